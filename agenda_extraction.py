@@ -0,0 +1,159 @@
+"""チャンクごとに議題を抽出し（map）、最後にまとめて番号を振り直す（reduce）ためのモジュール
+
+文字起こし全体を1回のリクエストで送る代わりに、チャンクの文字起こしが届くたびに
+そのチャンクの議題を抽出しておき、最後に議題の一覧だけを統合します。
+統合のリクエストには文字起こし本文を含まないので、会議が長くなっても大きくなりません。
+応答はスキーマを指定したJSONで受け取り、厳密に読み取ります。
+"""
+import json
+import re
+
+# create_excelが想定している議題の番号（最大20個）
+CIRCLED_NUMBERS = '①②③④⑤⑥⑦⑧⑨⑩⑪⑫⑬⑭⑮⑯⑰⑱⑲⑳'
+MAX_TOPICS = len(CIRCLED_NUMBERS)
+
+_TOPIC_LINE = re.compile(r'^[*\s]*議題\s*[0-9０-９①-⑳]*\s*[:：]\s*(.*)$')
+_SUMMARY_LINE = re.compile(r'^[*\s]*(?:議題\s*[0-9０-９①-⑳]*\s*の)?要約\s*[:：]\s*(.*)$')
+
+
+# 抽出結果のJSONのスキーマ（generate_contentのresponse_schemaに渡します）
+AGENDA_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'topics': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'title': {'type': 'string'},
+                    'summary': {'type': 'string'},
+                },
+                'required': ['title', 'summary'],
+            },
+        },
+    },
+    'required': ['topics'],
+}
+EXTRACTION_CONFIG = {'response_mime_type': 'application/json', 'response_schema': AGENDA_SCHEMA}
+
+# 会議（またはその一部）の文字起こしから議題を抽出するための指示
+EXTRACTION_INSTRUCTIONS = (
+    "会議の文字起こし（一部の場合もあります）から、話し合われた議題と要約を話された順に抽出してください。"
+    "インタビューなど議事録形式でない文章でも、話題のまとまりを議題とします。"
+    "要約は簡潔かつ具体的に。titleとsummaryに番号や記号は付けないでください。"
+)
+
+# 区間ごとの議題を統合するための指示
+MERGE_INSTRUCTIONS = (
+    "以下は、会議を区間に分けて抽出した議題の一覧（JSON、区間は話された順）です。"
+    "区間をまたいで続く議題や重複する議題は1つにまとめ、要約も統合してください。"
+    f"話された順に最大{MAX_TOPICS}個にしてください。"
+)
+
+
+def create_chunk_extraction_prompt(text):
+    """1つのチャンクの文字起こしから議題を抽出するための指示を作る関数"""
+    return f"{EXTRACTION_INSTRUCTIONS}\n\n{text}"
+
+
+def merge_listing(partials):
+    """区間ごとの議題を、統合の指示に添えるJSONにする関数"""
+    return json.dumps(
+        [[{'title': topic, 'summary': summary} for topic, summary in items] for items in partials],
+        ensure_ascii=False, separators=(',', ':'),
+    )
+
+
+def create_merge_prompt(partials):
+    """区間ごとの議題の一覧を1つにまとめるための指示を作る関数"""
+    return f"{MERGE_INSTRUCTIONS}\n\n{merge_listing(partials)}"
+
+
+def create_repair_prompt(reply, error):
+    """スキーマに合わない応答を直してもらうための指示を作る関数（本文は送り直しません）"""
+    return (
+        f"次の出力はJSONのスキーマに合っていません（{error}）。"
+        f"内容を変えずに、スキーマに合うJSONだけを出力してください。\n\n{reply}"
+    )
+
+
+def parse_agenda_json(reply):
+    """抽出結果のJSONを厳密に読み取り、(議題, 要約) のリストを返す関数
+
+    スキーマに合わない場合はValueErrorを送出します。
+    """
+    try:
+        data = json.loads(reply)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"JSONとして読み取れません: {e}") from e
+    if not isinstance(data, dict) or not isinstance(data.get('topics'), list):
+        raise ValueError("topicsの配列がありません")
+    items = []
+    for position, topic in enumerate(data['topics']):
+        if not isinstance(topic, dict):
+            raise ValueError(f"topics[{position}]がオブジェクトではありません")
+        title = topic.get('title')
+        summary = topic.get('summary')
+        if not isinstance(title, str) or not isinstance(summary, str):
+            raise ValueError(f"topics[{position}]のtitleまたはsummaryが文字列ではありません")
+        if title.strip() and summary.strip():
+            items.append((title.strip(), summary.strip()))
+    return items
+
+
+def parse_agenda_items(text):
+    """番号付きのテキスト形式の抽出結果から (議題, 要約) のリストを取り出す関数
+
+    「議題:」「議題①:」「要約:」「議題①の要約:」のどの書き方でも読み取ります。
+    以前の形式で保存された抽出結果を読むときに使います。
+    """
+    items = []
+    topic = None
+    summary = None
+    for line in (text or '').splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        summary_match = _SUMMARY_LINE.match(line)
+        if summary_match and topic is not None:
+            summary = summary_match.group(1).strip()
+            continue
+        topic_match = _TOPIC_LINE.match(line)
+        if topic_match:
+            if topic and summary:
+                items.append((topic, summary))
+            topic = topic_match.group(1).strip()
+            summary = None
+        elif summary is not None:
+            # 要約が複数行にわたっている場合はつなげます
+            summary += " " + line
+    if topic and summary:
+        items.append((topic, summary))
+    return items
+
+
+def _topic_key(topic):
+    return re.sub(r'[\s、。・「」『』（）()]', '', topic)
+
+
+def merge_agenda_items(partials):
+    """区間ごとの議題を、同じ名前の議題をまとめながら話された順に並べる関数（APIを使わない統合）"""
+    merged = {}
+    for items in partials:
+        for topic, summary in items:
+            key = _topic_key(topic)
+            if key in merged:
+                previous_topic, previous_summary = merged[key]
+                if summary not in previous_summary:
+                    merged[key] = (previous_topic, f"{previous_summary} {summary}")
+            else:
+                merged[key] = (topic, summary)
+    return list(merged.values())
+
+
+def format_agenda(items):
+    """議題のリストに①〜⑳の番号を振り、create_excelが読み取れる形式にする関数"""
+    blocks = []
+    for number, (topic, summary) in zip(CIRCLED_NUMBERS, items):
+        blocks.append(f"議題{number}: {topic}\n議題{number}の要約: {summary}")
+    return "\n\n".join(blocks)
@@ -0,0 +1,240 @@
+"""APIキーを空き容量に応じて貸し出すキープールのモジュール"""
+import threading
+import time
+from collections import deque
+
+from async_engine import LoopWaiters
+from retry_policy import RetryPolicy
+
+# レート制限を数える時間の幅（秒）
+RATE_WINDOW_SECONDS = 60.0
+# 音声1秒あたりのトークン数（Geminiの音声入力の目安）
+AUDIO_TOKENS_PER_SECOND = 32
+# 成功率の移動平均で直近の結果をどれだけ重視するか
+SUCCESS_RATE_WEIGHT = 0.2
+
+
+def estimate_audio_tokens(seconds, prompt=''):
+    """音声の長さとプロンプトから入力トークン数を見積もる関数"""
+    return int(seconds * AUDIO_TOKENS_PER_SECOND) + estimate_text_tokens(prompt)
+
+
+def estimate_text_tokens(text):
+    """テキストの入力トークン数を見積もる関数（日本語は1文字を1トークンと見なします）"""
+    return len(text or '')
+
+
+class KeyState:
+    """1つのAPIキーの利用状況"""
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.request_times = deque()  # 直近のリクエスト時刻
+        self.token_usage = deque()  # 直近の(時刻, トークン数)
+        self.cooldown_until = 0.0  # この時刻までは貸し出しません
+        self.consecutive_exhausted = 0  # 続けて利用制限に達した回数
+        self.disabled = False  # 無効なキーは以後貸し出しません
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.success_rate = 1.0
+
+    def prune(self, now):
+        """レート制限の時間幅より古い記録を捨てる"""
+        while self.request_times and now - self.request_times[0] >= RATE_WINDOW_SECONDS:
+            self.request_times.popleft()
+        while self.token_usage and now - self.token_usage[0][0] >= RATE_WINDOW_SECONDS:
+            self.token_usage.popleft()
+
+    def tokens_used(self):
+        return sum(tokens for _, tokens in self.token_usage)
+
+
+class ApiKeyPool:
+    """リクエスト数・トークン数の予算とクールダウンを考慮してAPIキーを貸し出すプール
+
+    acquire()で今いちばん余裕のあるキーを借り、release()で結果を報告して返します。
+    空いているキーがなければ、どれかが使えるようになるまで待ちます。
+    """
+
+    def __init__(self, api_keys, requests_per_minute=None, tokens_per_minute=None,
+                 max_in_flight=1, cooldown_seconds=60.0):
+        self.api_keys = list(dict.fromkeys(key for key in api_keys if key))
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_in_flight = max_in_flight
+        # 利用制限に続けて達するほどクールダウンを長くします（上限はcooldown_seconds）
+        self.cooldown_policy = RetryPolicy(base_delay=min(5.0, cooldown_seconds), max_delay=cooldown_seconds)
+        self._states = {key: KeyState(key) for key in self.api_keys}
+        self._condition = threading.Condition()
+        self._async_waiters = LoopWaiters()  # acquire_asyncで待っているコルーチン
+
+    def configure(self, requests_per_minute=None, tokens_per_minute=None, max_in_flight=1, cooldown_seconds=60.0):
+        """利用制限を変更する（借りているキーはそのまま、待っているリクエストは新しい制限で選び直します）"""
+        with self._condition:
+            self.requests_per_minute = requests_per_minute
+            self.tokens_per_minute = tokens_per_minute
+            self.max_in_flight = max_in_flight
+            self.cooldown_policy = RetryPolicy(base_delay=min(5.0, cooldown_seconds), max_delay=cooldown_seconds)
+            self._notify_all()
+
+    def _notify_all(self):
+        """キーを待っているスレッドとコルーチンを起こす（ロックを持って呼びます）"""
+        self._condition.notify_all()
+        self._async_waiters.notify_all()
+
+    def __len__(self):
+        return len(self.api_keys)
+
+    @property
+    def capacity(self):
+        """同時に貸し出せるキーの最大数"""
+        return len(self.api_keys) * self.max_in_flight
+
+    def _wait_time(self, state, now, tokens):
+        """キーが使えるようになるまでの秒数を返す（0なら今すぐ使える、Noneなら返却待ち）"""
+        if state.disabled:
+            return None
+        state.prune(now)
+        waits = [state.cooldown_until - now]
+        if self.requests_per_minute and len(state.request_times) >= self.requests_per_minute:
+            waits.append(state.request_times[0] + RATE_WINDOW_SECONDS - now)
+        if self.tokens_per_minute and state.token_usage:
+            if state.tokens_used() + tokens > self.tokens_per_minute:
+                waits.append(state.token_usage[0][0] + RATE_WINDOW_SECONDS - now)
+        wait = max(0.0, *waits)
+        if wait == 0 and state.in_flight >= self.max_in_flight:
+            return None
+        return wait
+
+    def _score(self, state):
+        """残りの予算と成功率から、キーの優先度を計算する"""
+        remaining = 1.0
+        if self.requests_per_minute:
+            remaining = min(remaining, 1 - len(state.request_times) / self.requests_per_minute)
+        if self.tokens_per_minute:
+            remaining = min(remaining, 1 - state.tokens_used() / self.tokens_per_minute)
+        # 同じ優先度なら、借りられている数・直近のリクエスト数が少ないキーを選びます
+        return (state.success_rate * max(remaining, 0.01), -state.in_flight, -len(state.request_times))
+
+    def acquire(self, estimated_tokens=0, exclude=(), timeout=None):
+        """使えるキーを1つ借りる（excludeのキーは他に空きがない場合だけ使います）
+
+        timeoutまでに借りられなければNoneを返します。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                if all(state.disabled for state in self._states.values()):
+                    return None
+                now = time.monotonic()
+                api_key, wait = self._try_acquire(now, estimated_tokens, exclude)
+                if api_key is not None:
+                    return api_key
+
+                # 次にどれかのキーが使えるようになるまで待ちます（返却されたら通知で起きます）
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._condition.wait(wait)
+
+    def _try_acquire(self, now, estimated_tokens, exclude, strict=False):
+        """今すぐ使えるキーがあれば借りる（ロックを持って呼びます）
+
+        (キー, None) か、借りられなければ (None, 次にどれかのキーが使えるようになるまでの秒数) を返します。
+        秒数がNoneなら、どれかのキーが返却されるまで待つ必要があります。
+        strictなら、excludeのキーは空いていても使いません。
+        """
+        if self.tokens_per_minute:
+            # 1回で予算を超えるリクエストでも、いつかは通るようにします
+            estimated_tokens = min(estimated_tokens, self.tokens_per_minute)
+        waits = {key: self._wait_time(state, now, estimated_tokens) for key, state in self._states.items()}
+        ready = [self._states[key] for key, wait in waits.items() if wait == 0]
+        preferred = [state for state in ready if state.api_key not in exclude]
+        if preferred or (ready and not strict):
+            state = max(preferred or ready, key=self._score)
+            state.request_times.append(now)
+            if estimated_tokens:
+                state.token_usage.append((now, estimated_tokens))
+            state.in_flight += 1
+            return state.api_key, None
+        pending = [wait for wait in waits.values() if wait]
+        return None, min(pending) if pending else None
+
+    async def acquire_async(self, estimated_tokens=0, exclude=(), timeout=None):
+        """acquire()の非同期版（イベントループを止めずに待ちます）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._condition:
+                if all(state.disabled for state in self._states.values()):
+                    return None
+                now = time.monotonic()
+                api_key, wait = self._try_acquire(now, estimated_tokens, exclude)
+                if api_key is not None:
+                    return api_key
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                # ロックを持ったまま登録するので、この後の返却の通知を取りこぼしません
+                waiter = self._async_waiters.add()
+            # 次にどれかのキーが使えるようになるか、返却の通知が届くまで待ちます
+            await self._async_waiters.wait(waiter, wait)
+
+    def try_acquire(self, estimated_tokens=0, exclude=()):
+        """今すぐ使える、exclude以外のキーを借りる（なければ待たずにNoneを返します）"""
+        with self._condition:
+            api_key, _ = self._try_acquire(time.monotonic(), estimated_tokens, exclude, strict=True)
+            return api_key
+
+    def cancel(self, api_key):
+        """借りたキーを、結果を記録せずに返す（リクエストをキャンセルしたとき）"""
+        with self._condition:
+            state = self._states.get(api_key)
+            if state is not None:
+                state.in_flight = max(0, state.in_flight - 1)
+            self._notify_all()
+
+    def release(self, api_key, success, exhausted=False, retry_after=None, disable=False):
+        """借りたキーを返し、結果（成功・失敗・利用制限・無効）を記録する"""
+        with self._condition:
+            state = self._states.get(api_key)
+            if state is None:
+                return
+            state.in_flight = max(0, state.in_flight - 1)
+            if success:
+                state.successes += 1
+            else:
+                state.failures += 1
+            state.success_rate += SUCCESS_RATE_WEIGHT * ((1.0 if success else 0.0) - state.success_rate)
+            if exhausted:
+                # 利用制限に達したキーはしばらく休ませ、その間は他のキーに回します
+                cooldown = self.cooldown_policy.delay(state.consecutive_exhausted, retry_after)
+                state.consecutive_exhausted += 1
+                state.cooldown_until = max(state.cooldown_until, time.monotonic() + cooldown)
+            elif success:
+                state.consecutive_exhausted = 0
+            if disable:
+                state.disabled = True
+            self._notify_all()
+
+    def snapshot(self):
+        """各キーの状態をログ出力用にまとめて返す"""
+        now = time.monotonic()
+        with self._condition:
+            return [
+                {
+                    'key': f"...{state.api_key[-4:]}",
+                    'in_flight': state.in_flight,
+                    'requests': len(state.request_times),
+                    'successes': state.successes,
+                    'failures': state.failures,
+                    'success_rate': round(state.success_rate, 2),
+                    'cooldown': max(0.0, round(state.cooldown_until - now, 1)),
+                    'disabled': state.disabled,
+                }
+                for state in self._states.values()
+            ]
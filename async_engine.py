@@ -0,0 +1,333 @@
+"""ジョブをasyncioのイベントループ1つで動かすためのエンジンのモジュール
+
+専用のスレッドでイベントループを1つだけ動かし、すべてのジョブをその上のタスクとして実行します。
+チャンクごとにスレッドを作らずに多くのジョブを同時に進められ、ジョブはいつでもキャンセルできます。
+TkBridgeを使うと、ジョブの進み具合や結果をTkのメインループ（root.after）で受け取れます。
+"""
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+
+# 実行中のジョブ（工程の報告に使います）
+current_job = contextvars.ContextVar('current_job', default=None)
+
+
+class StageTimeout(Exception):
+    """工程が制限時間内に終わらなかったことを表す例外"""
+
+    def __init__(self, stage, seconds):
+        super().__init__(f"{stage}の工程が{seconds:.0f}秒以内に終わりませんでした。")
+        self.stage = stage
+        self.seconds = seconds
+
+
+class JobHandle:
+    """エンジンで実行中のジョブ1件を外から扱うためのハンドル（どのスレッドからでも使えます）"""
+
+    def __init__(self, name, loop):
+        self.name = name
+        self.stage = None
+        self.detail = ''
+        self._loop = loop
+        self._task = None
+        self._coroutine = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.future = None  # concurrent.futures.Future
+
+    def cancel(self):
+        """ジョブをキャンセルする（実行中のリクエストやアップロードの待ちもその場で止めます）"""
+        if self.future is not None and not self.future.done():
+            logging.info(f"{self.name}のキャンセルを要求しました。")
+            self._loop.call_soon_threadsafe(self._cancel_task)
+
+    def _cancel_task(self):
+        if self._task is not None:
+            self._task.cancel()
+        else:
+            # まだ始まっていないジョブは、コルーチンごと破棄します
+            self.future.cancel()
+            self._coroutine.close()
+
+    def done(self):
+        return self.future.done()
+
+    def cancelled(self):
+        return self.future.cancelled()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def add_listener(self, listener):
+        """工程が変わるたびに listener(handle) を呼ぶ（ループのスレッドから呼ばれます）"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def report(self, stage, detail=''):
+        self.stage = stage
+        self.detail = detail
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                logging.error(f"進み具合の通知中にエラーが発生しました: {str(e)}")
+
+
+def report_stage(stage, detail=''):
+    """実行中のジョブの工程を報告する関数（ジョブの外で呼ばれたら何もしません）"""
+    handle = current_job.get()
+    if handle is not None:
+        handle.report(stage, detail)
+
+
+async def with_timeout(stage, awaitable, timeouts=None):
+    """工程ごとの制限時間をつけて待つ関数（時間切れならStageTimeoutを送出します）"""
+    report_stage(stage)
+    seconds = (timeouts or {}).get(stage)
+    if not seconds:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, seconds)
+    except asyncio.TimeoutError:
+        raise StageTimeout(stage, seconds) from None
+
+
+async def run_blocking(func, *args, on_cancel=None):
+    """ブロックする処理をスレッドで実行して待つ関数
+
+    待っている間にキャンセルされても、スレッドの処理そのものは止められません。
+    on_cancelを指定すると、処理が終わった後に on_cancel(結果) を呼んで後片付けをします。
+    """
+    future = asyncio.get_running_loop().run_in_executor(None, func, *args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        if on_cancel is not None:
+            def cleanup(finished):
+                if not finished.cancelled() and finished.exception() is None:
+                    try:
+                        on_cancel(finished.result())
+                    except Exception as e:
+                        logging.error(f"キャンセル後の後片付けに失敗しました: {str(e)}")
+            future.add_done_callback(cleanup)
+        raise
+
+
+async def gather_all(awaitables):
+    """すべてを並行して待つ関数（どれかが失敗したら、残りをキャンセルして終わるのを待ってから例外を送出します）"""
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LoopWaiters:
+    """他のスレッドからの通知で、イベントループで待っているコルーチンを起こすための待ち行列
+
+    add()とnotify_all()は、待つ条件を守っているロックを持って呼びます（通知を取りこぼさないように）。
+    """
+
+    def __init__(self):
+        self._waiters = []
+        self._lock = threading.Lock()
+
+    def add(self):
+        """待つためのfutureを登録して返す（イベントループの上で呼びます）"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._waiters.append((loop, future))
+        return future
+
+    def discard(self, future):
+        """待つのをやめたfutureの登録を外す"""
+        with self._lock:
+            self._waiters = [(loop, waiter) for loop, waiter in self._waiters if waiter is not future]
+
+    def notify_all(self):
+        """待っているコルーチンをすべて起こす（どのスレッドからでも呼べます）"""
+        with self._lock:
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # ループがもう閉じられています
+                pass
+
+    async def wait(self, future, timeout=None):
+        """add()で登録したfutureが通知されるか、timeout秒たつまで待つ"""
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.discard(future)
+
+
+class SharedSemaphore:
+    """スレッドとイベントループの両方から使える、同時実行数の枠
+
+    非同期で待つときは、枠が返されたときの通知で起きるので、空くのを繰り返し確かめることはありません。
+    """
+
+    def __init__(self, value):
+        self._value = value
+        self._condition = threading.Condition()
+        self._waiters = LoopWaiters()
+
+    def acquire(self):
+        with self._condition:
+            while self._value <= 0:
+                self._condition.wait()
+            self._value -= 1
+
+    async def acquire_async(self):
+        while True:
+            with self._condition:
+                if self._value > 0:
+                    self._value -= 1
+                    return
+                future = self._waiters.add()
+            await self._waiters.wait(future)
+
+    def release(self):
+        with self._condition:
+            self._value += 1
+            self._condition.notify()
+            self._waiters.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class PipelineEngine:
+    """専用スレッドのイベントループでジョブ（コルーチン）を実行するエンジン"""
+
+    def __init__(self, name='pipeline-loop'):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        """イベントループを返す（初めて使うときにスレッドを起動します）"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(self._loop)
+                    self._loop.call_soon(ready.set)
+                    self._loop.run_forever()
+                self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+                self._thread.start()
+                ready.wait()
+            return self._loop
+
+    def submit(self, coroutine, name=''):
+        """コルーチンをジョブとして実行し、JobHandleを返す"""
+        loop = self.loop
+        handle = JobHandle(name, loop)
+        handle._coroutine = coroutine
+
+        async def run_job():
+            handle._task = asyncio.current_task()
+            current_job.set(handle)
+            return await coroutine
+        handle.future = asyncio.run_coroutine_threadsafe(run_job(), loop)
+        return handle
+
+    def run(self, coroutine, name=''):
+        """コルーチンを実行して結果を待つ（ループのスレッド以外から呼びます）"""
+        if self._thread is not None and threading.current_thread() is self._thread:
+            raise RuntimeError("イベントループのスレッドから run() は呼べません。")
+        handle = self.submit(coroutine, name)
+        try:
+            return handle.result()
+        except KeyboardInterrupt:
+            handle.cancel()
+            raise
+
+    def close(self):
+        """実行中のジョブをキャンセルして、イベントループを止める"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+
+        async def shutdown():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            loop.stop()
+        asyncio.run_coroutine_threadsafe(shutdown(), loop)
+        thread.join(timeout=10)
+        if not loop.is_running():
+            loop.close()
+
+
+class TkBridge:
+    """イベントループ側からの通知を、Tkのメインループ（root.after）で実行するための橋渡し
+
+    Tkのウィジェットはメインスレッドからしか触れないので、通知はキューに入れておき、
+    root.after で一定間隔ごとに取り出して実行します。
+    """
+
+    def __init__(self, root, interval_ms=100):
+        self.root = root
+        self.interval_ms = interval_ms
+        self._queue = queue.Queue()
+        self._running = False
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.root.after(self.interval_ms, self._poll)
+
+    def stop(self):
+        self._running = False
+
+    def post(self, callback, *args):
+        """callback(*args) をTkのメインスレッドで実行するよう予約する（どのスレッドからでも呼べます）"""
+        self._queue.put((callback, args))
+
+    def _poll(self):
+        while True:
+            try:
+                callback, args = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                logging.exception(f"画面の更新中にエラーが発生しました: {str(e)}")
+        if self._running:
+            self.root.after(self.interval_ms, self._poll)
+
+    def watch(self, handle, on_done, on_update=None):
+        """ジョブの工程が変わったら on_update(handle) を、終わったら on_done(handle) をTkのスレッドで呼ぶ"""
+        if on_update is not None:
+            handle.add_listener(lambda h: self.post(on_update, h))
+        handle.future.add_done_callback(lambda _: self.post(on_done, handle))
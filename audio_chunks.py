@@ -0,0 +1,230 @@
+"""音声ファイルの分割計画（チャンクの開始・終了位置）を立て、ffmpegで切り出すモジュール"""
+import concurrent.futures
+import logging
+import math
+import os
+import subprocess
+import threading
+from dataclasses import dataclass
+
+# チャンク1つあたりの目標の長さ（秒）
+DEFAULT_CHUNK_SECONDS = 300
+# チャンク1つあたりの最大サイズ（バイト）。インラインで送れるリクエストの上限より小さくします
+DEFAULT_CHUNK_MAX_BYTES = 15 * 1024 * 1024
+# 隣り合うチャンクの重なり（チャンクの長さに対する割合）
+DEFAULT_OVERLAP_RATIO = 0.1
+# 重なりの上限（秒）。長いチャンクでも重複部分が増えすぎないようにします
+MAX_OVERLAP_SECONDS = 15
+
+
+@dataclass(frozen=True)
+class AudioChunk:
+    """元の音声ファイル内での1チャンクの位置"""
+    index: int
+    start: float
+    end: float
+    overlap: float  # 直前のチャンクと重なっている秒数
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+def split_evenly(duration, num_chunks, overlap_ratio=DEFAULT_OVERLAP_RATIO):
+    """音声の長さを指定された数のチャンクに均等に分ける関数"""
+    num_chunks = max(1, int(num_chunks))
+    part_duration = duration / num_chunks
+    overlap = min(part_duration * overlap_ratio, MAX_OVERLAP_SECONDS)
+
+    chunks = []
+    for i in range(num_chunks):
+        # 2つ目以降のチャンクは、境界の少し前から始めて前のチャンクと重ねます
+        start = max(0.0, i * part_duration - (overlap if i > 0 else 0.0))
+        end = duration if i == num_chunks - 1 else (i + 1) * part_duration
+        chunks.append(AudioChunk(i, start, end, overlap if i > 0 else 0.0))
+    return chunks
+
+
+def plan_chunks(duration, file_size, chunk_seconds=DEFAULT_CHUNK_SECONDS,
+                max_chunk_bytes=DEFAULT_CHUNK_MAX_BYTES, overlap_ratio=DEFAULT_OVERLAP_RATIO):
+    """チャンクの長さとサイズの上限から分割計画を立てる関数
+
+    分割数はAPIキーの数に関係なく、録音の長さとビットレートだけで決まります。
+    """
+    if duration <= 0:
+        return [AudioChunk(0, 0.0, 0.0, 0.0)]
+
+    target_seconds = target_chunk_seconds(duration, file_size, chunk_seconds, max_chunk_bytes, overlap_ratio)
+    num_chunks = max(1, math.ceil(duration / target_seconds))
+    return split_evenly(duration, num_chunks, overlap_ratio)
+
+
+def target_chunk_seconds(duration, file_size, chunk_seconds=DEFAULT_CHUNK_SECONDS,
+                         max_chunk_bytes=DEFAULT_CHUNK_MAX_BYTES, overlap_ratio=DEFAULT_OVERLAP_RATIO):
+    """チャンクの長さとサイズの上限から、1チャンクあたりの目標の長さ（秒）を求める関数"""
+    target_seconds = float(chunk_seconds)
+    if duration > 0 and file_size and max_chunk_bytes:
+        # 平均ビットレートから、サイズ上限に収まる長さを求めます（重なりの分も見込みます）
+        bytes_per_second = file_size / duration
+        target_seconds = min(target_seconds, max_chunk_bytes / bytes_per_second / (1 + overlap_ratio))
+    return target_seconds
+
+
+# ffmpeg 1プロセスあたりの出力数の上限（コマンドラインが長くなりすぎないようにします）
+MAX_OUTPUTS_PER_PROCESS = 32
+# 同時に動かすffmpegプロセスの上限
+ffmpeg_slots = threading.BoundedSemaphore(max(2, (os.cpu_count() or 2) // 2))
+
+# 音声をそのまま送るときのコーデック・フォーマット・拡張子・MIMEタイプ（元の拡張子ごと）
+# M4AはMP4コンテナのままだと受け付けられないことがあるので、AACのストリームだけを取り出します
+PIPE_FORMATS = {
+    '.mp3': (['-c', 'copy'], 'mp3', '.mp3', 'audio/mp3'),
+    '.m4a': (['-c', 'copy'], 'adts', '.aac', 'audio/aac'),
+    '.wav': (['-c:a', 'pcm_s16le'], 'wav', '.wav', 'audio/wav'),
+}
+
+# 拡張子ごとのMIMEタイプ
+MIME_TYPES = {
+    '.mp3': 'audio/mp3',
+    '.aac': 'audio/aac',
+    '.m4a': 'audio/aac',
+    '.wav': 'audio/wav',
+    '.flac': 'audio/flac',
+    '.ogg': 'audio/ogg',
+}
+
+# 音声認識向けの既定値。Geminiは音声を16kHz・モノラル相当に落として扱うので、それ以上は送っても使われません
+DEFAULT_SPEECH_SAMPLE_RATE = 16000
+DEFAULT_SPEECH_BITRATE = '32k'
+
+
+def mime_type_for(path):
+    """ファイル名の拡張子からMIMEタイプを返す関数"""
+    return MIME_TYPES.get(os.path.splitext(str(path))[1].lower(), 'audio/mp3')
+
+
+@dataclass(frozen=True)
+class AudioEncoding:
+    """チャンクを書き出すときのエンコードの指定"""
+    name: str
+    codec_args: tuple  # ffmpegに渡すコーデック・チャンネル数・サンプリングレートの引数
+    format: str  # パイプで出力するときのフォーマット
+    extension: str
+    mime_type: str
+    bytes_per_second: float = 0  # 書き出した後のおおよそのバイト数（わからなければ0）
+
+
+def _bitrate_bytes(bitrate):
+    """'32k' のようなビットレートの指定を1秒あたりのバイト数にする関数"""
+    text = str(bitrate).lower()
+    value = float(text[:-1]) * 1000 if text.endswith('k') else float(text)
+    return value / 8
+
+
+def encoding_for(source_path, profile='speech', sample_rate=DEFAULT_SPEECH_SAMPLE_RATE, bitrate=DEFAULT_SPEECH_BITRATE):
+    """エンコードの方針（profile）に合わせたチャンクの書き出し方を返す関数
+
+    speech   : モノラルに変換し、音声認識向けのサンプリングレートでMP3にします（既定）
+    lossless : モノラルに変換し、音声認識向けのサンプリングレートでFLACにします
+    original : 元の形式のまま切り出します（WAVはPCMのまま、MP3/M4Aは再エンコードしません）
+    """
+    downmix = ('-ac', '1', '-ar', str(sample_rate))
+    if profile == 'speech':
+        return AudioEncoding('speech', downmix + ('-c:a', 'libmp3lame', '-b:a', str(bitrate)),
+                             'mp3', '.mp3', 'audio/mp3', _bitrate_bytes(bitrate))
+    if profile == 'lossless':
+        # 16bitモノラルのFLACはおおよそPCMの6割程度になります
+        return AudioEncoding('lossless', downmix + ('-c:a', 'flac'),
+                             'flac', '.flac', 'audio/flac', sample_rate * 2 * 0.6)
+    extension = os.path.splitext(source_path)[1].lower()
+    codec_args, pipe_format, part_extension, mime_type = PIPE_FORMATS.get(extension, PIPE_FORMATS['.mp3'])
+    return AudioEncoding('original', tuple(codec_args), pipe_format, part_extension, mime_type)
+
+
+def part_name(source_path, chunk, encoding=None):
+    """分割したチャンクのファイル名を返す関数"""
+    extension = encoding.extension if encoding else os.path.splitext(source_path)[1].lower()
+    return f"{os.path.basename(source_path)}_part{chunk.index + 1}{extension}"
+
+
+def build_segment_command(ffmpeg_path, source_path, chunks, output_paths, encoding=None):
+    """1回のデコードで複数のチャンクを書き出すffmpegコマンドを作る関数"""
+    # 入力側の-ssでグループの先頭まで一気にシークし、出力ごとに相対位置で切り出します
+    group_start = chunks[0].start
+    encoding = encoding or encoding_for(source_path, 'original')
+    codec_args = list(encoding.codec_args)
+    command = [ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+               '-ss', f'{group_start:.3f}', '-i', source_path]
+    for chunk, output_path in zip(chunks, output_paths):
+        command += ['-map', '0:a:0',
+                    '-ss', f'{chunk.start - group_start:.3f}',
+                    '-t', f'{chunk.duration:.3f}',
+                    *codec_args, output_path]
+    return command
+
+
+def segment_to_files(ffmpeg_path, source_path, chunks, output_dir, max_workers=2, encoding=None):
+    """音声ファイルを1パスで読みながら、すべてのチャンクをファイルに書き出す関数"""
+    encoding = encoding or encoding_for(source_path, 'original')
+    output_paths = [os.path.join(output_dir, part_name(source_path, chunk, encoding)) for chunk in chunks]
+    # 再エンコードする場合は1プロセスではCPUが足りないので、ワーカーの数に合わせてグループを分けます
+    group_size = MAX_OUTPUTS_PER_PROCESS
+    if encoding.name != 'original':
+        group_size = min(group_size, max(1, math.ceil(len(chunks) / max_workers)))
+    groups = [range(i, min(i + group_size, len(chunks)))
+              for i in range(0, len(chunks), group_size)]
+
+    def run_group(group):
+        command = build_segment_command(ffmpeg_path, source_path,
+                                        [chunks[i] for i in group], [output_paths[i] for i in group], encoding)
+        with ffmpeg_slots:
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            logging.error(f"FFmpegエラー: {result.stderr}")
+
+    # チャンク数が多い場合だけ、いくつかのグループに分けて並列に処理します
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(run_group, groups))
+    return output_paths
+
+
+class PipedChunk:
+    """一時ファイルを作らず、読み出すときにffmpegの標準出力からバイト列を得るチャンク"""
+
+    def __init__(self, ffmpeg_path, source_path, chunk, size_hint=0, encoding=None):
+        self.encoding = encoding or encoding_for(source_path, 'original')
+        self.codec_args = list(self.encoding.codec_args)
+        self.format = self.encoding.format
+        self.mime_type = self.encoding.mime_type
+        self.ffmpeg_path = ffmpeg_path
+        self.source_path = source_path
+        self.chunk = chunk
+        self.name = part_name(source_path, chunk, self.encoding)
+        self.size_hint = size_hint  # 読み込む前に見積もったバイト数
+
+    def __str__(self):
+        return self.name
+
+    def read(self):
+        """チャンクの音声データをバイト列で返す"""
+        command = [self.ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+                   '-ss', f'{self.chunk.start:.3f}', '-i', self.source_path,
+                   '-t', f'{self.chunk.duration:.3f}', '-map', '0:a:0',
+                   *self.codec_args, '-f', self.format, 'pipe:1']
+        with ffmpeg_slots:
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(f"FFmpegエラー: {result.stderr.decode('utf-8', errors='replace')}")
+        return result.stdout
+
+
+def pipe_chunks(ffmpeg_path, source_path, chunks, encoding=None):
+    """チャンクごとにパイプで読み出すオブジェクトの一覧を返す関数"""
+    # 書き出し後のビットレート（わからなければ元のファイルの平均）から、各チャンクのサイズを見積もっておきます
+    encoding = encoding or encoding_for(source_path, 'original')
+    bytes_per_second = encoding.bytes_per_second
+    if not bytes_per_second:
+        total_duration = max((chunk.end for chunk in chunks), default=0)
+        bytes_per_second = os.path.getsize(source_path) / total_duration if total_duration else 0
+    return [PipedChunk(ffmpeg_path, source_path, chunk, int(chunk.duration * bytes_per_second), encoding)
+            for chunk in chunks]
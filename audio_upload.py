@@ -0,0 +1,200 @@
+"""チャンクの音声データを1度だけ読み込み、メモリ使用量の上限を守ってアップロードするモジュール"""
+import hashlib
+import io
+import logging
+import os
+import threading
+
+from async_engine import LoopWaiters
+from audio_chunks import mime_type_for
+
+# リクエストに直接埋め込むチャンクの上限。これより大きいチャンクはファイルとしてアップロードします
+DEFAULT_INLINE_MAX_BYTES = 8 * 1024 * 1024
+# 同時にメモリへ読み込んでおく音声データの合計の上限
+DEFAULT_MAX_INFLIGHT_BYTES = 200 * 1024 * 1024
+# ハッシュを計算するときにファイルを読む単位
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+class ByteBudget:
+    """読み込み中の音声データの合計バイト数を上限以下に抑えるための予約枠
+
+    スレッドからはacquire()で、イベントループからはacquire_async()で予約します。
+    非同期で待つときはスレッドを止めず、枠が返されたときの通知で起きます。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_INFLIGHT_BYTES):
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self._condition = threading.Condition()
+        self._waiters = LoopWaiters()  # acquire_asyncで待っているコルーチン
+
+    def _fits(self, size):
+        # 1件だけで上限を超える場合も、他に使っているものがなければ通します
+        return self.in_use == 0 or self.in_use + size <= self.max_bytes
+
+    def acquire(self, size):
+        """sizeバイト分の枠を予約する（空きがなければ待ちます）"""
+        with self._condition:
+            while not self._fits(size):
+                self._condition.wait()
+            self.in_use += size
+
+    async def acquire_async(self, size):
+        """acquire()の非同期版（イベントループを止めずに待ち、キャンセルされても枠は残りません）"""
+        while True:
+            with self._condition:
+                if self._fits(size):
+                    self.in_use += size
+                    return
+                # ロックを持ったまま登録するので、この後の返却の通知を取りこぼしません
+                waiter = self._waiters.add()
+            await self._waiters.wait(waiter)
+
+    def charge(self, size):
+        """読み込み済みのデータの分を、待たずに枠に加える"""
+        with self._condition:
+            self.in_use += size
+
+    def release(self, size):
+        with self._condition:
+            self.in_use = max(0, self.in_use - size)
+            self._condition.notify_all()
+            self._waiters.notify_all()
+
+    def resize(self, max_bytes):
+        """上限を変更する（上げたときは待っている予約を起こします）"""
+        with self._condition:
+            self.max_bytes = max_bytes
+            self._condition.notify_all()
+            self._waiters.notify_all()
+
+
+class AudioPayload:
+    """1チャンク分の音声データ
+
+    with文の中で1度だけ読み込み、リトライや別のAPIキーでも同じデータを使い回します。
+    大きいチャンクはメモリに読み込まず、APIキーごとに1度だけファイルとしてアップロードします。
+    """
+
+    def __init__(self, source, byte_budget=None, inline_max_bytes=DEFAULT_INLINE_MAX_BYTES):
+        self.source = source
+        self.name = str(source)
+        # パイプのチャンクは自分のMIMEタイプを持ち、ファイルは拡張子から決めます
+        self.mime_type = getattr(source, 'mime_type', None) or mime_type_for(self.name)
+        self.byte_budget = byte_budget
+        self.inline_max_bytes = inline_max_bytes
+        self.data = None
+        self.size = None
+        self._reserved = 0
+        self._digest = None
+        self._uploads = {}  # APIキー -> アップロード済みのファイル
+        self._upload_lock = threading.Lock()
+
+    @property
+    def is_file(self):
+        return not hasattr(self.source, 'read')
+
+    def _planned_size(self):
+        """読み込む前に予約するバイト数を返す"""
+        if self.is_file:
+            self.size = os.path.getsize(self.source)
+            # 小さいチャンクだけメモリに読み込み、リクエストに直接埋め込みます
+            return self.size if self.size <= self.inline_max_bytes else 0
+        # パイプで受け取るチャンクは、見積もりサイズで枠を予約してから読み込みます
+        return getattr(self.source, 'size_hint', 0)
+
+    def reserve(self):
+        """読み込む分の枠を予約する（空きがなければ待ちます）"""
+        size = self._planned_size()
+        if self.byte_budget and size:
+            self.byte_budget.acquire(size)
+            self._reserved += size
+
+    async def reserve_async(self):
+        """reserve()の非同期版（待っている間もスレッドを使いません）"""
+        size = self._planned_size()
+        if self.byte_budget and size:
+            await self.byte_budget.acquire_async(size)
+            self._reserved += size
+
+    def read(self):
+        """予約した枠で音声データを読み込む（失敗したら予約した枠を返します）"""
+        try:
+            if self.is_file:
+                if self.size <= self.inline_max_bytes:
+                    with open(self.source, 'rb') as f:
+                        self.data = f.read()
+            else:
+                self.data = self.source.read()
+                self.size = len(self.data)
+                if self.byte_budget and self.size > self._reserved:
+                    # 見積もりを超えた分は、読み込み済みなので待たずに加えます
+                    # （枠を持ったまま他の予約の返却を待ち合わないように）
+                    self.byte_budget.charge(self.size - self._reserved)
+                    self._reserved = self.size
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __enter__(self):
+        self.reserve()
+        return self.read()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.data = None
+        if self.byte_budget and self._reserved:
+            self.byte_budget.release(self._reserved)
+        self._reserved = 0
+        return False
+
+    def digest(self):
+        """音声データのSHA-256（キャッシュのキーに使います）"""
+        if self._digest is None:
+            digest = hashlib.sha256()
+            if self.data is not None:
+                digest.update(self.data)
+            else:
+                # メモリに読み込んでいないファイルは少しずつ読んで計算します
+                with open(self.source, 'rb') as f:
+                    for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+                        digest.update(block)
+            self._digest = digest.digest()
+        return self._digest
+
+    @property
+    def inline(self):
+        return self.data is not None and self.size <= self.inline_max_bytes
+
+    def content(self, api_key, uploader):
+        """generate_contentに渡す音声パートを返す
+
+        大きいチャンクは uploader(api_key, ファイルまたはBytesIO, MIMEタイプ, 表示名) で
+        アップロードし、同じキーでのリトライではアップロード済みのファイルを使い回します。
+        """
+        if self.inline:
+            return {"mime_type": self.mime_type, "data": self.data}
+        with self._upload_lock:
+            if api_key not in self._uploads:
+                source = self.source if self.is_file else io.BytesIO(self.data)
+                self._uploads[api_key] = uploader(api_key, source, self.mime_type, os.path.basename(self.name))
+            return self._uploads[api_key]
+
+    async def content_async(self, api_key, uploader):
+        """content()の非同期版（uploaderはコルーチン関数です）"""
+        if self.inline:
+            return {"mime_type": self.mime_type, "data": self.data}
+        if api_key not in self._uploads:
+            source = self.source if self.is_file else io.BytesIO(self.data)
+            self._uploads[api_key] = await uploader(api_key, source, self.mime_type, os.path.basename(self.name))
+        return self._uploads[api_key]
+
+    def delete_uploads(self, deleter):
+        """アップロードしたファイルを deleter(api_key, ファイル) で削除する"""
+        for api_key, uploaded in self._uploads.items():
+            try:
+                deleter(api_key, uploaded)
+            except Exception as e:
+                logging.error(f"アップロードしたファイルの削除に失敗しました: {self.name} - {str(e)}")
+        self._uploads.clear()
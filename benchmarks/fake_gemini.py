@@ -0,0 +1,235 @@
+"""ベンチマーク用の、ネットワークを使わないGeminiの代役
+
+GeminiClientPoolはそのまま使い、その下のサービスクライアント（接続）だけを代役に差し替えます。
+リクエストの組み立て・応答の読み取り・キーごとのクライアントの使い回しは本物のコードのまま計測できます。
+代役は設定した分布に従って応答を遅らせ、一定の割合で利用制限（429）のエラーを返します。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+import google.ai.generativelanguage as glm
+import google.api_core.exceptions
+
+from agenda_extraction import MERGE_INSTRUCTIONS
+from gemini_clients import GeminiClientPool
+
+# 文字起こしの代わりに返す文章の材料
+CANNED_SENTENCES = (
+    "本日の議題は来期の予算案についてです。",
+    "営業部から第3四半期の売上報告があります。",
+    "新しい勤怠管理システムの導入時期を検討します。",
+    "前回の議事録の確認から始めたいと思います。",
+    "採用計画について人事部から説明をお願いします。",
+    "顧客からの問い合わせ件数は先月より増加しています。",
+    "次回の会議までに見積もりを取り直すことになりました。",
+    "広報の施策は来月から段階的に実施します。",
+)
+
+
+class LatencyModel:
+    """応答の遅延（秒）を決める分布
+
+    kindは 'fixed'（常にmedian）、'uniform'（0〜2×median）、'lognormal'（中央値median・ばらつきsigma）です。
+    scaleを小さくすると、分布の形を保ったまま全体を短くできます。
+    """
+
+    def __init__(self, kind='lognormal', median=1.0, sigma=0.5, scale=1.0, seed=None):
+        self.kind = kind
+        self.median = median
+        self.sigma = sigma
+        self.scale = scale
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            if self.kind == 'fixed':
+                value = self.median
+            elif self.kind == 'uniform':
+                value = self._random.uniform(0, 2 * self.median)
+            else:
+                value = self._random.lognormvariate(0, self.sigma) * self.median
+        return value * self.scale
+
+
+def fake_response(text, prompt_tokens, output_tokens):
+    """generate_contentの応答（protos.GenerateContentResponse）を作る関数"""
+    return glm.GenerateContentResponse(
+        candidates=[glm.Candidate(
+            content=glm.Content(role='model', parts=[glm.Part(text=text)]),
+            finish_reason=glm.Candidate.FinishReason.STOP,
+        )],
+        usage_metadata=glm.GenerateContentResponse.UsageMetadata(
+            prompt_token_count=prompt_tokens, candidates_token_count=output_tokens,
+        ),
+    )
+
+
+class FakeGenerativeClient:
+    """1つのAPIキーに対応するGenerativeServiceClientの代役"""
+
+    def __init__(self, backend, api_key):
+        self.backend = backend
+        self.api_key = api_key
+
+    def generate_content(self, request, **kwargs):
+        return self.backend.generate(self.api_key, request)
+
+
+class FakeAsyncGenerativeClient(FakeGenerativeClient):
+    """GenerativeServiceAsyncClientの代役"""
+
+    async def generate_content(self, request, **kwargs):
+        return await asyncio.to_thread(self.backend.generate, self.api_key, request)
+
+
+class FakeFileClient:
+    """1つのAPIキーに対応するFileServiceClientの代役"""
+
+    def __init__(self, backend, api_key):
+        self.backend = backend
+        self.api_key = api_key
+
+    def create_file(self, path, mime_type=None, name=None, display_name=None, resumable=True):
+        return self.backend.upload_file(path, mime_type)
+
+    def get_file(self, name):
+        return self.backend.get_file(name)
+
+    def delete_file(self, name):
+        self.backend.delete_file(name)
+
+
+class FakeServiceClients:
+    """gemini_clients.ServiceClientsの代役（キーごとに代役のクライアントを作ります）"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def generative(self, api_key):
+        return FakeGenerativeClient(self.backend, api_key)
+
+    def generative_async(self, api_key):
+        return FakeAsyncGenerativeClient(self.backend, api_key)
+
+    def files(self, api_key):
+        return FakeFileClient(self.backend, api_key)
+
+
+class FakeGeminiBackend:
+    """GeminiClientPoolの下に差し込む、ネットワークを使わないバックエンド
+
+    error_rateの割合で429を返し、retry_afterを指定すれば再試行までの待ち時間をメッセージに含めます。
+    文字起こしは音声データのハッシュから決まる定型文を、抽出は議題のJSONを返します。
+    遅延の分布は文字起こし（latency）と議題の抽出・統合（extract_latency）で分けられます。
+    """
+
+    def __init__(self, latency=None, error_rate=0.0, retry_after=None, transcript_chars=1500,
+                 topics_per_chunk=3, upload_latency=None, extract_latency=None, seed=0):
+        self.latency = latency or LatencyModel('fixed', 0.0)
+        self.extract_latency = extract_latency or self.latency
+        self.upload_latency = upload_latency or LatencyModel('fixed', 0.0)
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.transcript_chars = transcript_chars
+        self.topics_per_chunk = topics_per_chunk
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._files = {}  # 名前 -> protos.File
+        self.stats = {'requests': 0, 'rate_limited': 0, 'uploads': 0, 'uploaded_bytes': 0, 'deletes': 0}
+        self.pool = None  # install()で差し込んだGeminiClientPool
+
+    def upload_file(self, source, mime_type):
+        size = source.getbuffer().nbytes if hasattr(source, 'getbuffer') else os.path.getsize(source)
+        time.sleep(self.upload_latency.sample())
+        with self._lock:
+            self.stats['uploads'] += 1
+            self.stats['uploaded_bytes'] += size
+            name = f"files/fake-{self.stats['uploads']}"
+            self._files[name] = glm.File(name=name, uri=f"https://fake.invalid/{name}", mime_type=mime_type,
+                                         size_bytes=size, state=glm.File.State.ACTIVE)
+            return self._files[name]
+
+    def get_file(self, name):
+        return self._files[name]
+
+    def delete_file(self, name):
+        with self._lock:
+            self._files.pop(name, None)
+            self.stats['deletes'] += 1
+
+    def _maybe_rate_limit(self):
+        with self._lock:
+            self.stats['requests'] += 1
+            limited = self._random.random() < self.error_rate
+            if limited:
+                self.stats['rate_limited'] += 1
+        if limited:
+            message = "Resource has been exhausted (e.g. check quota)."
+            if self.retry_after is not None:
+                message += f" Please retry in {self.retry_after}s"
+            raise google.api_core.exceptions.ResourceExhausted(message)
+
+    def generate(self, api_key, request):
+        """GenerateContentRequestに応答する"""
+        parts = [part for content in request.contents for part in content.parts]
+        audio = next((part for part in parts if part.inline_data.data or part.file_data.file_uri), None)
+        # 音声を含むリクエストは文字起こし、それ以外は議題の抽出・統合として扱います
+        time.sleep((self.latency if audio is not None else self.extract_latency).sample())
+        self._maybe_rate_limit()
+        if audio is not None:
+            return self._transcribe(audio)
+        prompt = "".join(part.text for part in parts)
+        if prompt.startswith(MERGE_INSTRUCTIONS):
+            return self._merge(prompt)
+        return self._extract(prompt)
+
+    def _transcribe(self, audio):
+        if audio.inline_data.data:
+            seed_bytes = hashlib.sha256(audio.inline_data.data).digest()
+            prompt_tokens = len(audio.inline_data.data) // 1000
+        else:
+            uri = audio.file_data.file_uri
+            seed_bytes = hashlib.sha256(uri.encode('utf-8')).digest()
+            with self._lock:
+                uploaded = next((f for f in self._files.values() if f.uri == uri), None)
+            prompt_tokens = (uploaded.size_bytes if uploaded else 0) // 1000
+        chooser = random.Random(seed_bytes)
+        sentences = []
+        length = 0
+        while length < self.transcript_chars:
+            sentence = chooser.choice(CANNED_SENTENCES)
+            sentences.append(sentence)
+            length += len(sentence)
+        text = "".join(sentences)
+        return fake_response(text, prompt_tokens, len(text))
+
+    def _extract(self, prompt):
+        chooser = random.Random(hashlib.sha256(prompt.encode('utf-8')).digest())
+        topics = [
+            {'title': chooser.choice(CANNED_SENTENCES)[:12], 'summary': chooser.choice(CANNED_SENTENCES)}
+            for _ in range(self.topics_per_chunk)
+        ]
+        text = json.dumps({'topics': topics}, ensure_ascii=False)
+        return fake_response(text, len(prompt), len(text))
+
+    def _merge(self, prompt):
+        partials = json.loads(prompt[len(MERGE_INSTRUCTIONS):].strip())
+        topics = [topic for items in partials for topic in items][:20]
+        text = json.dumps({'topics': topics}, ensure_ascii=False)
+        return fake_response(text, len(prompt), len(text))
+
+    def install(self, module):
+        """moduleのgemini_clientsを、このバックエンドにつないだGeminiClientPoolに差し替える（元に戻す関数を返します）"""
+        previous = module.gemini_clients
+        self.pool = GeminiClientPool(module.MODEL_NAME, service_clients=FakeServiceClients(self))
+        module.gemini_clients = self.pool
+
+        def restore():
+            module.gemini_clients = previous
+        return restore
@@ -0,0 +1,283 @@
+"""ネットワークを使わずに処理全体の速さを測るベンチマーク
+
+Geminiを FakeGeminiBackend に差し替え、合成音声で process_audio_file と create_minutes を実行して、
+全体の経過時間・工程ごとの時間・メモリの最大使用量・スループットを表示します。
+設定やジョブの記録は一時的な作業フォルダに作るので、普段使っている ~/.my_app には触れません。
+
+使い方（リポジトリの直下で）:
+    python benchmarks/run_benchmarks.py --durations 10,30 --formats mp3,wav --time-scale 0.05
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+try:
+    import resource
+except ImportError:  # Windowsにはありません
+    resource = None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="議事録作成処理のオフラインベンチマーク")
+    parser.add_argument('--durations', default='10,30,60', help="合成音声の長さ（分、カンマ区切り）")
+    parser.add_argument('--formats', default='mp3,wav', help="合成音声の形式（mp3・wav・m4a、カンマ区切り）")
+    parser.add_argument('--copies', type=int, default=1, help="同じ音声を何件まとめて処理するか")
+    parser.add_argument('--jobs', type=int, default=1, help="同時に処理するファイル数")
+    parser.add_argument('--keys', type=int, default=10, help="APIキーの数")
+    parser.add_argument('--rpm', type=int, default=0, help="キーごとの1分あたりのリクエスト数の上限（0なら無制限）")
+    parser.add_argument('--tpm', type=int, default=0, help="キーごとの1分あたりのトークン数の上限（0なら無制限）")
+    parser.add_argument('--latency', default='lognormal', choices=['fixed', 'uniform', 'lognormal'], help="応答の遅延の分布")
+    parser.add_argument('--latency-median', type=float, default=20.0, help="文字起こしの応答の遅延の中央値（秒）")
+    parser.add_argument('--extract-latency-median', type=float, default=5.0, help="議題抽出の応答の遅延の中央値（秒）")
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help="lognormalのばらつき")
+    parser.add_argument('--time-scale', type=float, default=0.01, help="遅延・待ち時間に掛ける倍率（小さいほど短時間で終わります）")
+    parser.add_argument('--error-rate', type=float, default=0.05, help="429を返す割合")
+    parser.add_argument('--retry-after', type=float, default=10.0, help="429のメッセージに含める再試行までの秒数")
+    parser.add_argument('--segment-mode', default='files', choices=['files', 'pipe'], help="チャンクの切り出し方")
+    parser.add_argument('--audio-encoding', default='speech', choices=['speech', 'lossless', 'original'],
+                        help="チャンクを送るときのエンコード")
+    parser.add_argument('--hedge-ratio', type=float, default=0.1,
+                        help="応答の遅いリクエストを別のキーでも送る割合の上限（0なら送りません）")
+    parser.add_argument('--chunk-seconds', type=int, default=300, help="チャンクの長さ（秒）")
+    parser.add_argument('--minutes-runs', type=int, default=5, help="create_minutesを繰り返す回数")
+    parser.add_argument('--sample-rate', type=int, default=44100, help="合成音声のサンプリングレート")
+    parser.add_argument('--workdir', help="作業フォルダ（指定すると合成音声を次回も使い回します）")
+    parser.add_argument('--json', help="結果をJSONで書き出すファイル")
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def prepare_workspace(args, workdir):
+    """ホームフォルダを作業フォルダに切り替え、ベンチマーク用の設定を書き出す"""
+    home = os.path.join(workdir, 'home')
+    os.makedirs(os.path.join(home, 'Documents'), exist_ok=True)
+    os.makedirs(os.path.join(home, '.my_app'), exist_ok=True)
+    os.environ['HOME'] = home
+    os.environ['USERPROFILE'] = home
+    output_directory = os.path.join(workdir, 'output')
+    os.makedirs(output_directory, exist_ok=True)
+
+    with open(os.path.join(REPO_DIR, 'settings.json'), 'r', encoding='utf-8') as f:
+        settings = json.load(f)
+    settings.update({
+        'output_directory': output_directory,
+        'chunk_seconds': args.chunk_seconds,
+        'segment_mode': args.segment_mode,
+        'audio_encoding': args.audio_encoding,
+        'hedge_enabled': args.hedge_ratio > 0,
+        'hedge_max_extra_ratio': args.hedge_ratio,
+        'key_requests_per_minute': args.rpm,
+        'key_tokens_per_minute': args.tpm,
+        'key_cooldown_seconds': 60 * args.time_scale,
+        'cache_enabled': False,
+        'gemini_api_keys': {f'GEMINI_API_KEY_{i}': f'bench-key-{i:04d}' for i in range(1, args.keys + 1)},
+    })
+    with open(os.path.join(home, '.my_app', 'settings.json'), 'w', encoding='utf-8') as f:
+        json.dump(settings, f, ensure_ascii=False, indent=2)
+    return home, output_directory
+
+
+def resolve_ffmpeg(minutes_app):
+    """同梱のffmpegがなければ、PATHかimageio-ffmpegのものを使う"""
+    ffmpeg_path = minutes_app.get_ffmpeg_path()
+    if os.path.exists(ffmpeg_path):
+        return ffmpeg_path
+    ffmpeg_path = shutil.which('ffmpeg')
+    if ffmpeg_path is None:
+        try:
+            import imageio_ffmpeg
+            ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
+        except ImportError:
+            sys.exit("ffmpegが見つかりません。PATHに追加するか、imageio-ffmpegをインストールしてください。")
+    minutes_app.get_ffmpeg_path = lambda: ffmpeg_path
+    return ffmpeg_path
+
+
+def reset_state(minutes_app, home):
+    """前回の計測の影響が残らないよう、共有の状態とジョブの記録を消す"""
+    from pipeline_metrics import MetricsRegistry
+    from token_accounting import TokenLedger
+
+    minutes_app.api_key_pool = None
+    minutes_app.upload_byte_budget = None
+    minutes_app.metrics = MetricsRegistry()
+    minutes_app.token_ledger = TokenLedger()
+    shutil.rmtree(os.path.join(home, '.my_app', 'jobs'), ignore_errors=True)
+
+
+def stage_times(minutes_app):
+    """工程ごとの所要時間の合計（秒）"""
+    summary = minutes_app.metrics.histogram_summary('stage_seconds')
+    return {dict(labels)['stage']: round(total, 3) for labels, (total, _) in sorted(summary.items())}
+
+
+def measure(func):
+    """funcを実行し、(結果, 経過秒数, Pythonのメモリ使用量の最大値) を返す"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = func()
+    finally:
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run_pipeline(minutes_app, backend, args, home, source, duration, workdir):
+    """1つの合成音声（をcopies件）処理して結果を返す"""
+    reset_state(minutes_app, home)
+    backend.stats.update({key: 0 for key in backend.stats})
+    # 作ったクライアントは残したまま、使い回しの回数だけを数え直します
+    backend.pool.stats.update({key: 0 for key in backend.pool.stats})
+    copies = []
+    copy_dir = os.path.join(workdir, 'inputs')
+    os.makedirs(copy_dir, exist_ok=True)
+    for index in range(args.copies):
+        path = os.path.join(copy_dir, f"copy{index}_{os.path.basename(source)}")
+        if not os.path.exists(path):
+            shutil.copyfile(source, path)
+        copies.append(path)
+
+    (succeeded, failed), elapsed, peak = measure(
+        lambda: minutes_app.run_batch(copies, max_jobs=args.jobs)
+    )
+    audio_seconds = duration * len(copies)
+    return {
+        'input': os.path.basename(source),
+        'audio_minutes': duration / 60,
+        'copies': len(copies),
+        'succeeded': succeeded,
+        'failed': failed,
+        'wall_seconds': round(elapsed, 3),
+        'realtime_factor': round(audio_seconds / elapsed, 1) if elapsed else None,
+        'files_per_hour': round(succeeded / elapsed * 3600, 1) if elapsed else None,
+        'peak_python_mb': round(peak / (1024 * 1024), 1),
+        'stages': stage_times(minutes_app),
+        'fake_api': dict(backend.stats),
+        'clients': dict(backend.pool.stats),
+        'tokens': minutes_app.token_ledger.snapshot(),
+    }
+
+
+def run_minutes(minutes_app, args, output_directory):
+    """抽出結果のExcelファイルからcreate_minutesで議事録を作る時間を測る"""
+    xlsx_files = sorted(name for name in os.listdir(output_directory) if name.endswith('_抽出結果.xlsx'))
+    if not xlsx_files:
+        return None
+    xlsx_path = os.path.join(output_directory, xlsx_files[0])
+    template_path = os.path.join(REPO_DIR, 'template.docx')
+    output_path = os.path.join(output_directory, 'bench_minutes.docx')
+    timings = []
+    peak = 0
+    # create_minutesは置き換えの内容をprintするので、計測中は出力を捨てます
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(args.minutes_runs):
+            ok, elapsed, run_peak = measure(lambda: minutes_app.create_minutes(xlsx_path, template_path, output_path))
+            if not ok:
+                return {'error': f"{xlsx_path}から議事録を作成できませんでした"}
+            timings.append(elapsed)
+            peak = max(peak, run_peak)
+    timings.sort()
+    return {
+        'runs': len(timings),
+        'median_seconds': round(timings[len(timings) // 2], 4),
+        'max_seconds': round(timings[-1], 4),
+        'peak_python_mb': round(peak / (1024 * 1024), 1),
+    }
+
+
+def print_report(results):
+    print()
+    print(f"{'入力':<36} {'件数':>4} {'経過(秒)':>9} {'実時間比':>8} {'件/時':>8} {'最大MB':>7} {'429':>5}")
+    for result in results['pipeline']:
+        print(f"{result['input']:<36} {result['copies']:>4} {result['wall_seconds']:>9.2f} "
+              f"{result['realtime_factor']:>8} {result['files_per_hour']:>8} {result['peak_python_mb']:>7} "
+              f"{result['fake_api']['rate_limited']:>5}")
+        stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result['stages'].items()
+                           if not name.endswith('_request'))
+        print(f"    工程: {stages}")
+        print(f"    クライアント: 作成 {result['clients']['clients_created']} / 使い回し {result['clients']['client_reuses']}")
+    if results.get('minutes'):
+        minutes = results['minutes']
+        if 'error' in minutes:
+            print(f"create_minutes: {minutes['error']}")
+        else:
+            print(f"create_minutes: 中央値 {minutes['median_seconds']}秒 / 最大 {minutes['max_seconds']}秒 "
+                  f"/ 最大 {minutes['peak_python_mb']}MB（{minutes['runs']}回）")
+    if resource is not None:
+        print(f"プロセスの最大RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f}MB")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='minutes_bench_')
+    home, output_directory = prepare_workspace(args, workdir)
+
+    # 作業フォルダに切り替えてから読み込みます（読み込み時にホームフォルダの設定とログを使うため）
+    with contextlib.redirect_stdout(io.StringIO()):
+        import minutes_app
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    from fake_gemini import FakeGeminiBackend, LatencyModel
+    from synthetic_audio import generate_audio
+
+    ffmpeg_path = resolve_ffmpeg(minutes_app)
+    minutes_app.PROCESSED_FILES_LOG = os.path.join(workdir, 'processed_files.json')
+    minutes_app.transcription_prompt = minutes_app.load_settings().get('transcription_prompt', '')
+
+    backend = FakeGeminiBackend(
+        latency=LatencyModel(args.latency, args.latency_median, args.latency_sigma, args.time_scale, args.seed),
+        extract_latency=LatencyModel(args.latency, args.extract_latency_median, args.latency_sigma,
+                                     args.time_scale, args.seed + 1),
+        error_rate=args.error_rate,
+        retry_after=args.retry_after * args.time_scale,
+        seed=args.seed,
+    )
+    restore = backend.install(minutes_app)
+
+    results = {'settings': vars(args), 'pipeline': []}
+    try:
+        durations = {}
+        for extension in args.formats.split(','):
+            for minutes in args.durations.split(','):
+                seconds = float(minutes) * 60
+                started = time.perf_counter()
+                path = generate_audio(ffmpeg_path, os.path.join(workdir, 'audio'), seconds, f".{extension.strip()}",
+                                      sample_rate=args.sample_rate)
+                durations[os.path.abspath(path)] = seconds
+                print(f"合成音声 {os.path.basename(path)} を用意しました（{time.perf_counter() - started:.1f}秒）")
+
+        # 録音の長さはヘッダーから読むので、ffprobeはヘッダーを読めないときにだけ使われます
+        if shutil.which('ffprobe') and not os.path.exists(minutes_app.get_ffprobe_path()):
+            minutes_app.get_ffprobe_path = lambda: shutil.which('ffprobe')
+
+        for path, seconds in durations.items():
+            result = run_pipeline(minutes_app, backend, args, home, path, seconds, workdir)
+            results['pipeline'].append(result)
+        results['minutes'] = run_minutes(minutes_app, args, output_directory)
+    finally:
+        restore()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
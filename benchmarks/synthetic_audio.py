@@ -0,0 +1,38 @@
+"""ベンチマーク用の合成音声ファイルを作るモジュール
+
+ffmpegのlavfiでピンクノイズと低い音を重ね、9秒ごとに2秒の無音を入れて発話の区切りに見立てます。
+"""
+import os
+import subprocess
+
+# 拡張子ごとのエンコードの指定
+CODECS = {
+    '.wav': ['-c:a', 'pcm_s16le'],
+    '.mp3': ['-c:a', 'libmp3lame', '-b:a', '128k'],
+    '.m4a': ['-c:a', 'aac', '-b:a', '128k'],
+}
+
+
+def synthetic_audio_command(ffmpeg_path, path, seconds, sample_rate=44100, channels=2):
+    """合成音声を作るffmpegのコマンドを返す関数"""
+    extension = os.path.splitext(path)[1].lower()
+    layout = 'stereo' if channels == 2 else 'mono'
+    graph = (
+        f"anoisesrc=d={seconds}:c=pink:r={sample_rate}:a=0.2[n];"
+        f"sine=f=220:d={seconds}:r={sample_rate}[t];"
+        f"[n][t]amix=inputs=2,volume='if(lt(mod(t,9),7),1,0)':eval=frame,"
+        f"aformat=channel_layouts={layout}[out]"
+    )
+    return [ffmpeg_path, '-v', 'error', '-y', '-filter_complex', graph, '-map', '[out]', *CODECS[extension], path]
+
+
+def generate_audio(ffmpeg_path, directory, seconds, extension='.mp3', sample_rate=44100, channels=2):
+    """合成音声ファイルを作ってパスを返す関数（同じ条件のファイルがあれば作り直しません）"""
+    os.makedirs(directory, exist_ok=True)
+    name = f"synthetic_{int(seconds)}s_{sample_rate}hz_{channels}ch{extension}"
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        temp_path = path + '.part' + extension
+        subprocess.run(synthetic_audio_command(ffmpeg_path, temp_path, seconds, sample_rate, channels), check=True)
+        os.replace(temp_path, path)
+    return path
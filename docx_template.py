@@ -0,0 +1,165 @@
+"""議事録のテンプレート（template.docx）に値を差し込むモジュール
+
+テンプレートは1度だけ読み込んで「コンパイル」し、「会議名」のような差し込み位置を
+本文・表・ヘッダー・フッターのXMLの中から探して、その前後のXMLを断片として覚えておきます。
+差し込むときは断片と値をつなげるだけなので、文書の大きさに比例した時間で済み、
+差し込み位置の前後のランの書式（フォント・太字など）もそのまま残ります。
+コンパイルした結果はパス・更新時刻・サイズごとに覚えておきます。
+"""
+import io
+import os
+import re
+import threading
+import zipfile
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+W_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+W = f'{{{W_NAMESPACE}}}'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+# 差し込み位置（「会議名」「議題①の要約」など）
+PLACEHOLDER_PATTERN = re.compile(r'「([^「」]+)」')
+# 差し込み位置を探すパート（本文と、その中の表・ヘッダー・フッター・脚注）
+TEXT_PART_PATTERN = re.compile(r'word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$')
+# コンパイル後のXMLで差し込み位置を表す印（XMLに書ける私用領域の文字を使います）
+MARKER_START, MARKER_END = '\ue000', '\ue001'
+MARKER_PATTERN = re.compile(f'{MARKER_START}(\\d+){MARKER_END}')
+# XMLに書けない制御文字
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _paragraph_texts(paragraph):
+    """段落の中のテキスト（w:t）を順に返す（テキストボックスの中の段落は含めません）"""
+    for text in paragraph.iter(W + 't'):
+        if next(text.iterancestors(W + 'p')) is paragraph:
+            yield text
+
+
+def _mark_placeholders(paragraph, keys):
+    """段落の中の差し込み位置を印に置き換える（複数のランにまたがる場合は最初のランにまとめます）"""
+    texts = list(_paragraph_texts(paragraph))
+    if not texts:
+        return
+    content = ''.join(text.text or '' for text in texts)
+    matches = list(PLACEHOLDER_PATTERN.finditer(content))
+    if not matches:
+        return
+    offsets = []
+    position = 0
+    for text in texts:
+        offsets.append(position)
+        position += len(text.text or '')
+
+    def locate(index):
+        """contentの位置indexを含むw:tの番号"""
+        for number in range(len(texts) - 1, -1, -1):
+            if offsets[number] <= index:
+                return number
+        return 0
+
+    # 後ろから置き換えると、前にある差し込み位置の場所はずれません
+    for match in reversed(matches):
+        first, last = locate(match.start()), locate(match.end() - 1)
+        marker = f'{MARKER_START}{len(keys)}{MARKER_END}'
+        keys.append(match.group(1))
+        head = (texts[first].text or '')[:match.start() - offsets[first]]
+        tail = (texts[last].text or '')[match.end() - offsets[last]:]
+        if first == last:
+            texts[first].text = head + marker + tail
+        else:
+            texts[first].text = head + marker
+            for number in range(first + 1, last):
+                texts[number].text = ''
+            texts[last].text = tail
+        for number in range(first, last + 1):
+            texts[number].set(XML_SPACE, 'preserve')
+
+
+def _compile_part(xml):
+    """パートのXMLを、(差し込み位置の間のXMLの断片のリスト, 差し込む値のキーのリスト) に分ける"""
+    root = etree.fromstring(xml)
+    keys = []
+    for paragraph in root.iter(W + 'p'):
+        _mark_placeholders(paragraph, keys)
+    if not keys:
+        return None
+    text = etree.tostring(root, xml_declaration=True, encoding='UTF-8', standalone=True).decode('utf-8')
+    pieces = MARKER_PATTERN.split(text)
+    # splitの結果は [断片, 番号, 断片, 番号, ..., 断片] の順に並びます
+    return pieces[0::2], [keys[int(number)] for number in pieces[1::2]]
+
+
+def _value_xml(value):
+    """差し込む値を、w:tの中に書けるXMLに変換する（改行とタブは改行・タブの要素にします）"""
+    text = INVALID_XML_CHARS.sub('', '' if value is None else str(value))
+    text = escape(text.replace('\r\n', '\n').replace('\r', '\n'))
+    return (text.replace('\n', '</w:t><w:br/><w:t xml:space="preserve">')
+                .replace('\t', '</w:t><w:tab/><w:t xml:space="preserve">'))
+
+
+class CompiledTemplate:
+    """コンパイル済みのテンプレート"""
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = []  # (ZipInfo, 元のデータ, コンパイル結果またはNone)
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                data = archive.read(info)
+                compiled = _compile_part(data) if TEXT_PART_PATTERN.match(info.filename) else None
+                self._entries.append((info, data, compiled))
+
+    @property
+    def placeholders(self):
+        """テンプレートにある差し込み位置のキー"""
+        return {key for _, _, compiled in self._entries if compiled for key in compiled[1]}
+
+    def _render_part(self, compiled, values):
+        fragments, keys = compiled
+        parts = [fragments[0]]
+        for key, fragment in zip(keys, fragments[1:]):
+            # 値のないキーは、テンプレートの文字をそのまま残します
+            parts.append(_value_xml(values[key]) if key in values else escape(f'「{key}」'))
+            parts.append(fragment)
+        return ''.join(parts).encode('utf-8')
+
+    def render(self, values):
+        """値を差し込んだdocxのバイト列を返す"""
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for info, data, compiled in self._entries:
+                archive.writestr(info, self._render_part(compiled, values) if compiled else data)
+        return output.getvalue()
+
+    def save(self, values, output_path):
+        """値を差し込んだdocxをoutput_pathに保存する"""
+        data = self.render(values)
+        with open(output_path, 'wb') as f:
+            f.write(data)
+
+    def document(self, values):
+        """値を差し込んだ文書をpython-docxのDocumentとして返す"""
+        from docx import Document
+        return Document(io.BytesIO(self.render(values)))
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def load_template(path):
+    """コンパイル済みのテンプレートを返す関数（ファイルが変わっていなければ前回の結果を使います）"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _templates_lock:
+        template = _templates.get(key)
+    if template is None:
+        template = CompiledTemplate(path)
+        with _templates_lock:
+            # 古い版のテンプレートは捨てます
+            for old_key in [k for k in _templates if k[0] == key[0]]:
+                del _templates[old_key]
+            _templates[key] = template
+    return template
@@ -0,0 +1,101 @@
+"""APIキーごとに独立したGeminiクライアントを作り、使い回すためのモジュール
+
+genai.configure()はプロセス全体の設定を書き換えるため、複数のスレッドから別々のキーで
+呼ぶと、他のスレッドのリクエストが違うキーで送られてしまいます。ここではキーごとに
+専用のクライアント（接続）を1つだけ作り、チャンク・リトライ・ジョブをまたいで使い回します。
+"""
+import threading
+
+import google.ai.generativelanguage as glm
+import google.generativeai as genai
+from google.api_core import client_options as client_options_lib
+from google.api_core import gapic_v1
+from google.generativeai import client as genai_client
+from google.generativeai.types import file_types
+
+
+class ServiceClients:
+    """APIキーを指定して、Gemini APIのサービスクライアント（接続）を作る
+
+    GeminiClientPoolはこのメソッドでクライアントを作ります。
+    ベンチマークでは、同じメソッドを持つネットワークを使わない代役に差し替えます。
+    """
+
+    def __init__(self, transport=None):
+        self.transport = transport
+
+    def _client_kwargs(self, api_key):
+        kwargs = {
+            'client_options': client_options_lib.ClientOptions(api_key=api_key),
+            'client_info': gapic_v1.client_info.ClientInfo(user_agent=f"genai-py/{genai.__version__}"),
+        }
+        if self.transport:
+            kwargs['transport'] = self.transport
+        return kwargs
+
+    def generative(self, api_key):
+        return glm.GenerativeServiceClient(**self._client_kwargs(api_key))
+
+    def generative_async(self, api_key):
+        # 非同期クライアントは常にgrpc_asyncioで接続します
+        kwargs = self._client_kwargs(api_key)
+        kwargs.pop('transport', None)
+        return glm.GenerativeServiceAsyncClient(**kwargs)
+
+    def files(self, api_key):
+        return genai_client.FileServiceClient(**self._client_kwargs(api_key))
+
+
+class GeminiClientPool:
+    """APIキーごとのGeminiクライアント（生成・ファイル）を保持するプール"""
+
+    def __init__(self, model_name, transport=None, service_clients=None):
+        self.model_name = model_name
+        self.service_clients = service_clients or ServiceClients(transport)
+        self._models = {}
+        self._async_models = {}
+        self._file_clients = {}
+        self._lock = threading.Lock()
+        # 接続の使い回しを計測するためのカウンタ
+        self.stats = {'clients_created': 0, 'client_reuses': 0}
+
+    def _get_or_create(self, cache, api_key, factory):
+        with self._lock:
+            value = cache.get(api_key)
+            if value is None:
+                value = cache[api_key] = factory()
+                self.stats['clients_created'] += 1
+            else:
+                self.stats['client_reuses'] += 1
+            return value
+
+    def model(self, api_key):
+        """指定したキー専用のクライアントを使うGenerativeModelを返す"""
+        def create():
+            model = genai.GenerativeModel(self.model_name)
+            model._client = self.service_clients.generative(api_key)
+            return model
+        return self._get_or_create(self._models, api_key, create)
+
+    def async_model(self, api_key):
+        """指定したキー専用の非同期クライアントを使うGenerativeModelを返す"""
+        def create():
+            model = genai.GenerativeModel(self.model_name)
+            model._async_client = self.service_clients.generative_async(api_key)
+            return model
+        return self._get_or_create(self._async_models, api_key, create)
+
+    def file_client(self, api_key):
+        """指定したキー専用のファイルAPIクライアントを返す"""
+        return self._get_or_create(self._file_clients, api_key, lambda: self.service_clients.files(api_key))
+
+    def upload_file(self, api_key, source, mime_type, display_name=None):
+        """指定したキーでファイルをアップロードする"""
+        created = self.file_client(api_key).create_file(source, mime_type=mime_type, display_name=display_name)
+        return file_types.File(created)
+
+    def get_file(self, api_key, name):
+        return file_types.File(self.file_client(api_key).get_file(name=name))
+
+    def delete_file(self, api_key, name):
+        self.file_client(api_key).delete_file(name=name)
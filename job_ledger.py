@@ -0,0 +1,250 @@
+"""処理した録音の記録（ジョブの台帳）をSQLiteに保存するモジュール
+
+録音は中身のハッシュ（SHA-256）で見分けるので、別のフォルダにある同じ名前のファイルを
+取り違えることはなく、名前を変えたりコピーしたりした録音を処理し直すこともありません。
+ハッシュはパス・サイズ・更新時刻ごとに覚えておき、変わっていないファイルは読み直しません。
+ジョブごとに、工程ごとの結果と時間・使ったAPIキー・トークン数・出力したファイルを記録します。
+WALモードで開くので、複数のジョブやプロセスが同時に書き込んでも読み込みを待たせません。
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA_VERSION = 2
+# ファイルのハッシュを計算するときに1度に読むバイト数
+HASH_BLOCK_SIZE = 1024 * 1024
+
+RUNNING = 'running'
+OK = 'ok'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    content_hash TEXT NOT NULL,
+    source_path TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    seconds REAL,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    api_keys TEXT NOT NULL DEFAULT '',
+    transcript_path TEXT,
+    xlsx_path TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_by_hash ON jobs (content_hash, status);
+CREATE INDEX IF NOT EXISTS jobs_by_finished ON jobs (finished_at);
+CREATE TABLE IF NOT EXISTS stages (
+    job_id INTEGER NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    seconds REAL,
+    PRIMARY KEY (job_id, stage)
+);
+CREATE TABLE IF NOT EXISTS legacy_processed (
+    name TEXT PRIMARY KEY,
+    output_path TEXT
+);
+CREATE TABLE IF NOT EXISTS legacy_imports (
+    path TEXT PRIMARY KEY,
+    imported_at REAL NOT NULL
+);
+"""
+
+
+def hash_file(path):
+    """ファイルの中身のSHA-256を返す関数"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class JobLedger:
+    """処理した録音とジョブの記録を保存する台帳（どのスレッドからでも使えます）
+
+    SQLiteの接続はスレッドごとに1つずつ開きます。
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                conn.executescript(SCHEMA)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # 他の接続が書き込み中なら、最大30秒待ちます
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """すべてのスレッドの接続を閉じる"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    def content_hash(self, path):
+        """ファイルの中身のハッシュを返す（パス・サイズ・更新時刻が前回と同じなら覚えておいた値を使います）"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        conn = self._connect()
+        row = conn.execute("SELECT size, mtime_ns, content_hash FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and (row['size'], row['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            return row['content_hash']
+        content_hash = hash_file(path)
+        with conn:
+            conn.execute(
+                "INSERT INTO files (path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, "
+                "content_hash = excluded.content_hash",
+                (path, stat.st_size, stat.st_mtime_ns, content_hash),
+            )
+        return content_hash
+
+    def is_processed(self, path):
+        """同じ中身の録音の処理が成功しているか"""
+        content_hash = self.content_hash(path)
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT 1 FROM jobs WHERE content_hash = ? AND status = ? LIMIT 1", (content_hash, OK)
+        ).fetchone()
+        if row is not None:
+            return True
+        return self._adopt_legacy(path, content_hash)
+
+    def _adopt_legacy(self, path, content_hash):
+        """以前のprocessed_files.jsonに名前があれば、このファイルの中身を処理済みとして1度だけ記録する
+
+        名前で照らし合わせるのはこの1回だけです。記録した後は名前を消すので、
+        別のフォルダにある同じ名前の新しい録音を処理済みと取り違えることはありません。
+        """
+        name = os.path.basename(path)
+        conn = self._connect()
+        with conn:
+            row = conn.execute("SELECT output_path FROM legacy_processed WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return False
+            now = time.time()
+            conn.execute(
+                "INSERT INTO jobs (content_hash, source_path, file_size, status, started_at, finished_at, xlsx_path) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (content_hash, os.path.abspath(path), os.path.getsize(path), OK, now, now, row['output_path'] or None),
+            )
+            conn.execute("DELETE FROM legacy_processed WHERE name = ?", (name,))
+        return True
+
+    def start_job(self, path):
+        """ジョブの開始を記録し、ジョブの番号を返す"""
+        content_hash = self.content_hash(path)
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (content_hash, source_path, file_size, status, started_at) VALUES (?, ?, ?, ?, ?)",
+                (content_hash, os.path.abspath(path), os.path.getsize(path), RUNNING, time.time()),
+            )
+        return cursor.lastrowid
+
+    def finish_job(self, job_id, status, seconds, stages=None, prompt_tokens=0, output_tokens=0,
+                   api_keys=(), transcript_path=None, xlsx_path=None):
+        """ジョブの結果を記録する（stagesは {工程: (結果, 秒数)}）"""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, seconds = ?, prompt_tokens = ?, output_tokens = ?, "
+                "api_keys = ?, transcript_path = ?, xlsx_path = ? WHERE id = ?",
+                (status, time.time(), seconds, prompt_tokens, output_tokens, ','.join(sorted(api_keys)),
+                 transcript_path, xlsx_path, job_id),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO stages (job_id, stage, status, seconds) VALUES (?, ?, ?, ?)",
+                [(job_id, stage, stage_status, stage_seconds)
+                 for stage, (stage_status, stage_seconds) in (stages or {}).items()],
+            )
+
+    def import_processed_files(self, json_path):
+        """以前のprocessed_files.json（ファイル名だけの記録）を取り込む（取り込んだ件数を返す）
+
+        取り込んだ名前は、その名前のファイルを初めて見つけたときに中身のハッシュの記録に置き換えます。
+        """
+        json_path = os.path.abspath(json_path)
+        if not os.path.exists(json_path):
+            return 0
+        conn = self._connect()
+        # 同じファイルは1度だけ取り込みます（置き換え済みの名前を取り込み直さないように）
+        if conn.execute("SELECT 1 FROM legacy_imports WHERE path = ?", (json_path,)).fetchone() is not None:
+            return 0
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                processed_files = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"{json_path}を読み込めませんでした: {str(e)}")
+            return 0
+        if not isinstance(processed_files, dict):
+            return 0
+        with conn:
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO legacy_processed (name, output_path) VALUES (?, ?)",
+                [(name, output or '') for name, output in processed_files.items()],
+            )
+            conn.execute("INSERT INTO legacy_imports (path, imported_at) VALUES (?, ?)", (json_path, time.time()))
+        return max(cursor.rowcount, 0)
+
+    def recent_jobs(self, limit=20):
+        """新しい順にジョブの記録を返す"""
+        rows = self._connect().execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def throughput(self, days=7):
+        """終わったジョブの日ごとの件数・平均時間・トークン数を古い順に返す"""
+        since = time.time() - days * 24 * 60 * 60
+        rows = self._connect().execute(
+            "SELECT date(finished_at, 'unixepoch', 'localtime') AS day, "
+            "SUM(status = ?) AS succeeded, SUM(status != ?) AS failed, "
+            "AVG(CASE WHEN status = ? THEN seconds END) AS average_seconds, "
+            "SUM(file_size) AS total_bytes, SUM(prompt_tokens) AS prompt_tokens, SUM(output_tokens) AS output_tokens "
+            "FROM jobs WHERE finished_at >= ? GROUP BY day ORDER BY day",
+            (OK, OK, OK, since),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def stage_seconds(self, days=7):
+        """成功した工程ごとの平均時間（秒）を返す"""
+        since = time.time() - days * 24 * 60 * 60
+        rows = self._connect().execute(
+            "SELECT stages.stage, AVG(stages.seconds) AS seconds FROM stages JOIN jobs ON jobs.id = stages.job_id "
+            "WHERE jobs.finished_at >= ? AND stages.status = ? AND stages.seconds IS NOT NULL GROUP BY stages.stage",
+            (since, OK),
+        ).fetchall()
+        return {row['stage']: row['seconds'] for row in rows}
+
@@ -0,0 +1,175 @@
+"""ジョブの進み具合（分割計画・チャンクごとの結果・完了した工程）をディスクに記録するモジュール"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from audio_chunks import AudioChunk
+
+# ジョブの工程（この順に進みます）
+STAGES = ('transcription', 'docx', 'extraction', 'xlsx')
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def job_id_for(source_path):
+    """音声ファイルのパス・サイズ・更新時刻からジョブIDを作る関数"""
+    stat = os.stat(source_path)
+    key = f"{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+class JobManifest:
+    """1件の音声ファイル処理の進み具合を記録するマニフェスト
+
+    チャンクの結果や工程が完了するたびにファイルへ書き出すので、
+    途中で止まっても次回は未完了の工程から再開できます。
+    チャンクの結果はマニフェスト全体を書き直さず、そのチャンクの分だけを
+    ログ（.log、JSON Lines）の末尾に追記します。工程が完了したときにマニフェスト全体を書き出し、
+    ログを空にします。
+    """
+
+    def __init__(self, path, data):
+        self.path = path
+        self.log_path = os.path.splitext(path)[0] + '.log'
+        self.data = data
+        self._lock = threading.RLock()
+
+    @classmethod
+    def open(cls, directory, source_path, fingerprint=''):
+        """マニフェストを読み込む（なければ、または設定が変わっていれば新しく作る）"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{job_id_for(source_path)}.json")
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('fingerprint') == fingerprint:
+                manifest = cls(path, data)
+                manifest._replay_log()
+                return manifest
+        except (OSError, ValueError):
+            pass
+        data = {
+            'source': os.path.abspath(source_path),
+            'fingerprint': fingerprint,
+            'created': time.time(),
+            'chunks': None,
+            'stages': {stage: None for stage in STAGES},
+        }
+        return cls(path, data)
+
+    def _replay_log(self):
+        """ログに追記されたチャンクの結果をマニフェストに反映する"""
+        if self.data['chunks'] is None:
+            return
+        try:
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 書き込み途中で止まった最後の行は読み飛ばします
+                continue
+            index = entry.pop('index', None)
+            if isinstance(index, int) and 0 <= index < len(self.data['chunks']):
+                self.data['chunks'][index].update(entry)
+
+    def _append_log(self, entry):
+        """チャンクの結果を1行だけログに追記する"""
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    @property
+    def resumed(self):
+        """前回の途中結果を引き継いでいるかどうか"""
+        return self.data['chunks'] is not None
+
+    @property
+    def chunks(self):
+        if self.data['chunks'] is None:
+            return None
+        return [AudioChunk(c['index'], c['start'], c['end'], c['overlap']) for c in self.data['chunks']]
+
+    def set_plan(self, chunks):
+        """分割計画を記録する"""
+        with self._lock:
+            self.data['chunks'] = [
+                {'index': c.index, 'start': c.start, 'end': c.end, 'overlap': c.overlap,
+                 'status': PENDING, 'transcript': None, 'extraction': None}
+                for c in chunks
+            ]
+            self.save()
+
+    def pending_indices(self):
+        """まだ文字起こしが完了していないチャンクの番号"""
+        return [c['index'] for c in self.data['chunks'] if c['status'] != DONE]
+
+    def transcripts(self):
+        """チャンク順の文字起こし結果（未完了のチャンクはNone）"""
+        return [c['transcript'] for c in self.data['chunks']]
+
+    def record_chunk(self, index, transcript):
+        """チャンクの文字起こし結果を記録する（Noneなら失敗として記録します）"""
+        with self._lock:
+            chunk = self.data['chunks'][index]
+            # 文字起こしが変わったら、そのチャンクの議題抽出もやり直します
+            update = {'status': DONE if transcript else FAILED, 'transcript': transcript, 'extraction': None}
+            chunk.update(update)
+            self._append_log({'index': index, **update})
+
+    def chunk_extractions(self):
+        """チャンク順の議題抽出の結果（未完了のチャンクはNone）"""
+        return [c.get('extraction') for c in self.data['chunks']]
+
+    def record_chunk_extraction(self, index, extraction):
+        """チャンクの議題抽出の結果を記録する"""
+        with self._lock:
+            self.data['chunks'][index]['extraction'] = extraction
+            self._append_log({'index': index, 'extraction': extraction})
+
+    def stage_done(self, stage):
+        return self.data['stages'].get(stage) is not None
+
+    def stage_result(self, stage):
+        return self.data['stages'].get(stage)
+
+    def complete_stage(self, stage, result=True):
+        """工程の完了と、その結果（出力ファイルのパスなど）を記録する"""
+        with self._lock:
+            self.data['stages'][stage] = result
+            self.save()
+
+    def reset_stages_after(self, stage):
+        """指定した工程より後の工程を未完了に戻す（前の工程の結果が変わったとき）"""
+        with self._lock:
+            for later in STAGES[STAGES.index(stage) + 1:]:
+                self.data['stages'][later] = None
+            self.save()
+
+    def save(self):
+        """マニフェスト全体を書き出してログを空にする（書き込み途中で止まっても壊れないよう、一時ファイルから置き換えます）"""
+        with self._lock:
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+            # ログの内容はマニフェストに含まれたので消します（消す前に止まっても、読み直すだけで結果は同じです）
+            try:
+                os.remove(self.log_path)
+            except OSError:
+                pass
+
+    def remove(self):
+        """すべて完了したジョブのマニフェストを削除する"""
+        for path in (self.path, self.log_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,267 @@
+"""音声ファイルのヘッダーから長さなどの情報を読み取るモジュール
+
+WAV（RIFFヘッダー）・MP3（フレームヘッダーとXing/VBRIヘッダー）・M4A（mvhdアトム）は
+ffprobeを起動せずにPythonだけで読み取ります。読めなかったときだけffprobeを使います。
+結果はパス・更新時刻・サイズごとに覚えておくので、同じファイルを何度調べても速く済みます。
+"""
+import logging
+import os
+import struct
+import subprocess
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# 覚えておく結果の数の上限
+MAX_CACHE_ENTRIES = 4096
+# MP3の先頭のフレームを探す範囲（バイト）
+MP3_SYNC_SEARCH_BYTES = 64 * 1024
+
+# MP3のビットレート（kbps）。キーは (MPEG-1かどうか, レイヤー)
+MP3_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# MP3のサンプリングレート（Hz）。キーはバージョンのビット（0: MPEG-2.5, 2: MPEG-2, 3: MPEG-1）
+MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    """音声ファイルの長さなどの情報"""
+    duration: float  # 秒
+    format: str
+    sample_rate: int = 0
+    channels: int = 0
+    bit_rate: int = 0  # bps（わからなければ0）
+    source: str = 'header'  # 'header'（ヘッダーから読んだ）か 'ffprobe'
+
+
+def _probe_wav(f, file_size):
+    """RIFF/WAVEのヘッダーを読む"""
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return None
+    channels = sample_rate = byte_rate = 0
+    position = 12
+    while position + 8 <= file_size:
+        f.seek(position)
+        chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+        if chunk_id == b'fmt ':
+            _, channels, sample_rate, byte_rate = struct.unpack('<HHII', f.read(12))
+        elif chunk_id == b'data':
+            # 録音途中で止まったファイルなどでは、dataの大きさが実際のサイズと合わないことがあります
+            data_size = min(chunk_size, file_size - position - 8)
+            if not byte_rate:
+                return None
+            return MediaInfo(data_size / byte_rate, 'wav', sample_rate, channels, byte_rate * 8)
+        position += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _skip_id3v2(f):
+    """ID3v2タグを読み飛ばし、音声データの開始位置を返す"""
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b'ID3':
+        # タグの大きさは7ビットずつの4バイト（syncsafe integer）で書かれています
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        footer = 10 if header[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def _parse_mp3_header(data, offset):
+    """MP3のフレームヘッダーを読み、(MPEG-1かどうか, レイヤー, ビットレート, サンプリングレート, チャンネル数, フレーム長) を返す"""
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    version_bits = (data[offset + 1] >> 3) & 0x03
+    layer_bits = (data[offset + 1] >> 1) & 0x03
+    bitrate_index = data[offset + 2] >> 4
+    rate_index = (data[offset + 2] >> 2) & 0x03
+    padding = (data[offset + 2] >> 1) & 0x01
+    channel_mode = data[offset + 3] >> 6
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version_bits == 3
+    layer = 4 - layer_bits
+    bit_rate = MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version_bits][rate_index]
+    if layer == 1:
+        frame_length = (12 * bit_rate // sample_rate + padding) * 4
+    else:
+        frame_length = (144 if mpeg1 or layer == 2 else 72) * bit_rate // sample_rate + padding
+    return mpeg1, layer, bit_rate, sample_rate, 1 if channel_mode == 3 else 2, frame_length
+
+
+def _samples_per_frame(mpeg1, layer):
+    if layer == 1:
+        return 384
+    if layer == 2 or mpeg1:
+        return 1152
+    return 576
+
+
+def _probe_mp3(f, file_size):
+    """MP3のフレームヘッダーを読む（VBRならXing/VBRIヘッダーのフレーム数から、CBRならサイズから長さを求めます）"""
+    f.seek(0)
+    audio_start = _skip_id3v2(f)
+    f.seek(audio_start)
+    data = f.read(MP3_SYNC_SEARCH_BYTES)
+    offset = 0
+    while True:
+        offset = data.find(b'\xff', offset)
+        if offset < 0:
+            return None
+        header = _parse_mp3_header(data, offset)
+        # 偶然同じ並びになったバイトと区別するため、次のフレームの先頭も確認します
+        if header and (_parse_mp3_header(data, offset + header[5]) or offset + header[5] >= len(data)):
+            break
+        offset += 1
+    mpeg1, layer, bit_rate, sample_rate, channels, _ = header
+    frame_samples = _samples_per_frame(mpeg1, layer)
+
+    # VBRの場合、最初のフレームにXing（Info）かVBRIのヘッダーがあり、総フレーム数が書かれています
+    side_info = (32 if channels == 2 else 17) if mpeg1 else (17 if channels == 2 else 9)
+    xing = offset + 4 + side_info
+    frames = None
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing + 4:xing + 8])[0]
+        if flags & 0x01:
+            frames = struct.unpack('>I', data[xing + 8:xing + 12])[0]
+    elif data[offset + 36:offset + 40] == b'VBRI':
+        frames = struct.unpack('>I', data[offset + 50:offset + 54])[0]
+    if frames:
+        duration = frames * frame_samples / sample_rate
+        audio_bytes = file_size - audio_start - offset
+        return MediaInfo(duration, 'mp3', sample_rate, channels, int(audio_bytes * 8 / duration) if duration else 0)
+
+    # CBRとみなして、音声データの大きさとビットレートから求めます（末尾のID3v1タグは除きます）
+    audio_bytes = file_size - audio_start - offset
+    f.seek(max(0, file_size - 128))
+    if f.read(3) == b'TAG':
+        audio_bytes -= 128
+    return MediaInfo(audio_bytes * 8 / bit_rate, 'mp3', sample_rate, channels, bit_rate)
+
+
+def _atoms(f, start, end):
+    """MP4のアトムを (種類, 中身の開始位置, 終了位置) で順に返す"""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size:
+            return
+        yield kind, position + header_size, min(position + size, end)
+        position += size
+
+
+def _probe_mp4(f, file_size):
+    """MP4（M4A）のmoovアトムの中のmvhdアトムから長さを読む"""
+    f.seek(4)
+    if f.read(4) != b'ftyp':
+        return None
+    for kind, start, end in _atoms(f, 0, file_size):
+        if kind != b'moov':
+            continue
+        for child, child_start, _ in _atoms(f, start, end):
+            if child != b'mvhd':
+                continue
+            f.seek(child_start)
+            version = f.read(4)[0]
+            if version == 1:
+                _, _, timescale, duration = struct.unpack('>QQIQ', f.read(28))
+            else:
+                _, _, timescale, duration = struct.unpack('>IIII', f.read(16))
+            if not timescale:
+                return None
+            seconds = duration / timescale
+            return MediaInfo(seconds, 'mp4', bit_rate=int(file_size * 8 / seconds) if seconds else 0)
+    return None
+
+
+# 拡張子ごとに、先に試す読み取り方
+PARSERS = {
+    '.wav': (_probe_wav, _probe_mp4, _probe_mp3),
+    '.mp3': (_probe_mp3, _probe_wav, _probe_mp4),
+    '.m4a': (_probe_mp4, _probe_wav, _probe_mp3),
+}
+
+
+def probe_header(path):
+    """ヘッダーから音声ファイルの情報を読む関数（読めなければNone）"""
+    file_size = os.path.getsize(path)
+    parsers = PARSERS.get(os.path.splitext(str(path))[1].lower(), (_probe_wav, _probe_mp4, _probe_mp3))
+    with open(path, 'rb') as f:
+        for parser in parsers:
+            try:
+                f.seek(0)
+                info = parser(f, file_size)
+            except (struct.error, IndexError, OSError, ZeroDivisionError):
+                info = None
+            if info is not None and info.duration > 0:
+                return info
+    return None
+
+
+def probe_ffprobe(ffprobe_path, path):
+    """ffprobeで音声ファイルの長さを調べる関数"""
+    command = [ffprobe_path, "-v", "error", "-show_entries", "format=duration,bit_rate,format_name",
+               "-of", "default=noprint_wrappers=1", str(path)]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    values = dict(line.split('=', 1) for line in result.stdout.splitlines() if '=' in line)
+    bit_rate = values.get('bit_rate', '')
+    return MediaInfo(float(values['duration']), values.get('format_name', ''),
+                     bit_rate=int(bit_rate) if bit_rate.isdigit() else 0, source='ffprobe')
+
+
+class MediaProbe:
+    """音声ファイルの情報を、パス・更新時刻・サイズごとに覚えておく読み取り役"""
+
+    def __init__(self, ffprobe_path=None, max_entries=MAX_CACHE_ENTRIES):
+        self.ffprobe_path = ffprobe_path
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def probe(self, path, ffprobe_path=None):
+        """音声ファイルの情報を返す（ヘッダーから読めなければffprobeを使います）"""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        info = probe_header(path)
+        if info is None:
+            logging.info(f"{os.path.basename(path)}のヘッダーを読めなかったため、ffprobeで長さを調べます。")
+            info = probe_ffprobe(ffprobe_path or self.ffprobe_path or 'ffprobe', path)
+
+        with self._lock:
+            self._entries[key] = info
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return info
+
+
+# アプリ全体で共有する読み取り役
+media_probe = MediaProbe()
+
+
+def probe_media(path, ffprobe_path=None):
+    """音声ファイルの情報を返す関数（結果は共有のキャッシュに残ります）"""
+    return media_probe.probe(path, ffprobe_path)
@@ -0,0 +1,189 @@
+"""処理したすべての会議の議題と要約を1つにまとめる索引のモジュール
+
+会議を1件処理するたびに、その議題と要約をCSVの索引（会議一覧.csv）の末尾に追記します。
+一覧のExcelファイル（会議一覧.xlsx）とParquetファイルは、この索引から作り直します。
+どれも1行ずつ読み書きするので、何万行になってもメモリ使用量は増えません。
+同じ録音（同じパスのファイル）を処理し直したときは、最後に追記した分だけを残します。
+別のフォルダにある同じ名前の録音は、別の会議として扱います。
+"""
+import csv
+import datetime
+import importlib.util
+import logging
+import os
+import threading
+import uuid
+
+import openpyxl
+from openpyxl.utils import get_column_letter
+
+from workbook_styles import CONTENT_STYLE, HEADER_STYLE, LABEL_STYLE, register_styles, styled_cell
+
+INDEX_FILE_NAME = '会議一覧.csv'
+WORKBOOK_FILE_NAME = '会議一覧.xlsx'
+PARQUET_FILE_NAME = '会議一覧.parquet'
+
+# 索引の列
+COLUMNS = ('meeting', 'audio_file', 'processed_at', 'topic_number', 'topic', 'summary', 'xlsx_file', 'batch')
+# 一覧のExcelファイルに出す列と、その見出し・幅
+WORKBOOK_COLUMNS = (
+    ('meeting', '会議', 30),
+    ('processed_at', '処理日時', 20),
+    ('topic_number', '番号', 6),
+    ('topic', '議題', 40),
+    ('summary', '要約', 100),
+    ('xlsx_file', '抽出結果のファイル', 40),
+)
+# Parquetファイルに1度に書き込む行数
+PARQUET_BATCH_ROWS = 5000
+
+_index_lock = threading.RLock()
+
+
+def parquet_available():
+    """Parquetファイルを書き出せるか（pyarrowがインストールされているか）"""
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+class MeetingIndex:
+    """会議ごとの議題と要約を追記していくCSVの索引"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_FILE_NAME)
+
+    def append(self, audio_file, items, xlsx_file=''):
+        """1件の会議の議題と要約 [(議題, 要約), ...] を索引に追記する"""
+        meeting = os.path.splitext(os.path.basename(audio_file))[0]
+        processed_at = datetime.datetime.now().isoformat(timespec='seconds')
+        batch = uuid.uuid4().hex
+        # 会議は録音のパスで見分けるので、audio_fileには絶対パスを記録します
+        rows = [(meeting, os.path.abspath(audio_file), processed_at, number, topic, summary, xlsx_file, batch)
+                for number, (topic, summary) in enumerate(items, start=1)]
+        with _index_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            new_file = not os.path.exists(self.path)
+            # Excelで開いても文字化けしないよう、新しく作るときだけBOMを付けます
+            with open(self.path, 'a', encoding='utf-8-sig' if new_file else 'utf-8', newline='') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(COLUMNS)
+                writer.writerows(rows)
+        return len(rows)
+
+    @staticmethod
+    def _meeting_key(row):
+        """行がどの会議のものかを表すキー（録音の絶対パス）を返す"""
+        source = row['audio_file']
+        # 以前の行はファイル名しか記録していないので、別の会議と取り違えないよう追記した分ごとに別に扱います
+        return source if os.path.isabs(source) else row['batch']
+
+    def _latest_batches(self):
+        """会議ごとに、最後に追記した分の識別子を返す（1会議につき1つだけ覚えます）"""
+        latest = {}
+        for row in self._read_all():
+            latest[self._meeting_key(row)] = row['batch']
+        return latest
+
+    def _read_all(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8-sig', newline='') as f:
+            yield from csv.DictReader(f)
+
+    def rows(self):
+        """処理し直す前の古い行を除いて、索引の行を順に返す"""
+        latest = self._latest_batches()
+        for row in self._read_all():
+            if latest.get(self._meeting_key(row)) == row['batch']:
+                yield row
+
+    def compact(self):
+        """処理し直す前の古い行を索引から取り除く（取り除いた行数を返す）"""
+        with _index_lock:
+            latest = self._latest_batches()
+            temp_path = self.path + '.tmp'
+            kept = removed = 0
+            with open(temp_path, 'w', encoding='utf-8-sig', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(COLUMNS)
+                for row in self._read_all():
+                    if latest.get(self._meeting_key(row)) == row['batch']:
+                        writer.writerow([row[column] for column in COLUMNS])
+                        kept += 1
+                    else:
+                        removed += 1
+            if removed:
+                os.replace(temp_path, self.path)
+            else:
+                os.remove(temp_path)
+        return removed
+
+    def write_workbook(self, output_path):
+        """索引から一覧のExcelファイルを作る（書き込み専用モードで1行ずつ書き出します）"""
+        wb = openpyxl.Workbook(write_only=True)
+        register_styles(wb)
+        ws = wb.create_sheet("議題一覧")
+        for index, (_, _, width) in enumerate(WORKBOOK_COLUMNS, start=1):
+            ws.column_dimensions[get_column_letter(index)].width = width
+        ws.freeze_panes = 'A2'
+        ws.append([styled_cell(ws, title, HEADER_STYLE) for _, title, _ in WORKBOOK_COLUMNS])
+        # 書き込み専用のシートはappendのたびに行を書き出すので、スタイル付きのセルは使い回せます
+        cells = [styled_cell(ws, None, LABEL_STYLE if index == 0 else CONTENT_STYLE)
+                 for index in range(len(WORKBOOK_COLUMNS))]
+        count = 0
+        for row in self.rows():
+            for cell, (column, _, _) in zip(cells, WORKBOOK_COLUMNS):
+                value = row[column]
+                cell.value = int(value) if column == 'topic_number' and value.isdigit() else value
+            ws.append(cells)
+            count += 1
+        if count:
+            ws.auto_filter.ref = f"A1:{get_column_letter(len(WORKBOOK_COLUMNS))}{count + 1}"
+        temp_path = output_path + '.tmp'
+        wb.save(temp_path)
+        os.replace(temp_path, output_path)
+        return count
+
+    def write_parquet(self, output_path, batch_rows=PARQUET_BATCH_ROWS):
+        """索引からParquetファイルを作る（pyarrowが必要です）"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([(column, pa.int32() if column == 'topic_number' else pa.string()) for column in COLUMNS])
+        temp_path = output_path + '.tmp'
+        count = 0
+        with pq.ParquetWriter(temp_path, schema) as writer:
+            batch = []
+            for row in self.rows():
+                row['topic_number'] = int(row['topic_number'] or 0)
+                batch.append(row)
+                if len(batch) >= batch_rows:
+                    writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                    count += len(batch)
+                    batch = []
+            if batch or not count:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                count += len(batch)
+        os.replace(temp_path, output_path)
+        return count
+
+
+def export_consolidated(directory, parquet=True):
+    """索引から一覧のExcelファイル（と、pyarrowがあればParquetファイル）を作り直す関数"""
+    index = MeetingIndex(directory)
+    if not os.path.exists(index.path):
+        return 0
+    # 作り直している間は、追記を待たせます（書きかけの行を読まないように）
+    with _index_lock:
+        removed = index.compact()
+        if removed:
+            logging.info(f"会議一覧から、処理し直す前の{removed}行を取り除きました。")
+        count = index.write_workbook(os.path.join(directory, WORKBOOK_FILE_NAME))
+        if parquet:
+            if parquet_available():
+                index.write_parquet(os.path.join(directory, PARQUET_FILE_NAME))
+            else:
+                logging.info("Parquetファイルを書き出すにはpyarrowが必要です（pip install pyarrow）。")
+    logging.info(f"会議一覧を更新しました: {count}行")
+    return count
@@ -1,25 +1,57 @@
 import os
 import json
-import google.generativeai as genai
 import openpyxl
 import logging
 import argparse
-from openpyxl.styles import Alignment
-from openpyxl.utils.datetime import from_excel
 from dotenv import load_dotenv
-import subprocess
+import asyncio
 import concurrent.futures
+import multiprocessing
+import atexit
+import contextlib
+import contextvars
+import glob
+import hashlib
+import re
+import shutil
+import sqlite3
+import tempfile
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import threading
 import sys
 from pathlib import Path
 import time
-import google.api_core.exceptions
+import math
 from docx import Document
 import datetime
 import xml.parsers.expat
 import webbrowser
+from api_key_pool import ApiKeyPool, estimate_audio_tokens
+from retry_policy import RetryPolicy, RetryBudget, classify_error, retry_after_from, RETRYABLE, RATE_LIMITED, KEY_INVALID, PERMANENT
+from transcript_cache import TranscriptCache
+from job_manifest import JobManifest, STAGES
+from job_ledger import JobLedger
+from audio_upload import AudioPayload, ByteBudget
+from gemini_clients import GeminiClientPool
+from audio_chunks import plan_chunks, split_evenly, segment_to_files, pipe_chunks, encoding_for, target_chunk_seconds, DEFAULT_CHUNK_SECONDS, DEFAULT_CHUNK_MAX_BYTES
+from media_probe import probe_media
+from docx_template import load_template
+from settings_store import SettingsStore, write_json_atomic
+from workbook_styles import register_styles, styled_cell, LABEL_STYLE, CONTENT_STYLE
+from meeting_index import MeetingIndex, export_consolidated
+from minutes_batch import read_minutes_data, find_extraction_workbooks, create_minutes_bulk
+from voice_activity import detect_speech, plan_speech_chunks, speech_seconds, DEFAULT_DROP_SILENCE_SECONDS
+from transcript_stitch import stitch_transcripts
+from agenda_extraction import (
+    create_chunk_extraction_prompt, create_merge_prompt, create_repair_prompt, parse_agenda_json, parse_agenda_items,
+    merge_agenda_items, merge_listing, format_agenda, EXTRACTION_CONFIG, EXTRACTION_INSTRUCTIONS, MERGE_INSTRUCTIONS, MAX_TOPICS, CIRCLED_NUMBERS,
+)
+from token_accounting import TokenLedger, estimate_prompt_tokens, usage_from
+from pipeline_metrics import MetricsRegistry, JobTrace, key_label
+from transcription_backends import CallableBackend, FallbackBackend, LocalWhisperBackend
+from request_hedging import HedgePolicy
+from async_engine import PipelineEngine, SharedSemaphore, TkBridge, StageTimeout, gather_all, report_stage, run_blocking, with_timeout
 
 # ユーザーディレクトリのDocumentsフォルダのパスを取得
 documents_path = Path.home() / "Documents"
@@ -60,104 +92,64 @@ project_dir = os.path.dirname(os.path.abspath(__file__))
 # APIキーの設定
 API_KEYS = [os.getenv(f'GEMINI_API_KEY_{i}') for i in range(1, 11)]  # 10個のAPIキーを取得
 
-# 処理済みファイルのログファイル
+# 以前の処理済みファイルのログ（ジョブの台帳を初めて開くときに取り込みます）
 PROCESSED_FILES_LOG = os.path.join(current_dir, 'processed_files.json')
 
-def load_processed_files():
-    # この関数は、すでに処理したファイルのリストを読み込みます。
-    if os.path.exists(PROCESSED_FILES_LOG):
-        # もしログファイルが存在するなら
-        with open(PROCESSED_FILES_LOG, 'r', encoding='utf-8') as f:
-            return json.load(f)  # ファイルを開いて内容を読み込みます
-    return {}  # ファイルがなけば空のリストを返します
-
-def save_processed_files(processed_files):
-    # この関数は、処理したファイルのリストを保存します。
-    with open(PROCESSED_FILES_LOG, 'w', encoding='utf-8') as f:
-        json.dump(processed_files, f, indent=2, ensure_ascii=False)  # ファイルに書き込みます
-
-def get_unprocessed_audio_files():
+job_ledger = None  # 処理した録音とジョブの記録（SQLite）
+job_ledger_lock = threading.Lock()
+
+def get_job_ledger():
+    """処理した録音とジョブの記録の台帳を返す関数"""
+    global job_ledger
+    with job_ledger_lock:
+        if job_ledger is None:
+            job_ledger = JobLedger(Path.home() / ".my_app" / "job_ledger.sqlite3")
+            imported = job_ledger.import_processed_files(PROCESSED_FILES_LOG)
+            if imported:
+                logging.info(f"processed_files.jsonから{imported}件の処理済みファイルを台帳に取り込みました。")
+        return job_ledger
+
+# 処理対象とする音声ファイルの拡張子
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.wav')
+# 分割途中の一時ファイルの名前（例: 会議.mp3_part2.mp3）
+PART_FILE_PATTERN = re.compile(r'\.(mp3|m4a|wav|flac)_part\d+\.[^.]+$', re.IGNORECASE)
+
+def collect_audio_files(patterns):
+    """ディレクトリやglobパターンから音声ファイルの一覧を作る関数"""
+    # ディレクトリならその直下の音声ファイルを、それ以外はglobとして展開します
+    audio_files = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [entry.path for entry in os.scandir(pattern) if entry.is_file()]
+        else:
+            candidates = glob.glob(pattern, recursive=True)
+        for path in sorted(candidates):
+            path = os.path.abspath(path)
+            if not path.lower().endswith(AUDIO_EXTENSIONS):
+                continue
+            # 分割途中の一時ファイル（元の名前_partN.拡張子）は対象外にします
+            if PART_FILE_PATTERN.search(os.path.basename(path)):
+                logging.info(f"分割途中の一時ファイルなので対象外にします: {path}")
+                continue
+            if path not in seen:
+                seen.add(path)
+                audio_files.append(path)
+    return audio_files
+
+def get_unprocessed_audio_files(patterns=None):
     # この関数は、まだ処理していない音声ファイルを探します。
-    processed_files = load_processed_files()  # すでに処理したファイルを取得
-    audio_files = [f for f in os.listdir(current_dir) if f.endswith('.mp3')]
-    # フォルダ内のすべての.mp3ファイルをリストにします
-    return [f for f in audio_files if f not in processed_files]
+    ledger = get_job_ledger()
+    # 指定がなければスクリプトのフォルダを探します
+    audio_files = collect_audio_files(patterns or [str(current_dir)])
+    # 処理済みかどうかは中身のハッシュで調べます（別のフォルダにある同じ名前のファイルも区別します）
+    return [f for f in audio_files if not ledger.is_processed(f)]
     # まだ処理していないファイルだけを返します
 
 def create_extraction_prompt(text):
     # この関数は、会議の内容から情報を抽出するための指示を作ります。
-    return f"""
-    この文章はとある会議の内容です。
-    以下の文章から、次の項目を抽出してください：
-    1. 議題①
-    2. 議題①の要約
-    3. 議題②
-    4. 議題②の要約
-    5. 議題③
-    6. 議題③の要約
-    7. 議題④
-    8. 議④の要約
-    9. 議題⑤
-    10. 議題⑤の要約
-    11. 議題⑥
-    12. 議題⑥の要約
-    13. 議題
-    14. 議題⑦の要約
-    15. 議題⑧
-    16. 議題⑧の要約
-    17. 議題⑨
-    18. 議題⑨の要約
-    19. 議題⑩
-    20. 議題⑩の要約
-    21. 議題⑪
-    22. 議題⑪の要約
-    23. 議題⑫
-    24. 議題⑫の要約
-    25. 議題⑬
-    26. 議題⑬の要約
-    27. 議題⑭
-    28. 議題⑭の要約
-    29. 議題⑮
-    30. 議題⑮の要約
-    31. 議題⑯
-    32. 議題⑯の要約
-    33. 議題⑰
-    34. 議題⑰の要約
-    35. 議題⑱
-    36. 議題⑱の要約
-    37. 議題⑲
-    38. 議題⑲の要約
-    39. 議題⑳
-    40. 議題⑳の要約
-
-    抽出する際は、必ず以下の形式で出力してください：
-    議題①: [議題の内容]
-    議題①の要約: [要約内容]
-
-    議題②: [議題の内容]
-    議題②の要約: [要約内容]
-
-    議題③: [議題の内容]
-    議題③の要約: [要約内容]
-
-    ...
-
-    議題⑳: [議題の内容]
-    議題⑳の要約: [要約内容]
-
-    注意事項:
-    - 各議題とその要約を必ず上記の形式で出力してください。
-    - 議題が20個未満の場合は、存在する議題のみを抽出してください。
-    - 要約は簡潔かつ具体的にしてください。
-    - 議題の番号（①、②など）は必ず付けてください。
-    - 各行は必ず「議題○:」または「議題○の要約:」で始まるようにしてください。
-    - 議題や要約の前に「*」や「**」などの記号を付けないでください。
-    - 議題というのはあくまで表現の一つであり、会話内容が議事録形式で記されていれば構いません。インタビューの文章等からも適切に議題を抽出してい。
-    - インタビーのような文章であっても、適切に議題を抽出してください。
-
-    文章:
-    {text}
-    """
+    # 出力の形式はEXTRACTION_CONFIGのJSONスキーマで指定するので、指示文は短くしています。
+    return create_chunk_extraction_prompt(text)
 
 def get_ffmpeg_path():
     if getattr(sys, 'frozen', False):
@@ -169,102 +161,315 @@ def get_ffprobe_path():
         return os.path.join(sys._MEIPASS, 'ffprobe.exe')
     return os.path.join(os.path.dirname(__file__), 'ffprobe.exe')
 
-def split_audio_file(audio_file_path, num_parts):
-    """音声ファイルを指定された数の部分に重なりを持たせて分割する関数"""
+def split_audio_file(audio_file_path, chunks, output_dir=None, encoding=None):
+    """音声ファイルを分割計画（チャンクの一覧）に従って重なりを持たせて分割する関数"""
     # この関数は、長い音声ファイルを小さな部分に分けます。
     # 分けた部分は少し重なりを持つので、途切れないようになっています。
-
-    file_size = os.path.getsize(audio_file_path)  # ファイルの大きさを調べます
-    duration = get_audio_duration(audio_file_path)  # 音声ファイルの長さを取得します
-    part_duration = duration / num_parts  # 各部分の長さを計算します
-    overlap_duration = part_duration * 0.1  # 10%の重なりを持たせます
-
-    parts = []  # 分割した声フイルのリストを作ります
-    for i in range(num_parts):
-        # 部分の開始時間を計算します
-        start_time = max(0, i * part_duration - (overlap_duration if i > 0 else 0))
-        # 新しい音声ファイルの名前を決めます
-        part_file = f"{audio_file_path}_part{i+1}.mp3"  # 拡張子をmp3のままにします
-
-        # 音声ファイルの種類に応じて、分割の法を変えます
-        if audio_file_path.endswith('.mp3'):
-            # MP3ファイルの場合の分割方法
-            command = [
-                str(get_ffmpeg_path()),  # ffmpegといソフトウェアのパスを取得します
-                '-y',  # 同じ名前のファイルがあれば上書きします
-                '-i', audio_file_path,  # 元の音声ファイルを指定します
-                '-ss', str(start_time),  # 開始時間を指定します
-                '-t', str(part_duration + (overlap_duration if i < num_parts - 1 else 0)),  # 部分の長さを指定します
-                '-c', 'copy',  # 音声をそのままコピーします（音質を変えません）
-                part_file  # 新しい音声ファイルの名前を指定します
-            ]
-        elif audio_file_path.endswith('.m4a'):
-            # M4Aファイルの場合の分方法
-            part_file = f"{audio_file_path}_part{i+1}.m4a"  # 拡m4aまま
-            command = [
-                str(get_ffmpeg_path()),
-                '-y',
-                '-i', audio_file_path,
-                '-ss', str(start_time),
-                '-t', str(part_duration + (overlap_duration if i < num_parts - 1 else 0)),
-                '-c', 'copy',
-                part_file
-            ]
-        elif audio_file_path.endswith('.wav'):
-            # WAVファイルの場合の分割方法
-            part_file = f"{audio_file_path}_part{i+1}.wav"  # 拡張子をwavのままにしま
-            command = [
-                str(get_ffmpeg_path()),
-                '-y',
-                '-i', audio_file_path,
-                '-ss', str(start_time),
-                '-t', str(part_duration + (overlap_duration if i < num_parts - 1 else 0)),
-                '-c', 'pcm_s16le',  # WAV用の音声形式を指定します
-                part_file
-            ]
-
-        # 音声ファイルを実際に分割します
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if result.returncode != 0:
-            # エラーが起きた場合は記録します
-            logging.error(f"FFmpegエラー: {result.stderr}")
-        parts.append(part_file)  # 分割したファイルをリストに追加します
-
-    return parts  # 割したファイルのリストを返しす
+    # ffmpegは1回だけ起動し、元のファイルを1度読むだけですべての部分を書き出します。
+    # 古い呼び出し方（分割数を整数で渡す）にも対応します
+    if isinstance(chunks, int):
+        chunks = split_evenly(get_audio_duration(audio_file_path), chunks)
+    if output_dir is None:
+        output_dir = os.path.dirname(os.path.abspath(audio_file_path))
+    return segment_to_files(str(get_ffmpeg_path()), audio_file_path, chunks, output_dir, encoding=encoding)
+
+def audio_encoding_for(audio_file_path, settings):
+    """設定に従って、チャンクを書き出すときのエンコードを決める関数"""
+    # 既定ではモノラル・16kHzのMP3に変換し、アップロードするデータ量を減らします
+    return encoding_for(
+        audio_file_path,
+        settings.get('audio_encoding', 'speech'),
+        sample_rate=settings.get('speech_sample_rate', 16000),
+        bitrate=settings.get('speech_bitrate', '32k'),
+    )
 
 def get_audio_duration(audio_file_path):
     """音声ファイルの長さを取得する関数"""
     # この関数は、音声ファイルの再生時間（長さ）を秒単位で取得します
+    # WAV・MP3・M4Aはファイルの先頭（ヘッダー）から読み取り、読めないときだけffprobeを使います
+    # 同じファイルの結果は覚えておくので、何度呼んでもすぐに返ります
+    return probe_media(audio_file_path, get_ffprobe_path()).duration
 
-    # ffprobeというツールを使うためのコマンドを準備します
-    ffprobe_path = get_ffprobe_path()
-    command = [ffprobe_path, "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", audio_file_path]
-
-    # 準備したコマンドを実行し、結果を取得します
-    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-    # 結果から音声ファイルの長さ（秒）を取り出し、小数点の数値として返します
-    return float(result.stdout.strip())
+# 文字起こし・情報抽出に使うモデル
+MODEL_NAME = 'gemini-1.5-pro'
+# APIキーごとのGeminiクライアント（ジョブをまたいで接続を使い回します）
+gemini_clients = GeminiClientPool(MODEL_NAME)
 
 # グローバル変数の定義
 transcription_prompt = ""
+api_request_semaphore = None  # 全ジョブで共有するAPI同時リクエスト数の上限（Noneなら無制限）
+
+def set_api_concurrency(max_requests):
+    """全ジョブ共通のAPI同時リクエスト数の上限を設定する関数"""
+    global api_request_semaphore
+    # 同期の呼び出し（スレッド）と非同期の呼び出し（イベントループ）で同じ枠を共有します
+    api_request_semaphore = SharedSemaphore(max_requests) if max_requests else None
+
+@contextlib.contextmanager
+def api_request_slot():
+    """API呼び出しの間だけ同時リクエスト枠を確保する"""
+    semaphore = api_request_semaphore
+    if semaphore is None:
+        yield
+        return
+    with semaphore:
+        yield
+
+@contextlib.asynccontextmanager
+async def api_request_slot_async():
+    """api_request_slotの非同期版（枠が空くまでイベントループを止めずに待ちます）"""
+    semaphore = api_request_semaphore
+    if semaphore is None:
+        yield
+        return
+    await semaphore.acquire_async()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+api_key_pool = None  # 全ジョブで共有するAPIキープール
+api_key_pool_lock = threading.Lock()
+
+def get_api_key_pool(api_keys):
+    """全ジョブで共有するAPIキープールを返す関数（キーが変わったら作り直します）"""
+    global api_key_pool
+    # 設定はロックを取る前に読みます（設定の変更の通知がこのロックを取るため）
+    settings = load_settings()
+    with api_key_pool_lock:
+        if api_key_pool is None or api_key_pool.api_keys != list(dict.fromkeys(api_keys)):
+            api_key_pool = ApiKeyPool(
+                api_keys,
+                requests_per_minute=settings.get('key_requests_per_minute'),
+                tokens_per_minute=settings.get('key_tokens_per_minute'),
+                max_in_flight=settings.get('key_max_in_flight', 1),
+                cooldown_seconds=settings.get('key_cooldown_seconds', 60),
+            )
+        return api_key_pool
+
+hedge_policy = None  # 文字起こしのリクエストを追加で送る方針（全ジョブで所要時間の記録を共有します）
+hedge_policy_lock = threading.Lock()
+
+def get_hedge_policy():
+    """文字起こしのhedged requestの方針を返す関数（設定で無効にされていればNone）"""
+    global hedge_policy
+    settings = load_settings()
+    if not settings.get('hedge_enabled', True):
+        return None
+    with hedge_policy_lock:
+        if hedge_policy is None:
+            hedge_policy = HedgePolicy(
+                percentile=settings.get('hedge_percentile', 95),
+                max_extra_ratio=settings.get('hedge_max_extra_ratio', 0.1),
+                min_samples=settings.get('hedge_min_samples', 20),
+            )
+        return hedge_policy
+
+transcript_cache = None  # 文字起こし結果のキャッシュ
+transcript_cache_lock = threading.Lock()
+
+def get_transcript_cache():
+    """文字起こし結果のキャッシュを返す関数（設定で無効にされていればNone）"""
+    global transcript_cache
+    settings = load_settings()
+    if not settings.get('cache_enabled', True):
+        return None
+    with transcript_cache_lock:
+        if transcript_cache is None:
+            transcript_cache = TranscriptCache(
+                Path.home() / ".my_app" / "transcript_cache",
+                max_bytes=int(settings.get('cache_max_mb', 200) * 1024 * 1024),
+                max_age_seconds=settings.get('cache_max_age_days', 30) * 24 * 60 * 60,
+            )
+        return transcript_cache
+
+metrics = MetricsRegistry()  # 工程の時間・リトライ・送信量・トークン数のメトリクス
+metrics.describe('stage_seconds', "工程ごとの所要時間（秒）")
+metrics.describe('request_seconds', "APIキーごとのリクエストの所要時間（秒）")
+metrics.describe('key_wait_seconds', "APIキーが空くまで待った時間（秒）")
+metrics.describe('requests_total', "APIキー・工程・結果ごとのリクエスト数")
+metrics.describe('retries_total', "工程・エラーの種類ごとのリトライ数")
+metrics.describe('backoff_seconds_total', "リトライ前に待った時間の合計（秒）")
+metrics.describe('hedges_total', "応答が遅いため別のキーでも送ったリクエストの数")
+metrics.describe('hedge_wins_total', "別のキーでも送ったリクエストで、先に成功した方（primary・hedge）ごとの数")
+metrics.describe('audio_bytes_sent_total', "送信した音声データのバイト数")
+metrics.describe('tokens_total', "工程ごとの入出力トークン数")
+metrics.describe('cache_hits_total', "文字起こし結果のキャッシュヒット数")
+metrics.describe('jobs_total', "結果ごとのジョブ数")
+
+def get_metrics_directory():
+    """トレースとメトリクスのファイルを保存するフォルダのパスを返す関数"""
+    directory = load_settings().get('metrics_directory')
+    return Path(directory) if directory else Path.home() / ".my_app" / "metrics"
+
+def open_job_trace(audio_file_path):
+    """1件のジョブのトレースを開く関数（設定で無効にされていればファイルには書き出しません）"""
+    path = None
+    if load_settings().get('metrics_enabled', True):
+        stem = os.path.splitext(os.path.basename(audio_file_path))[0]
+        path = get_metrics_directory() / "traces" / f"{time.strftime('%Y%m%d-%H%M%S')}_{stem}.jsonl"
+    return JobTrace(path, metrics, job=os.path.basename(audio_file_path))
+
+# 実行中のジョブのトレース（トークン数をジョブごとに集計するのに使います）
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+def write_metrics():
+    """これまでのメトリクスをPrometheusのテキスト形式で書き出す関数"""
+    if not load_settings().get('metrics_enabled', True):
+        return
+    try:
+        metrics.write_prometheus(get_metrics_directory() / "minutes.prom")
+    except OSError as e:
+        logging.error(f"メトリクスの書き出し中にエラーが発生しました: {str(e)}")
+
+def record_usage(stage, response, estimated=0):
+    """応答のトークン使用量を台帳とメトリクスに記録する関数（estimatedはキーの予約に使った見積もり）"""
+    prompt_tokens, output_tokens = usage_from(response)
+    token_ledger.record(stage, estimated, prompt_tokens, output_tokens)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_tokens(prompt_tokens, output_tokens)
+    metrics.inc('tokens_total', prompt_tokens, stage=stage, direction='in')
+    metrics.inc('tokens_total', output_tokens, stage=stage, direction='out')
+
+token_ledger = TokenLedger()  # 工程ごとのトークン使用量
 
 def load_prompt_from_settings():
-    """settings.jsonからプロンプトを読み込む関数"""
-    settings_path = get_settings_path()
-    logging.info(f"Settings path: {settings_path}")  # 追加: パスをログに出力
-    if os.path.exists(settings_path):
-        logging.info("settings.jsonが見つかりました。")  # 追加: ファイ存在確認
-        with open(settings_path, 'r', encoding='utf-8') as f:
+    """設定からプロンプトを読み込む関数"""
+    logging.info(f"Settings path: {settings_store.path}")  # 追加: パスをログに出力
+    return settings_store.get('transcription_prompt', '') or ''  # デフォルト値を空文字に変更
+
+upload_byte_budget = None  # 全ジョブで共有する、読み込み中の音声データの上限
+upload_byte_budget_lock = threading.Lock()
+
+def get_upload_byte_budget():
+    """全ジョブで共有する音声データの予約枠を返す関数"""
+    global upload_byte_budget
+    settings = load_settings()
+    with upload_byte_budget_lock:
+        if upload_byte_budget is None:
+            upload_byte_budget = ByteBudget(int(settings.get('max_inflight_mb', 200) * 1024 * 1024))
+        return upload_byte_budget
+
+def open_audio_payload(audio_file):
+    """チャンクを1度だけ読み込むためのAudioPayloadを作る関数"""
+    settings = load_settings()
+    return AudioPayload(audio_file, get_upload_byte_budget(),
+                        int(settings.get('inline_max_mb', 8) * 1024 * 1024))
+
+@contextlib.asynccontextmanager
+async def open_audio_payload_async(audio_file):
+    """open_audio_payloadの非同期版
+
+    予約枠の空きはイベントループの上で待ち、読み込みだけをスレッドで行います。
+    途中でキャンセルされても予約した枠を返します。
+    """
+    payload = open_audio_payload(audio_file)
+    await payload.reserve_async()
+    await run_blocking(payload.read, on_cancel=lambda opened: opened.__exit__(None, None, None))
+    try:
+        yield payload
+    finally:
+        payload.__exit__(None, None, None)
+
+def upload_audio(api_key, source, mime_type, display_name):
+    """大きいチャンクをGeminiのファイルAPIでアップロードする関数"""
+    uploaded = gemini_clients.upload_file(api_key, source, mime_type, display_name)
+    size = source.getbuffer().nbytes if hasattr(source, 'getbuffer') else os.path.getsize(source)
+    metrics.inc('audio_bytes_sent_total', size, mode='file')
+    # 処理中のファイルはまだ使えないので、使えるようになるまで待ちます
+    while uploaded.state.name == 'PROCESSING':
+        time.sleep(1)
+        uploaded = gemini_clients.get_file(api_key, uploaded.name)
+    if uploaded.state.name == 'FAILED':
+        raise ValueError(f"ファイルのアップロードに失敗しました: {display_name}")
+    return uploaded
+
+async def upload_audio_async(api_key, source, mime_type, display_name):
+    """upload_audioの非同期版（キャンセルされたら、送信し終わった後にファイルを削除します）"""
+    uploaded = await run_blocking(gemini_clients.upload_file, api_key, source, mime_type, display_name,
+                                  on_cancel=lambda finished: delete_uploaded_audio_later(api_key, finished))
+    size = source.getbuffer().nbytes if hasattr(source, 'getbuffer') else os.path.getsize(source)
+    metrics.inc('audio_bytes_sent_total', size, mode='file')
+    try:
+        while uploaded.state.name == 'PROCESSING':
+            await asyncio.sleep(1)
+            uploaded = await asyncio.to_thread(gemini_clients.get_file, api_key, uploaded.name)
+    except asyncio.CancelledError:
+        delete_uploaded_audio_later(api_key, uploaded)
+        raise
+    if uploaded.state.name == 'FAILED':
+        raise ValueError(f"ファイルのアップロードに失敗しました: {display_name}")
+    return uploaded
+
+def delete_uploaded_audio_later(api_key, uploaded):
+    """アップロードしたチャンクを、イベントループを止めずにスレッドで削除する関数"""
+    def delete():
+        try:
+            delete_uploaded_audio(api_key, uploaded)
+        except Exception as e:
+            logging.error(f"アップロードしたファイルの削除に失敗しました: {uploaded.name} - {str(e)}")
+    asyncio.get_running_loop().run_in_executor(None, delete)
+
+def delete_uploaded_audio(api_key, uploaded):
+    """アップロードしたチャンクを削除する関数"""
+    gemini_clients.delete_file(api_key, uploaded.name)
+
+def transcribe_audio_once(audio_file, api_key, payload=None):
+    """指定されたAPIキーで音声ファイルを1回だけ文字起こしする関数（失敗したら例外を送出します）"""
+    # 読み込み済みのチャンクが渡されなければ、ここで読み込みます
+    if payload is None:
+        with open_audio_payload(audio_file) as payload:
             try:
-                settings = json.load(f)
-                logging.info("settings.jsonを正常に読み込みました。")  # 追加: 読み込み成功
-                return settings.get('transcription_prompt', '')  # デフォルト値を空文字に変更
-            except json.JSONDecodeError as e:
-                logging.error(f"JSONデコーエラー: {str(e)}")  # 追加: JSONデコードエラー
-    else:
-        logging.error("settings.jsonが見つかりません。")  # 追加: ファイルが見つからない場合
-    return ''  # ファイルが存在しない場合も空文字を返す
+                return transcribe_audio_once(audio_file, api_key, payload)
+            finally:
+                payload.delete_uploads(delete_uploaded_audio)
+
+    # このキー専用のクライアントを使うGeminiモデルを取得します（他のスレッドのキーと混ざりません）
+    model = gemini_clients.model(api_key)
+
+    # モデルを使って音声データを文字に起こします
+    audio_part = payload.content(api_key, upload_audio)
+    if payload.inline:
+        metrics.inc('audio_bytes_sent_total', payload.size, mode='inline')
+    with api_request_slot():
+        response = model.generate_content(
+            [
+                transcription_prompt,
+                audio_part
+            ]
+        )
+
+    record_usage('transcription', response)
+
+    # 文字起こしが成功したかチェックします（ブロックされた場合などはここで例外になります）
+    text = response.text
+    if not text:
+        raise ValueError("レスポンスにテキストが含まれていません。")
+    logging.info(f"{audio_file}の文字起こしが成功しました。")
+    return text
+
+async def transcribe_audio_once_async(audio_file, api_key, payload):
+    """transcribe_audio_onceの非同期版（応答を待っている間にキャンセルできます）"""
+    model = gemini_clients.async_model(api_key)
+    audio_part = await payload.content_async(api_key, upload_audio_async)
+    if payload.inline:
+        metrics.inc('audio_bytes_sent_total', payload.size, mode='inline')
+    async with api_request_slot_async():
+        response = await model.generate_content_async(
+            [
+                transcription_prompt,
+                audio_part
+            ]
+        )
+
+    record_usage('transcription', response)
+
+    text = response.text
+    if not text:
+        raise ValueError("レスポンスにテキストが含まれていません。")
+    logging.info(f"{audio_file}の文字起こしが成功しました。")
+    return text
 
 def transcribe_audio_with_key(audio_file, api_key, retries=3):
     """指定されたAPIキーを使用て音声ファイルを文字起こしする関数"""
@@ -280,43 +485,22 @@ def transcribe_audio_with_key(audio_file, api_key, retries=3):
         return None
 
     # 指定さた回数（デフォルトは3回）まで文字起こしを試みます
+    policy = RetryPolicy(max_attempts=retries)
     for attempt in range(retries):
         try:
-            # 音声ファイルを開いてデータを読み込みます
-            with open(audio_file, 'rb') as audio:
-                audio_data = audio.read()
-
-            # Geminiモデルを設定します
-            model = genai.GenerativeModel('gemini-1.5-pro')
-            genai.configure(api_key=api_key)
-
-            # モデルを使って音声データを文字に起こします
-            response = model.generate_content(
-                [
-                    transcription_prompt,
-                    {"mime_type": "audio/mp3", "data": audio_data}
-                ]
-            )
-
-            # 文字起こしが成功したかチェックします
-            if hasattr(response, 'text'):
-                # 成功した場合、ログに記録して結果を返します
-                logging.info(f"{audio_file}の文字起こしが成功しました。")
-                return response.text
-            else:
-                # テキストが含まれていない場合はエラーを記録します
-                logging.error(f"文起こし失敗: {audio_file} - レスポンスにテキストが含まれていません。")
-        except google.api_core.exceptions.ResourceExhausted:
-            # APIの利用制限に達した場合のエラーを録します
-            logging.error(f"文字起こし失敗: {audio_file} - 429 Resource has been exhausted (e.g. check quota).")
+            return transcribe_audio_once(audio_file, api_key)
         except Exception as e:
-            # その他のエラーが発生し、エ内容を記録します
+            # エラー内容を記録し、やり直しても成功しないエラーならすぐにあきらめます
             logging.error(f"文字起こし失敗: {audio_file} - {str(e)}")
+            if classify_error(e) in (PERMANENT, KEY_INVALID):
+                break
+            retry_after = retry_after_from(e)
         
-        # リトライが可能な場合は、次の試行を行います
+        # リトライが可能な場合は、バックオフしてから次の試行を行います
         if attempt < retries - 1:
-            logging.info(f"リトライを試みます ({attempt + 2}/{retries})")
-            time.sleep(30)  # 1分待ってから次の試行を行います
+            delay = policy.delay(attempt, retry_after)
+            logging.info(f"{delay:.1f}秒後にリトライを試みます ({attempt + 2}/{retries})")
+            time.sleep(delay)
         else:
             # すべての試行が失敗した場合、最終的なエラーを記録します
             logging.error(f"{audio_file}の文字起こしが{retries}回失敗しました。")
@@ -324,6 +508,331 @@ def transcribe_audio_with_key(audio_file, api_key, retries=3):
     # すべての試行が失敗した場合はNoneを返します
     return None
 
+def release_failed_key(pool, api_key, error, elapsed, stage):
+    """失敗したリクエストのキーを返し、メトリクスに記録する関数（エラーの種類を返します）"""
+    kind = classify_error(error)
+    pool.release(api_key, success=False, exhausted=kind == RATE_LIMITED,
+                 retry_after=retry_after_from(error), disable=kind == KEY_INVALID)
+    metrics.observe('request_seconds', elapsed, key=key_label(api_key), stage=stage)
+    metrics.inc('requests_total', key=key_label(api_key), stage=stage, outcome=kind)
+    return kind
+
+async def request_with_hedge(pool, func, api_key, estimated_tokens=0, hedge=None, label='', stage='request', trace=None):
+    """コルーチン関数func(api_key)を呼び、応答が遅ければ空いている別のキーでも呼ぶ関数（hedged request）
+
+    直近の所要時間の百分位を過ぎても応答がなく、追加で送れる枠とすぐに使えるキーがあるときだけ、
+    同じリクエストをもう1つ送ります。先に成功した方の (結果, キー) を返し、もう一方はキャンセルします。
+    返したキーは呼び出し側で返却します。どちらも失敗したら、最初のキーの例外を送出します。
+    """
+    if hedge is None:
+        return await func(api_key), api_key
+    hedge.started()
+    started = time.perf_counter()
+    tasks = {asyncio.ensure_future(func(api_key)): (api_key, started)}
+    hedge_key = None
+    primary_error = None
+    primary_elapsed = 0.0
+    winner = None
+    try:
+        delay = hedge.delay()
+        if delay is not None:
+            await asyncio.wait(tasks, timeout=delay)
+        if not any(task.done() for task in tasks) and delay is not None:
+            hedge_key = pool.try_acquire(estimated_tokens, exclude=[api_key])
+            if hedge_key is not None and not hedge.allow():
+                pool.cancel(hedge_key)
+                hedge_key = None
+            if hedge_key is not None:
+                logging.info(f"{label}: 応答が{delay:.1f}秒を過ぎたため、別のAPIキーでも送ります。")
+                metrics.inc('hedges_total', stage=stage)
+                if trace:
+                    trace.event('hedge', stage=stage, seconds=round(delay, 3), label=label, key=key_label(hedge_key))
+                tasks[asyncio.ensure_future(func(hedge_key))] = (hedge_key, time.perf_counter())
+
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                key, task_started = tasks.pop(task)
+                elapsed = time.perf_counter() - task_started
+                error = task.exception()
+                if error is None:
+                    # 所要時間の記録は、呼び出し側が待った時間（最初に送ってから）にします。
+                    # 追加で送った方の時間だけを記録すると百分位が下がり、待つ時間も短くなっていくためです
+                    hedge.record(time.perf_counter() - started)
+                    if hedge_key is not None:
+                        metrics.inc('hedge_wins_total', stage=stage, winner='hedge' if key == hedge_key else 'primary')
+                    if key != api_key and primary_error is not None:
+                        # 最初のキーの失敗は、追加で送った方が成功したのでここで記録します
+                        release_failed_key(pool, api_key, primary_error, primary_elapsed, stage)
+                    winner = key
+                    return task.result(), key
+                if key == api_key:
+                    primary_error = error
+                    primary_elapsed = elapsed
+                else:
+                    kind = release_failed_key(pool, key, error, elapsed, stage)
+                    logging.error(f"{label}の追加のリクエストが失敗しました ({kind}): {str(error)}")
+        raise primary_error
+    finally:
+        # 負けた方のリクエストは止め、キーは結果を記録せずに返します
+        # （成功せずに終わったときの最初のキーは、呼び出し側で返します）
+        for task, (key, _) in tasks.items():
+            task.cancel()
+            if key != api_key or winner is not None:
+                pool.cancel(key)
+
+async def call_with_pool(pool, func, label, estimated_tokens=0, policy=None, budget=None, stage='request', trace=None,
+                         timeout=None, hedge=None):
+    """キープールから借りたキーでコルーチン関数func(api_key)を呼び出す関数（結果とキーの組を返します）
+
+    失敗したらエラーの種類に応じてやり直します。利用制限ならそのキーを休ませて別のキーですぐに、
+    一時的なエラーなら指数バックオフで待ってから、やり直しても成功しないエラーならすぐにあきらめます。
+    timeout秒以内に応答がなければ、一時的なエラーとして扱います。
+    hedgeを指定すると、応答の遅いリクエストを空いている別のキーでも送ります（request_with_hedge）。
+    各リクエストの所要時間と結果は、stageごとにメトリクスとトレースに記録します。
+    """
+    policy = policy or RetryPolicy(max_attempts=len(pool) + 2)
+    tried_keys = []
+    for attempt in range(policy.max_attempts):
+        waited = time.perf_counter()
+        # リトライ予算はやり直しの待ち時間にだけ使います（最初の1回はキーが空くまで待ちます）
+        retry_wait = budget.remaining_seconds() if budget and attempt > 0 else None
+        api_key = await pool.acquire_async(estimated_tokens, exclude=tried_keys, timeout=retry_wait)
+        metrics.observe('key_wait_seconds', time.perf_counter() - waited, stage=stage)
+        if api_key is None:
+            if retry_wait is not None:
+                logging.error(f"{label}: リトライ予算の時間内にAPIキーが空きませんでした。")
+            else:
+                logging.error(f"{label}: 使えるAPIキーがありません。")
+            return None, None
+        key = key_label(api_key)
+        start = time.time()
+        started = time.perf_counter()
+        try:
+            request = request_with_hedge(pool, func, api_key, estimated_tokens, hedge, label, stage, trace)
+            result, api_key = await asyncio.wait_for(request, timeout) if timeout else await request
+            key = key_label(api_key)
+        except asyncio.CancelledError:
+            # キャンセルはキーのせいではないので、成功・失敗を記録せずに返します
+            pool.cancel(api_key)
+            if trace:
+                trace.record_span(f"{stage}_request", start, time.perf_counter() - started, 'cancelled', key=key, attempt=attempt, label=label)
+            raise
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                e = TimeoutError(f"{timeout:.0f}秒以内に応答がありませんでした。")
+            elapsed = time.perf_counter() - started
+            kind = release_failed_key(pool, api_key, e, elapsed, stage)
+            retry_after = retry_after_from(e)
+            if trace:
+                trace.record_span(f"{stage}_request", start, elapsed, kind, key=key, attempt=attempt, label=label)
+            logging.error(f"{label}失敗 ({kind}): {str(e)}")
+            if kind == PERMANENT:
+                return None, None
+            if attempt == policy.max_attempts - 1:
+                break
+            if budget and not budget.allow_retry():
+                logging.error(f"{label}: ジョブのリトライ予算を使い切りました。")
+                return None, None
+            tried_keys.append(api_key)
+            metrics.inc('retries_total', stage=stage, kind=kind)
+            if kind == RETRYABLE:
+                delay = policy.delay(attempt, retry_after)
+                logging.info(f"{label}: {delay:.1f}秒後にリトライします ({attempt + 2}/{policy.max_attempts})")
+                metrics.inc('backoff_seconds_total', delay, stage=stage)
+                if trace:
+                    trace.event('backoff', stage=stage, seconds=round(delay, 3), label=label)
+                remaining = budget.remaining_seconds() if budget else None
+                await asyncio.sleep(delay if remaining is None else min(delay, remaining))
+            else:
+                logging.info(f"{label}: 別のAPIキーでリトライします ({attempt + 2}/{policy.max_attempts})")
+            continue
+        elapsed = time.perf_counter() - started
+        pool.release(api_key, success=True)
+        metrics.observe('request_seconds', elapsed, key=key, stage=stage)
+        metrics.inc('requests_total', key=key, stage=stage, outcome='ok')
+        if trace:
+            trace.record_span(f"{stage}_request", start, elapsed, 'ok', key=key, attempt=attempt, label=label)
+        return result, api_key
+
+    logging.error(f"{label}が{policy.max_attempts}回失敗しました。")
+    return None, None
+
+async def transcribe_with_pool(audio_file, pool, estimated_tokens=0, budget=None, trace=None, timeout=None, hedge=None):
+    """キープールから空いているAPIキーを借りて文字起こしする関数（結果とキーの組を返します）"""
+    # チャンクは1度だけ読み込み、リトライや別のキーでも同じデータを使い回します
+    start = time.time()
+    started = time.perf_counter()
+    async with open_audio_payload_async(audio_file) as payload:
+        if trace:
+            # パイプで受け取るチャンクでは、ここにffmpegでの切り出しの時間が含まれます
+            trace.record_span('chunk_read', start, time.perf_counter() - started, chunk=str(audio_file), bytes=payload.size)
+        try:
+            # 同じ音声・プロンプト・モデルの結果がキャッシュにあれば、APIを呼ばずにそれを返します
+            cache = get_transcript_cache()
+            cache_key = cache.make_key_from_digest(await asyncio.to_thread(payload.digest), transcription_prompt, MODEL_NAME) if cache else None
+            if cache:
+                cached_text = cache.get(cache_key)
+                if cached_text is not None:
+                    metrics.inc('cache_hits_total')
+                    if trace:
+                        trace.event('cache_hit', chunk=str(audio_file))
+                    logging.info(f"{audio_file}の文字起こし結果をキャッシュから取得しました。")
+                    return cached_text, None
+
+            result, api_key = await call_with_pool(
+                pool,
+                lambda api_key: transcribe_audio_once_async(audio_file, api_key, payload),
+                f"文字起こし {audio_file}",
+                estimated_tokens,
+                budget=budget,
+                stage='transcription',
+                trace=trace,
+                timeout=timeout,
+                hedge=hedge,
+            )
+        finally:
+            # アップロードしたファイルの削除は待たずに進めます
+            asyncio.get_running_loop().run_in_executor(None, payload.delete_uploads, delete_uploaded_audio)
+
+    if result and cache:
+        try:
+            cache.put(cache_key, result)
+        except OSError as e:
+            logging.error(f"文字起こし結果のキャッシュ保存中にエラーが発生しました: {str(e)}")
+    return result, api_key
+
+local_engine = None  # ローカルの文字起こしモデル（プロセスプールはジョブをまたいで使い回します）
+local_engine_lock = threading.Lock()
+
+def get_local_engine(settings):
+    """ローカルの文字起こしモデルを返す関数（faster-whisperがなければNone）"""
+    global local_engine
+    if not LocalWhisperBackend.available():
+        return None
+    with local_engine_lock:
+        if local_engine is None:
+            local_engine = LocalWhisperBackend(
+                model_size=settings.get('local_model', 'small'),
+                compute_type=settings.get('local_compute_type', 'int8'),
+                workers=settings.get('local_workers', 0),
+            )
+            # 終了時にワーカープロセスを止めます
+            atexit.register(local_engine.close)
+        return local_engine
+
+async def transcribe_locally(audio_file, engine, trace=None):
+    """ローカルのモデルで文字起こしする関数（結果はGeminiと同じキャッシュに、モデル名を分けて保存します）"""
+    async with open_audio_payload_async(audio_file) as payload:
+        cache = get_transcript_cache()
+        cache_key = cache.make_key_from_digest(await asyncio.to_thread(payload.digest), '', engine.model_tag) if cache else None
+        if cache:
+            cached_text = cache.get(cache_key)
+            if cached_text is not None:
+                metrics.inc('cache_hits_total')
+                logging.info(f"{audio_file}の文字起こし結果をキャッシュから取得しました。")
+                return cached_text
+        # メモリに読み込み済みならそのデータを、そうでなければファイルのパスをワーカーに渡します
+        source = payload.data if payload.data is not None else str(audio_file)
+        start = time.time()
+        started = time.perf_counter()
+        try:
+            text = await engine.transcribe_source_async(source)
+            outcome = 'ok' if text else 'empty'
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"ローカルでの文字起こしに失敗しました: {audio_file} - {str(e)}")
+            text = None
+            outcome = 'error'
+        elapsed = time.perf_counter() - started
+    metrics.observe('request_seconds', elapsed, key='local', stage='transcription')
+    metrics.inc('requests_total', key='local', stage='transcription', outcome=outcome)
+    if trace:
+        trace.record_span('transcription_request', start, elapsed, outcome, key='local', label=str(audio_file))
+    if text and cache:
+        try:
+            cache.put(cache_key, text)
+        except OSError as e:
+            logging.error(f"文字起こし結果のキャッシュ保存中にエラーが発生しました: {str(e)}")
+    return text or None
+
+def create_transcription_backend(settings, pool, budget=None, trace=None):
+    """設定に従って文字起こしのバックエンドを作る関数
+
+    transcription_backendが "gemini" ならGeminiだけ、"local" ならローカルのモデルだけ（音声を外に出しません）、
+    "auto" ならGeminiで失敗したチャンクだけをローカルのモデルで文字起こしします。
+    """
+    mode = settings.get('transcription_backend', 'gemini')
+
+    request_timeout = settings.get('request_timeout_seconds', DEFAULT_REQUEST_TIMEOUT_SECONDS)
+    # 応答の遅いチャンクは、空いている別のキーでも送ってジョブ全体の完了を早めます
+    hedge = get_hedge_policy()
+
+    # どのチャンクも、その時点でいちばん余裕のあるAPIキーで処理します
+    async def transcribe_with_gemini(audio_part, chunk):
+        estimated_tokens = estimate_audio_tokens(chunk.duration, transcription_prompt)
+        return (await transcribe_with_pool(audio_part, pool, estimated_tokens, budget, trace, request_timeout, hedge))[0]
+    gemini = CallableBackend(
+        'gemini',
+        lambda audio_part, chunk: pipeline_engine.run(transcribe_with_gemini(audio_part, chunk)),
+        pool.capacity,
+        async_func=transcribe_with_gemini,
+    )
+    if mode == 'gemini':
+        return gemini
+
+    engine = get_local_engine(settings)
+    if engine is None:
+        if mode == 'local':
+            # 社外秘の録音などを誤ってGeminiへ送らないよう、ここで止めます
+            logging.error("ローカルでの文字起こしにはfaster-whisperが必要です（pip install faster-whisper）。")
+            return None
+        logging.warning("faster-whisperがインストールされていないため、Geminiだけで文字起こしします。")
+        return gemini
+    local = CallableBackend(
+        'local',
+        lambda audio_part, chunk: pipeline_engine.run(transcribe_locally(audio_part, engine, trace)),
+        engine.max_workers,
+        async_func=lambda audio_part, chunk: transcribe_locally(audio_part, engine, trace),
+    )
+    if mode == 'local':
+        return local
+    return FallbackBackend(gemini, local)
+
+def generate_agenda(prompt, api_key, stage, estimated=0):
+    """指示を送り、スキーマを指定したJSONで議題を受け取る関数
+
+    JSONを読み取れなければ、応答だけを添えて1度だけ修正を依頼します（本文は送り直しません）。
+    """
+    model = gemini_clients.model(api_key)
+    with api_request_slot():
+        response = model.generate_content(prompt, generation_config=EXTRACTION_CONFIG)
+    record_usage(stage, response, estimated)
+    try:
+        return parse_agenda_json(response.text)
+    except ValueError as e:
+        logging.warning(f"抽出結果を読み取れなかったため、修正を依頼します: {str(e)}")
+        with api_request_slot():
+            repaired = model.generate_content(create_repair_prompt(response.text, e), generation_config=EXTRACTION_CONFIG)
+        record_usage(f"{stage}_repair", repaired)
+        return parse_agenda_json(repaired.text)
+
+async def generate_agenda_async(prompt, api_key, stage, estimated=0):
+    """generate_agendaの非同期版"""
+    model = gemini_clients.async_model(api_key)
+    async with api_request_slot_async():
+        response = await model.generate_content_async(prompt, generation_config=EXTRACTION_CONFIG)
+    record_usage(stage, response, estimated)
+    try:
+        return parse_agenda_json(response.text)
+    except ValueError as e:
+        logging.warning(f"抽出結果を読み取れなかったため、修正を依頼します: {str(e)}")
+        async with api_request_slot_async():
+            repaired = await model.generate_content_async(create_repair_prompt(response.text, e), generation_config=EXTRACTION_CONFIG)
+        record_usage(f"{stage}_repair", repaired)
+        return parse_agenda_json(repaired.text)
+
 def extract_information(text, api_key):
     # この関数は、テキストから重要な情報を抽出します
 
@@ -335,20 +844,13 @@ def extract_information(text, api_key):
         logging.error("情報抽出に使用するAPIキーが設定されていません。")
         return
 
-    # APIキーを設定して、AIモデルを準備します
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-1.5-pro')
-    
-    # 情報抽出のための指示文を作ります
-    prompt = create_extraction_prompt(cleaned_text)
-
     try:
         # 情報抽出を開始します
         logging.info("情報抽出を開始します。")
-        # AIモデルに指示を送り、結果を受け取ります
-        response = model.generate_content(prompt)
-        # 結果のテキストから余分な空白を取り除きます
-        extracted_text = response.text.strip()
+        estimated = estimate_prompt_tokens(EXTRACTION_INSTRUCTIONS, cleaned_text)
+        items = generate_agenda(create_extraction_prompt(cleaned_text), api_key, 'extraction', estimated)
+        # create_excelが読み取れる形式で返します
+        extracted_text = format_agenda(items)
         # 抽出結果を記録します
         logging.info(f"抽出結果全体: {extracted_text}")
         # 抽出したテキストを返します
@@ -358,17 +860,47 @@ def extract_information(text, api_key):
         logging.exception(f"情報抽出中にエラーが発生しました: {str(e)}")
         raise
 
-def create_excel(extracted_info, output_file):
-    # 新しいExcelワークブックを作成します
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "議事録"
+async def extract_chunk_agenda(text, index, total, api_key):
+    """1つのチャンクの文字起こしから (議題, 要約) のリストを抽出する関数（map）"""
+    text = " ".join(text.split())
+    estimated = estimate_prompt_tokens(EXTRACTION_INSTRUCTIONS, text)
+    items = await generate_agenda_async(create_chunk_extraction_prompt(text), api_key, 'extraction', estimated)
+    logging.info(f"チャンク{index + 1}/{total}から{len(items)}個の議題を抽出しました。")
+    return items
+
+async def merge_agenda(partials, pool, label, budget=None, trace=None, timeout=None):
+    """チャンクごとの議題をまとめて①〜⑳の番号を振り直す関数（reduce）"""
+    partials = [items for items in partials if items]
+    merged = merge_agenda_items(partials)
+    if len(partials) <= 1 and len(merged) <= MAX_TOPICS:
+        # 1区間分しかなければ、APIを呼ばずにそのまま番号を振ります
+        return format_agenda(merged)
+
+    estimated = estimate_prompt_tokens(MERGE_INSTRUCTIONS, merge_listing(partials))
+    items, _ = await call_with_pool(
+        pool,
+        lambda api_key: generate_agenda_async(create_merge_prompt(partials), api_key, 'merge', estimated),
+        label,
+        estimated,
+        budget=budget,
+        stage='merge',
+        trace=trace,
+        timeout=timeout,
+    )
+    if not items:
+        # 統合に失敗したら、同じ名前の議題だけをまとめた結果を使います
+        logging.error(f"{label}に失敗したため、区間ごとの議題を順に並べます。")
+        items = merged
+    return format_agenda(items[:MAX_TOPICS])
 
-    # 列の幅を設定します
-    ws.column_dimensions['A'].width = 20  # A列（議題）の幅を20に設定
-    ws.column_dimensions['B'].width = 80  # B列（内容）の幅を80に設定
+def create_excel(extracted_info, output_file):
+    # 書き込み専用モードで新しいExcelワークブックを作成します（1行ずつ書き出すので、行が多くても速く済みます）
+    wb = openpyxl.Workbook(write_only=True)
+    # 枠線・太字・背景色・折り返しは、セルごとに作らず名前付きスタイルとして1度だけ登録します
+    register_styles(wb)
+    ws = wb.create_sheet("議事録")
 
-    # 会議詳細情報を追加します
+    # 会議詳細情報の項目（内容は後から手で入力します）
     meeting_details = [
         "会議名",
         "日時",
@@ -376,91 +908,193 @@ def create_excel(extracted_info, output_file):
         "参加者",
         "欠席者"
     ]
+    rows = [(detail, None) for detail in meeting_details]
 
-    # 会議詳細情報をExcelに書き込みます
-    for i, detail in enumerate(meeting_details, start=1):
-        ws.cell(row=i, column=1, value=detail)  # A列に項目名を書き込み
-        ws.cell(row=i, column=1).font = openpyxl.styles.Font(bold=True)  # 太字に設定
-        ws.cell(row=i, column=1).fill = openpyxl.styles.PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")  # 背景色を設定
-
-    row = 6  # 会議詳細情報の後から議題の書き込みを開始します
-
-    # 抽出された情報を行ごとに分割します
-    lines = extracted_info.split('\n')
-    current_topic = ""
-    current_summary = ""
-
-    # 各行を処理して議題と要約を抽出します
-    for line in lines:
-        line = line.strip()
-        if line.startswith("議題"):
-            if current_topic and current_summary:
-                # 前の議題を書き込みます
-                ws.cell(row=row, column=1, value=current_topic)
-                cell = ws.cell(row=row, column=2, value=current_summary)
-                cell.alignment = Alignment(wrap_text=True)  # テキストを折り返して表示
-                row += 1
-            parts = line.split(':', 1)
-            if len(parts) == 2:
-                current_topic = parts[0].strip()
-                current_summary = parts[1].strip()
-            else:
-                current_topic = line
-                current_summary = ""
-        elif "の要約" in line:
-            if current_topic and "の要約:" in line:
-                current_summary = line.split("の要約:", 1)[1].strip()
-        elif current_summary:
-            current_summary += " " + line.strip()
-
-    # 最後の議題を書き込みます
-    if current_topic and current_summary:
-        ws.cell(row=row, column=1, value=current_topic)
-        cell = ws.cell(row=row, column=2, value=current_summary)
-        cell.alignment = Alignment(wrap_text=True)
-
-    # セルのスタイルを設定します
-    for row in ws['A1:B'+str(ws.max_row)]:
-        for cell in row:
-            # すべてのセルに細い枠線を設定
-            cell.border = openpyxl.styles.Border(left=openpyxl.styles.Side(style='thin'), 
-                                                 right=openpyxl.styles.Side(style='thin'), 
-                                                 top=openpyxl.styles.Side(style='thin'), 
-                                                 bottom=openpyxl.styles.Side(style='thin'))
-            if cell.column == 1:  # A列（議題）のセルの場合
-                cell.font = openpyxl.styles.Font(bold=True)  # 太字に設定
-                cell.fill = openpyxl.styles.PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")  # 背景色を設定
-            elif cell.column == 2:  # B列（内容）のセルの場合
-                cell.alignment = Alignment(wrap_text=True)  # テキストを折り返して表示
-
-    # B列の幅を内容に合わせて自動調整します
-    for column_cells in ws.columns:
-        length = max(len(str(cell.value)) for cell in column_cells)
-        if column_cells[0].column_letter == 'B':
-            ws.column_dimensions[column_cells[0].column_letter].width = min(100, max(80, length))
+    # 抽出された議題を読み取り、議題と要約をそれぞれ1行ずつ書き込みます
+    items = agenda_items_of(extracted_info)
+    for number, (topic, summary) in zip(CIRCLED_NUMBERS, items):
+        rows.append((f"議題{number}", topic))
+        rows.append((f"議題{number}の要約", summary))
+
+    # 列の幅を設定します（書き込み専用モードでは行より先に設定します）
+    ws.column_dimensions['A'].width = 20  # A列（議題）の幅を20に設定
+    # B列の幅を内容に合わせて調整します
+    length = max(len(str(value)) for _, value in rows)
+    ws.column_dimensions['B'].width = min(100, max(80, length))
+
+    for label, value in rows:
+        ws.append([styled_cell(ws, label, LABEL_STYLE), styled_cell(ws, value, CONTENT_STYLE)])
 
     # Excelファイルを保存します
     try:
         wb.save(output_file)
         logging.info(f"Excelファイルが正常に作成されました: {output_file}")
+        return True
     except PermissionError:
         logging.error(f"Excelファイルの保存に失敗しました。書き込み権限がありません: {output_file}")
     except Exception as e:
         logging.error(f"Excelファイルの保存中にエラーが発生しました: {str(e)}")
+    return False
+
+def agenda_items_of(extracted_info):
+    """抽出結果を [(議題, 要約), ...] の形で返す関数（Excelに書ける数までにします）"""
+    items = extracted_info if isinstance(extracted_info, list) else parse_agenda_items(extracted_info)
+    return [tuple(item) for item in items][:len(CIRCLED_NUMBERS)]
+
+def append_to_meeting_index(audio_file_path, extracted_info, xlsx_file):
+    """会議一覧の索引に、1件の会議の議題と要約を追記する関数（設定で無効にされていれば何もしません）"""
+    if not load_settings().get('meeting_index_enabled', True):
+        return
+    try:
+        count = MeetingIndex(load_output_directory()).append(audio_file_path, agenda_items_of(extracted_info), xlsx_file)
+        logging.info(f"会議一覧の索引に{count}件の議題を追記しました。")
+    except OSError as e:
+        logging.error(f"会議一覧の索引への追記に失敗しました: {str(e)}")
+
+def export_meeting_index():
+    """会議一覧のExcelファイル（とParquetファイル）を索引から作り直す関数"""
+    settings = load_settings()
+    if not settings.get('meeting_index_enabled', True):
+        return 0
+    try:
+        return export_consolidated(load_output_directory(), parquet=settings.get('meeting_index_parquet', True))
+    except Exception as e:
+        logging.error(f"会議一覧の作成中にエラーが発生しました: {str(e)}")
+        return 0
 
 def load_output_directory():
-    """settings.jsonから出力先ディレクトリを読み込む関数"""
-    settings_path = get_settings_path()
-    if os.path.exists(settings_path):
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-            return settings.get('output_directory', os.path.join(Path.home(), 'Documents'))
-    return os.path.join(Path.home(), 'Documents')
+    """設定から出力先ディレクトリを返す関数（設定されていなければドキュメントフォルダ）"""
+    return settings_store.get('output_directory') or os.path.join(Path.home(), 'Documents')
+
+def get_jobs_directory():
+    """ジョブのマニフェストを保存するフォルダのパスを返す関数"""
+    return Path.home() / ".my_app" / "jobs"
+
+def job_fingerprint(settings):
+    """途中結果を引き継げるかどうかを判断するための、設定の指紋を作る関数"""
+    # プロンプト・モデル・分割の設定が変わったら、前回の途中結果は使いません
+    key = json.dumps([
+        transcription_prompt,
+        MODEL_NAME,
+        settings.get('chunk_seconds', DEFAULT_CHUNK_SECONDS),
+        settings.get('chunk_max_mb'),
+        settings.get('vad_enabled', True),
+        settings.get('vad_drop_silence_seconds', DEFAULT_DROP_SILENCE_SECONDS),
+    ], ensure_ascii=False)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def plan_audio_chunks(audio_file_path, duration, file_size, settings, trace):
+    """録音の長さとサイズから分割計画を立てる関数（分割数はAPIキーの数とは無関係です）"""
+    chunk_seconds = settings.get('chunk_seconds', DEFAULT_CHUNK_SECONDS)
+    max_chunk_bytes = int(settings.get('chunk_max_mb', DEFAULT_CHUNK_MAX_BYTES / (1024 * 1024)) * 1024 * 1024)
+    if settings.get('vad_enabled', True):
+        # 発話区間を検出して、長い無音を除き、チャンクの境界を無音の中に置きます
+        try:
+            with trace.span('vad'):
+                regions, _ = detect_speech(str(get_ffmpeg_path()), audio_file_path)
+            chunks = plan_speech_chunks(
+                regions,
+                target_chunk_seconds(duration, file_size, chunk_seconds, max_chunk_bytes),
+                drop_silence_seconds=settings.get('vad_drop_silence_seconds', DEFAULT_DROP_SILENCE_SECONDS),
+            )
+            if chunks:
+                kept = speech_seconds(chunks)
+                logging.info(f"{os.path.basename(audio_file_path)}の発話区間は{kept:.0f}秒です（全体{duration:.0f}秒のうち約{max(0.0, duration - kept):.0f}秒の無音を除きます）。")
+                return chunks
+            logging.info(f"{os.path.basename(audio_file_path)}で発話区間が見つからなかったため、録音全体を文字起こしします。")
+        except Exception as e:
+            logging.error(f"発話区間の検出に失敗したため、録音全体を文字起こしします: {str(e)}")
+    return plan_chunks(duration, file_size, chunk_seconds=chunk_seconds, max_chunk_bytes=max_chunk_bytes)
+
+# 画面に表示する工程の名前
+STAGE_LABELS = {
+    'plan': '分割計画',
+    'segment': '音声の分割',
+    'transcription': '文字起こし',
+    'docx': '文字起こし結果の保存',
+    'extraction': '議題の抽出',
+    'merge': '議題の統合',
+    'xlsx': '抽出結果の保存',
+}
+# 工程ごとの制限時間（秒）の既定値。時間切れになったジョブは、次回そこまでの結果から再開します
+DEFAULT_STAGE_TIMEOUTS = {
+    'plan': 900,
+    'segment': 1800,
+    'transcription': 10800,
+    'docx': 300,
+    'extraction': 1800,
+    'merge': 600,
+    'xlsx': 300,
+}
+# APIへのリクエスト1回あたりの制限時間（秒）
+DEFAULT_REQUEST_TIMEOUT_SECONDS = 600
+
+# すべてのジョブを1つのイベントループで実行するエンジン
+pipeline_engine = PipelineEngine()
+atexit.register(pipeline_engine.close)
+
+# ジョブの台帳に時間を記録する工程（トレースのスパンの名前）
+LEDGER_STAGES = ('plan', 'vad', 'segment', 'transcription', 'docx', 'extraction_wait', 'merge', 'xlsx')
+
+def start_ledger_job(audio_file_path):
+    """ジョブの開始を台帳に記録する関数（記録できなくても処理は続けます）"""
+    try:
+        return get_job_ledger().start_job(audio_file_path)
+    except (OSError, sqlite3.Error) as e:
+        logging.error(f"ジョブの台帳に記録できませんでした: {str(e)}")
+        return None
 
-def process_audio_file(audio_file_path, processed_files):
+def finish_ledger_job(job_id, outcome, seconds, trace, manifest):
+    """ジョブの結果・工程ごとの時間・使ったAPIキー・トークン数・出力したファイルを台帳に記録する関数"""
+    if job_id is None:
+        return
+    stages = {name: trace.stages[name] for name in LEDGER_STAGES if name in trace.stages}
+    if manifest is not None:
+        # マニフェストの工程は、前回までに済んでいたものも含めて結果を記録します
+        for stage in STAGES:
+            status, stage_seconds = stages.get(stage, (None, None))
+            if manifest.stage_done(stage):
+                status = 'ok'
+            elif status is not None:
+                status = 'error' if status == 'ok' else status
+            else:
+                status = 'pending'
+            stages[stage] = (status, stage_seconds)
+    try:
+        get_job_ledger().finish_job(
+            job_id, outcome, seconds, stages,
+            prompt_tokens=trace.prompt_tokens,
+            output_tokens=trace.output_tokens,
+            api_keys=trace.keys,
+            transcript_path=manifest.stage_result('docx') if manifest is not None else None,
+            xlsx_path=manifest.stage_result('xlsx') if manifest is not None else None,
+        )
+    except sqlite3.Error as e:
+        logging.error(f"ジョブの結果を台帳に記録できませんでした: {str(e)}")
+
+async def process_audio_file_job(audio_file_path):
+    """1件の録音を文字起こしから抽出結果の保存まで処理するジョブ（イベントループの上で動きます）
+
+    チャンクごとにスレッドを作らず、APIの応答はすべて非同期に待ちます。
+    ジョブをキャンセルすると、実行中のリクエストやアップロードの待ちもその場で止まり、
+    済んだところまではマニフェストに残るので、次回はその続きから再開します。
+    ジョブの結果はジョブの台帳に記録し、成功した録音は次回から処理済みとして扱います。
+    """
+    temp_dir = None
+    extraction_tasks = {}
+    manifest = None
+    job_id = None
+    # 工程ごとの時間やリクエストの結果は、ジョブごとのトレースとメトリクスに記録します
+    trace = open_job_trace(audio_file_path)
+    current_trace.set(trace)
+    job_start = time.time()
+    job_started = time.perf_counter()
+    outcome = 'error'
     try:
         audio_file_name = os.path.basename(audio_file_path)
         file_size = os.path.getsize(audio_file_path)
+        # 台帳には中身のハッシュで記録します（大きいファイルを読むのでスレッドで行います）
+        job_id = await run_blocking(start_ledger_job, audio_file_path)
         logging.info(f"{audio_file_name}の処理を開始します。ファイルサイズ: {file_size / (1024 * 1024):.2f}MB")
 
         # APIキーをロード
@@ -469,102 +1103,329 @@ def process_audio_file(audio_file_path, processed_files):
             logging.error("APIキーがロードされていません。処理を中止します。")
             return False
 
-        # 音声ファイルを分割する数を決定
-        num_parts = len(api_keys)  # APIキーの数に応じて分割数を決定
+        # 前回途中で止まったジョブなら、マニフェストから続きを再開します
+        settings = load_settings()
+        timeouts = {**DEFAULT_STAGE_TIMEOUTS, **settings.get('stage_timeout_seconds', {})}
+        request_timeout = settings.get('request_timeout_seconds', DEFAULT_REQUEST_TIMEOUT_SECONDS)
+        manifest = JobManifest.open(get_jobs_directory(), audio_file_path, job_fingerprint(settings))
+        encoding = audio_encoding_for(audio_file_path, settings)
+        if manifest.resumed:
+            logging.info(f"{audio_file_name}は前回の途中結果から再開します。")
+        else:
+            # 録音の長さとサイズから分割計画を立てます
+            def plan():
+                duration = get_audio_duration(audio_file_path)
+                # 変換して送る場合は、変換後のおおよそのサイズでチャンクの上限を判断します
+                encoded_size = int(encoding.bytes_per_second * duration) if encoding.bytes_per_second else file_size
+                return plan_audio_chunks(audio_file_path, duration, encoded_size, settings, trace)
+            with trace.span('plan', bytes=file_size, encoding=encoding.name):
+                await run_blocking(manifest.set_plan, await with_timeout('plan', run_blocking(plan), timeouts))
+        chunks = manifest.chunks
+        pending = manifest.pending_indices()
+        logging.info(f"{audio_file_name}を{len(chunks)}個に分割します（1つあたり約{chunks[0].duration:.0f}秒、未処理{len(pending)}個）。")
+
+        pool = get_api_key_pool(api_keys)
+        budget = RetryBudget(
+            max_retries=settings.get('job_max_retries', 30),
+            max_seconds=settings.get('job_retry_seconds', 900),
+        )
+
+        # 文字起こしのバックエンド（Gemini・ローカルのモデル）を設定から選びます
+        backend = create_transcription_backend(settings, pool, budget, trace)
+        if backend is None:
+            return False
 
-        transcribed_texts = [None] * num_parts  # インデックスに基づいて配置するリスト
+        # 議題の抽出は、チャンクの文字起こしが届くたびに文字起こしと並行して進めます（map）
+        async def extract_chunk(index):
+            text = " ".join(manifest.transcripts()[index].split())
+            # キーの利用枠は見積もりで予約し、実際のトークン数は応答のusage_metadataで記録します
+            items, _ = await call_with_pool(
+                pool,
+                lambda api_key: extract_chunk_agenda(text, index, len(chunks), api_key),
+                f"{audio_file_name}のチャンク{index + 1}の議題抽出",
+                estimate_prompt_tokens(EXTRACTION_INSTRUCTIONS, text),
+                budget=budget,
+                stage='extraction',
+                trace=trace,
+                timeout=request_timeout,
+            )
+            if items is not None:
+                await run_blocking(manifest.record_chunk_extraction, index, items)
+            return items
+
+        def submit_missing_extractions():
+            extractions = manifest.chunk_extractions()
+            for index, text in enumerate(manifest.transcripts()):
+                if text and extractions[index] is None and index not in extraction_tasks:
+                    extraction_tasks[index] = asyncio.ensure_future(extract_chunk(index))
+
+        if not manifest.stage_done('extraction'):
+            # 前回文字起こしまで済んでいたチャンクは、すぐに抽出を始めます
+            submit_missing_extractions()
+
+        if pending:
+            # 未処理のチャンクだけを、一時フォルダに書き出すか、パイプでそのままアップロードします
+            pending_chunks = [chunks[i] for i in pending]
+            segment_mode = settings.get('segment_mode', 'files')
+            with trace.span('segment', mode=segment_mode, chunks=len(pending_chunks)):
+                if segment_mode == 'pipe':
+                    report_stage('segment')
+                    audio_parts = pipe_chunks(str(get_ffmpeg_path()), audio_file_path, pending_chunks, encoding=encoding)
+                else:
+                    temp_dir = tempfile.mkdtemp(prefix='minutes_')
+                    audio_parts = await with_timeout(
+                        'segment', run_blocking(split_audio_file, audio_file_path, pending_chunks, temp_dir, encoding), timeouts)
+            audio_parts = dict(zip(pending, audio_parts))
 
-        audio_parts = split_audio_file(audio_file_path, num_parts)
+            # 同時に文字起こしするチャンクの数は、バックエンドが同時に処理できる数までにします
+            slots = asyncio.Semaphore(backend.max_workers)
+            finished = []
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future_to_index = {executor.submit(transcribe_audio_with_key, part, api_keys[i]): i for i, part in enumerate(audio_parts)}
-            failed_parts = []
-            successful_api_keys = []  # 成功したAPIキーを記録るリスト
-            for future in concurrent.futures.as_completed(future_to_index):
-                index = future_to_index[future]
+            async def transcribe_chunk(index):
                 part = audio_parts[index]
-                result = future.result()
+                async with slots:
+                    result = await backend.transcribe_async(part, chunks[index])
+                # 結果は届いた順にマニフェストのログへ追記します（書き込みはスレッドで行います）
+                await run_blocking(manifest.record_chunk, index, result)
+                finished.append(index)
+                report_stage('transcription', f"{len(finished)}/{len(pending)}")
                 if result:
-                    transcribed_texts[index] = result
+                    extraction_tasks[index] = asyncio.ensure_future(extract_chunk(index))
                     logging.info(f"{part}の処理が成功しました。")
-                    if api_keys[index] not in successful_api_keys:
-                        successful_api_keys.append(api_keys[index])  # 成功したAPIキーを記録
                 else:
                     logging.error(f"{part}の処理が失敗しました。")
-                    failed_parts.append((index, part))
-
-        # 失敗したパートのリトライ
-        if failed_parts:
-            logging.info("失敗したファイルのリトライを1分後に開始します。")
-            time.sleep(60)
-            for index, part in failed_parts:
-                result = transcribe_audio_with_key(part, api_keys[0])
-                if result:
-                    transcribed_texts[index] = result
-                    logging.info(f"{part}のリトライが成功しました。")
-                    if api_keys[0] not in successful_api_keys:
-                        successful_api_keys.append(api_keys[0])  # リトライで成功しAPIキーを記録
-                else:
-                    logging.error(f"{part}のリトライが失敗しました。")
 
-        # 分割されたファイルを削除
-        for part in audio_parts:
-            os.remove(part)
-        logging.info(f"{audio_file_name}の分割されたファイルを削除しました。")
+            with trace.span('transcription', chunks=len(pending), backend=backend.name):
+                await with_timeout('transcription', gather_all(transcribe_chunk(i) for i in pending), timeouts)
+            logging.info(f"APIキーの状態: {pool.snapshot()}")
+            logging.info(f"Geminiクライアントの利用状況: {gemini_clients.stats}")
+
+            # 文字起こし結果が変わったので、後の工程はやり直します
+            await run_blocking(manifest.reset_stages_after, 'transcription')
+
+            # 分割されたファイルを削除
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                temp_dir = None
+                logging.info(f"{audio_file_name}の分割されたファイルを削除しました。")
+
+        failed_indices = manifest.pending_indices()
+        if failed_indices:
+            logging.error(f"{audio_file_name}の{len(failed_indices)}個のチャンクの文字起こしに失敗しました。次回はそのチャンクから再開します。")
+        else:
+            await run_blocking(manifest.complete_stage, 'transcription')
 
-        # 文字起こし結果を結合（Noneを除外）
-        combined_text = "\n".join(filter(None, transcribed_texts))
+        # 文字起こし結果を結合（重なり部分の重複を取り除き、Noneを除外）
+        combined_text = stitch_transcripts(manifest.transcripts(), chunks)
         # 余分な空白を取り除く
         cleaned_combined_text = " ".join(combined_text.split())
         logging.info(f"{audio_file_name}字起こしが完了しました。情報を抽出します。")
 
         # 文字起こし結果をWordファイルに保存
-        try:
-            output_directory = load_output_directory()
-            word_output_file = os.path.join(output_directory, f"{os.path.splitext(audio_file_name)[0]}_文字起こし.docx")
-            doc = Document()
-            doc.add_paragraph(cleaned_combined_text)
-            doc.save(word_output_file)
-            logging.info(f"文字起こし結果がWordファイルに保存されました: {word_output_file}")
-        except Exception as e:
-            logging.error(f"文字起こし結果のWordファイル保存中にエラーが発生しました: {str(e)}")
-            return False
-
-        # 15秒のバッファを持たせる
-        time.sleep(15)
-
-        # 成功したAPIキー使って情報抽出を試みる
-        for api_key in successful_api_keys:
+        output_directory = load_output_directory()
+        if not manifest.stage_done('docx'):
             try:
-                extracted_info = extract_information(cleaned_combined_text, api_key)
+                word_output_file = os.path.join(output_directory, f"{os.path.splitext(audio_file_name)[0]}_文字起こし.docx")
+
+                def save_transcript():
+                    doc = Document()
+                    doc.add_paragraph(cleaned_combined_text)
+                    doc.save(word_output_file)
+                with trace.span('docx', characters=len(cleaned_combined_text)):
+                    await with_timeout('docx', run_blocking(save_transcript), timeouts)
+                await run_blocking(manifest.complete_stage, 'docx', word_output_file)
+                logging.info(f"文字起こし結果がWordファイルに保存されました: {word_output_file}")
+            except Exception as e:
+                logging.error(f"文字起こし結果のWordファイル保存中にエラーが発生しました: {str(e)}")
+                return False
+
+        # チャンクごとの議題抽出の完了を待ち、1つにまとめて番号を振り直します（reduce）
+        extracted_info = manifest.stage_result('extraction')
+        if extracted_info is None:
+            submit_missing_extractions()
+            # 文字起こしの後に抽出の完了を待った時間が、抽出が処理全体を延ばしている時間です
+            with trace.span('extraction_wait', chunks=len(extraction_tasks)):
+                await with_timeout(
+                    'extraction', asyncio.gather(*extraction_tasks.values(), return_exceptions=True), timeouts)
+            extractions = manifest.chunk_extractions()
+            missing = [i for i, text in enumerate(manifest.transcripts()) if text and extractions[i] is None]
+            if missing:
+                logging.error(f"{audio_file_name}の{len(missing)}個のチャンクの議題抽出に失敗しました。次回はそのチャンクから再開します。")
+            else:
+                with trace.span('merge'):
+                    extracted_info = await with_timeout('merge', merge_agenda(
+                        [[tuple(item) for item in items] for items in extractions if items],
+                        pool,
+                        f"{audio_file_name}の議題の統合",
+                        budget,
+                        trace,
+                        request_timeout,
+                    ), timeouts)
                 if extracted_info:
-                    output_file = os.path.join(output_directory, f"{os.path.splitext(audio_file_name)[0]}_抽出結果.xlsx")
-                    create_excel(extracted_info, output_file)
-                    processed_files[audio_file_name] = output_file
-                    break  # 成功したらループを抜ける
-            except google.api_core.exceptions.ResourceExhausted:
-                logging.error(f"{api_key}での情報抽出が失敗しました。次のAPIキーを試します。")
+                    await run_blocking(manifest.complete_stage, 'extraction', extracted_info)
+            logging.info(f"トークン使用量: {token_ledger.snapshot()}")
+
+        if extracted_info:
+            output_file = manifest.stage_result('xlsx')
+            if output_file is None:
+                output_file = os.path.join(output_directory, f"{os.path.splitext(audio_file_name)[0]}_抽出結果.xlsx")
+                with trace.span('xlsx'):
+                    saved = await with_timeout('xlsx', run_blocking(create_excel, extracted_info, output_file), timeouts)
+                if saved:
+                    await run_blocking(manifest.complete_stage, 'xlsx', output_file)
+                    # 会議をまたいだ一覧の索引にも追記します（一覧のExcelファイルはバッチの終わりに作り直します）
+                    await run_blocking(append_to_meeting_index, audio_file_path, extracted_info, output_file)
         else:
             logging.error(f"{audio_file_name}の情報抽出に失敗しました。")
 
+        # 失敗したチャンクや工程があれば、マニフェストを残して次回その続きから再開します
+        if not all(manifest.stage_done(stage) for stage in STAGES):
+            outcome = 'incomplete'
+            logging.error(f"{audio_file_name}の処理は完了していません。次回は途中から再開します。")
+            return False
+
+        # すべての工程が完了したら、マニフェストはもう必要ありません
+        manifest.remove()
+        outcome = 'ok'
         return True
+    except StageTimeout as e:
+        outcome = 'timeout'
+        logging.error(f"{audio_file_path}の処理を中断しました: {str(e)} 次回は途中から再開します。")
+        return False
+    except asyncio.CancelledError:
+        outcome = 'cancelled'
+        logging.info(f"{audio_file_path}の処理がキャンセルされました。次回は途中から再開します。")
+        raise
     except Exception as e:
         logging.exception(f"{audio_file_path}の処理中にエラーが発生しました: {str(e)}")
         return False
+    finally:
+        # 残っている議題抽出を止め、終わるのを待ってから後片付けをします
+        for task in extraction_tasks.values():
+            task.cancel()
+        await asyncio.gather(*extraction_tasks.values(), return_exceptions=True)
+        # 途中で失敗しても分割されたファイルを残さないようにします
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        trace.record_span('job', job_start, time.perf_counter() - job_started, outcome)
+        finish_ledger_job(job_id, outcome, time.perf_counter() - job_started, trace, manifest)
+        trace.close()
+        metrics.inc('jobs_total', outcome=outcome)
+        write_metrics()
+
+def process_audio_file(audio_file_path):
+    """1件の録音を処理する関数（ジョブをイベントループで実行し、終わるまで待ちます）"""
+    return pipeline_engine.run(process_audio_file_job(audio_file_path), os.path.basename(audio_file_path))
+
+def log_throughput(succeeded, failed, elapsed):
+    """バッチ処理のスループット（件/時）をログに出力する関数"""
+    per_hour = succeeded / elapsed * 3600 if elapsed > 0 else 0.0
+    logging.info(f"スループット: 成功{succeeded}件 / 失敗{failed}件 / 経過{elapsed:.0f}秒 / {per_hour:.1f}件/時")
+
+async def run_batch_async(audio_files, max_jobs):
+    """複数の音声ファイルを、同時実行数の上限付きで1つのイベントループの上で処理する関数"""
+    slots = asyncio.Semaphore(max_jobs)
+
+    async def run_one(path):
+        async with slots:
+            try:
+                return path, await process_audio_file_job(path)
+            except Exception as e:
+                logging.exception(f"バッチ処理: {path}の処理中にエラーが発生しました: {str(e)}")
+                return path, False
+
+    for finished in asyncio.as_completed([run_one(path) for path in audio_files]):
+        yield await finished
+
+def run_batch(audio_files, max_jobs=2):
+    """複数の音声ファイルを同時実行数の上限付きでまとめて処理する関数"""
+    start = time.time()
+    logging.info(f"バッチ処理を開始します。対象: {len(audio_files)}件 / 同時実行数: {max_jobs}")
+
+    async def run_all():
+        succeeded = failed = 0
+        async for path, success in run_batch_async(audio_files, max_jobs):
+            if success:
+                succeeded += 1
+                logging.info(f"バッチ処理: {path}の処理が完了しました。")
+            else:
+                failed += 1
+                logging.error(f"バッチ処理: {path}の処理が失敗しました。")
+        return succeeded, failed
+
+    succeeded, failed = pipeline_engine.run(run_all(), 'batch')
+    log_throughput(succeeded, failed, time.time() - start)
+    if succeeded:
+        # 会議一覧はバッチの終わりに1度だけ作り直します
+        export_meeting_index()
+    return succeeded, failed
+
+def signature_of(path):
+    """ファイルのサイズと更新時刻の組を返す関数（存在しなければNone）"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime)
+
+def watch_folders(patterns, max_jobs=2, interval=10.0, stop_event=None):
+    """フォルダを監視し、新しく置かれた音声ファイルを順次処理する関数"""
+    # コピー途中のファイルを拾わないよう、サイズと更新時刻が2回続けて同じになってから処理します
+    stop_event = stop_event or threading.Event()
+    ledger = get_job_ledger()
+    last_seen = {}
+    failed_signatures = {}
+    pending = {}
+    start = time.time()
+    succeeded = failed = 0
+    logging.info(f"フォルダの監視を開始します: {', '.join(patterns)}")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        try:
+            while not stop_event.is_set():
+                for path in collect_audio_files(patterns):
+                    if path in pending:
+                        continue
+                    signature = signature_of(path)
+                    if signature is None:
+                        continue
+                    if failed_signatures.get(path) == signature:
+                        continue
+                    if last_seen.get(path) != signature:
+                        last_seen[path] = signature
+                        continue
+                    # 処理済みかどうかは、コピーが終わってから中身のハッシュで調べます
+                    if ledger.is_processed(path):
+                        continue
+                    pending[path] = executor.submit(process_audio_file, path)
+                    logging.info(f"新しい音声ファイルを検出しました: {path}")
+
+                # 完了したジョブを回収します（失敗したファイルは更新されるまで再実行しません）
+                collected = 0
+                for path, future in list(pending.items()):
+                    if future.done():
+                        del pending[path]
+                        if future.result():
+                            succeeded += 1
+                            collected += 1
+                        else:
+                            failed += 1
+                            failed_signatures[path] = signature_of(path)
+                        log_throughput(succeeded, failed, time.time() - start)
+                if collected:
+                    export_meeting_index()
+
+                stop_event.wait(interval)
+        except KeyboardInterrupt:
+            logging.info("フォルダの監視を停止します。実行中のジョブの完了を待ちます。")
+            stop_event.set()
+
+    log_throughput(succeeded, failed, time.time() - start)
+    return succeeded, failed
 
 def extract_info_from_xlsx(file_path):
-    wb = openpyxl.load_workbook(file_path)
-    sheet = wb.active
-    data = {
-        '会議名': sheet['B1'].value or '',
-        '日時': convert_excel_date(sheet['B2'].value),
-        '場所': sheet['B3'].value or '',
-        '参加者': sheet['B4'].value or '',
-        '欠席者': sheet['B5'].value or '',
-    }
-    for i in range(1, 21):  # 議題①から⑩まで
-        data[f'議題{chr(0x2460 + i - 1)}'] = sheet[f'B{5+i*2-1}'].value or ''
-        data[f'議題{chr(0x2460 + i - 1)}の要約'] = sheet[f'B{5+i*2}'].value or ''
+    # 読み取り専用・値のみで開き、B列の必要な行だけを読みます
+    data = read_minutes_data(file_path)
     
     print("抽出されたデータ:")
     for key, value in data.items():
@@ -572,59 +1433,18 @@ def extract_info_from_xlsx(file_path):
     
     return data
 
-def convert_excel_date(value):
-    if isinstance(value, (int, float)):
-        return from_excel(value).strftime('%Y-%m-%d')
-    return value
+def get_template_path():
+    """議事録のテンプレート（template.docx）のパスを返す関数"""
+    if getattr(sys, 'frozen', False):
+        # PyInstallerでパッケージ化されている場合
+        return os.path.join(sys._MEIPASS, 'template.docx')
+    # 通常のPython実行の場合
+    return os.path.join(get_current_dir(), 'template.docx')
 
 def create_minutes_from_template(data, template_path):
+    """テンプレートに抽出データを差し込んだ文書（Document）を返す関数"""
     try:
-        if getattr(sys, 'frozen', False):
-            # PyInstallerでパッケージ化されている場合
-            template_path = os.path.join(sys._MEIPASS, 'template.docx')
-        else:
-            # 通常のPython実行の場合
-            template_path = os.path.join(get_current_dir(), 'template.docx')
-
-        print(f"Using template path: {template_path}")  # デバッグ用
-        print(f"Template exists: {os.path.exists(template_path)}")  # デバッグ用
-
-        doc = Document(template_path)
-        
-        for paragraph in doc.paragraphs:
-            # 会議名、日時、場所、参加者、欠席者の置き換え
-            for key, value in data.items():
-                placeholder = f'「{key}」'
-                if placeholder in paragraph.text:
-                    old_text = paragraph.text
-                    new_text = paragraph.text.replace(placeholder, str(value) if value is not None else '')
-                    paragraph.text = new_text
-                    print(f"置換: '{old_text}' -> '{new_text}'")
-
-            # 議題と要約の置き換え
-            for i in range(1,21):
-                topic_key = f'議題{chr(0x2460 + i - 1)}'
-                topic_content = data.get(topic_key, '')
-                summary_key = f'議題{chr(0x2460 + i - 1)}の要約'
-                summary_content = data.get(summary_key, '')
-
-                # 議題の名称を置き換え
-                topic_placeholder = f'「{topic_key}」'
-                if topic_placeholder in paragraph.text:
-                    old_text = paragraph.text
-                    new_text = paragraph.text.replace(topic_placeholder, topic_content)
-                    paragraph.text = new_text
-                    print(f"議題名置換: '{old_text}' -> '{new_text}'")
-
-                # 要約の置き換え
-                summary_placeholder = f'「{summary_key}」'
-                if summary_placeholder in paragraph.text:
-                    old_text = paragraph.text
-                    new_text = paragraph.text.replace(summary_placeholder, summary_content)
-                    paragraph.text = new_text
-                    print(f"要約置換: '{old_text}' -> '{new_text}'")
-
-        return doc
+        return load_template(get_template_path()).document(data)
     except Exception as e:
         logging.error(f"テンプレート処理中にエラーが発生: {str(e)}")
         raise
@@ -632,14 +1452,31 @@ def create_minutes_from_template(data, template_path):
 def create_minutes(xlsx_path, template_path, output_path):
     try:
         data = extract_info_from_xlsx(xlsx_path)
-        doc = create_minutes_from_template(data, template_path)
-        doc.save(output_path)
+        # テンプレートはコンパイル済みのものを使い回し、差し込んだ結果をそのまま保存します
+        template = load_template(get_template_path())
+        missing = sorted(template.placeholders - data.keys())
+        if missing:
+            logging.warning(f"テンプレートの差し込み位置に対応するデータがありません: {', '.join(missing)}")
+        template.save(data, output_path)
         print(f"議事録が作成されました: {output_path}")
         return True
     except Exception as e:
         logging.error(f"議事録の作成中にエラーが発生しました: {str(e)}")
         print(f"エラーが発生しました: {str(e)}")
         return False
+
+def create_minutes_from_folder(folder, output_directory=None, max_workers=None):
+    """フォルダの中の抽出結果のExcelファイルから、議事録をまとめて作る関数（結果のリストを返す）"""
+    xlsx_paths = find_extraction_workbooks(folder)
+    if not xlsx_paths:
+        logging.info(f"{folder}に抽出結果のExcelファイルがありません。")
+        return []
+    output_directory = output_directory or load_output_directory()
+    logging.info(f"議事録の一括作成を開始します。対象: {len(xlsx_paths)}件")
+    start = time.time()
+    results = create_minutes_bulk(xlsx_paths, load_template(get_template_path()), output_directory, max_workers)
+    logging.info(f"議事録の一括作成が完了しました（{time.time() - start:.1f}秒）。")
+    return results
     
 # グローバル変数の定義
 selected_file = None
@@ -653,9 +1490,12 @@ processing_done = False  # 処理が完了したかどうかを示すフラグ
 start_time = None  # 処理開始時刻を保持
 selected_file_name = ""  # 選択したファイル名を保持
 estimated_time_text = ""  # 想定処理時間を保持
+tk_bridge = None  # ジョブの通知をTkのメインスレッドで受け取るための橋渡し
+current_audio_job = None  # 実行中の音声ファイルのジョブ（JobHandle）
+stage_label = None  # 実行中の工程を表示するラベル
 
 def show_main_menu():
-    global root, file_label, excel_file_label, uploading_label, elapsed_time_label, estimated_time_label, selected_file, selected_file_name, estimated_time_text,transcription_prompt, processing_done, start_time
+    global root, file_label, excel_file_label, uploading_label, elapsed_time_label, estimated_time_label, selected_file, selected_file_name, estimated_time_text,transcription_prompt, processing_done, start_time, stage_label
     for widget in root.winfo_children():
         widget.destroy()
 
@@ -712,6 +1552,14 @@ def show_main_menu():
     uploading_label = tk.Label(audio_frame, text="", font=("Arial", 12))
     uploading_label.pack(pady=10)
 
+    # 実行中の工程を表示するラベルと、処理を中止するボタン
+    stage_label = tk.Label(audio_frame, text="", font=("Arial", 10))
+    stage_label.pack(pady=5)
+    if current_audio_job is not None and not current_audio_job.done():
+        show_stage(current_audio_job)
+        cancel_button = tk.Button(audio_frame, text="処理を中止する", command=cancel_audio_job, width=25)
+        cancel_button.pack(pady=5)
+
     # 処理が進行中の場合、選択ファイルと想定時間を表示
     if not processing_done and selected_file and start_time:
         file_label.config(text=f"選択したファイル: {os.path.basename(selected_file)}")
@@ -748,6 +1596,10 @@ def show_main_menu():
     process_excel_button = tk.Button(excel_frame, text="Excelファイルを処理する", command=complete_xlsx_upload, width=25)
     process_excel_button.pack(pady=10)
 
+    # フォルダの中の抽出結果からまとめて議事録を作るボタン
+    bulk_excel_button = tk.Button(excel_frame, text="フォルダからまとめて処理する", command=complete_xlsx_folder_upload, width=25)
+    bulk_excel_button.pack(pady=10)
+
     # グリッドの設定
     main_frame.grid_columnconfigure(0, weight=1)
     main_frame.grid_columnconfigure(1, weight=1)
@@ -849,7 +1701,7 @@ def select_directory(label_widget):
         save_output_directory_to_settings(directory.strip())
 
 def main():
-    global root, transcription_prompt, selected_file_name, estimated_time_text
+    global root, transcription_prompt, selected_file_name, estimated_time_text, tk_bridge
     try:
         logging.info("プロンプトをロード中...")  # 追加: ロード開始ログ
         transcription_prompt = load_prompt_from_settings()  # プロンプトをロード
@@ -859,6 +1711,10 @@ def main():
         root.title("ファイル処理ツール")
         root.geometry("500x300")
 
+        # ジョブの進み具合や結果は、イベントループからTkのメインループへ渡して画面に反映します
+        tk_bridge = TkBridge(root)
+        tk_bridge.start()
+
         show_main_menu()
 
         root.mainloop()
@@ -900,53 +1756,39 @@ def show_usage():
     back_button.lift()  # ボタンを最前面に配置
 
 def save_prompt_to_settings(prompt_text):
-    """プロンプトをsettings.jsonに保存する関数"""
-    ensure_settings_exist()  # フォルダとファイルの存在を確認
-    settings_path = get_settings_path()
+    """プロンプトを設定に保存する関数"""
     try:
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-        settings['transcription_prompt'] = prompt_text
-        with open(settings_path, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
+        settings_store.update({'transcription_prompt': prompt_text})
         logging.info("プロンプトがsettings.jsonに保存されました。")
         messagebox.showinfo("保存", "プロンプトが保存されました。")
     except Exception as e:
         logging.error(f"プロンプトの保存中にエラーが発生しました: {str(e)}")
         messagebox.showerror("エラー", "プロンプトの保存中にエラーが発生しました。")
 
-def load_output_directory():
-    """settings.jsonから出力先ディレクトリを読み込む関数"""
-    settings_path = get_settings_path()
-    if os.path.exists(settings_path):
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-            return settings.get('output_directory', '')  # デフォルト値を空文字に変更
-    return ''  # ファイルが存在しない場合も空文字を返す
-
 def save_output_directory_to_settings(directory):
-    """出力先ディレクトリをsettings.jsonに保存する関数"""
-    ensure_settings_exist()  # フォルダとファイルの存在を確認
-    settings_path = get_settings_path()
+    """出力先ディレクトリを設定に保存する関数"""
     try:
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-        settings['output_directory'] = directory
-        with open(settings_path, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
+        settings_store.update({'output_directory': directory})
         logging.info("出力先ディレクトリがsettings.jsonに保存されました。")
     except Exception as e:
         logging.error(f"出力先ディレクトリの保存中にエラーが発生しました: {str(e)}")
 
 def load_api_keys():
-    """settings.jsonからAPIキーを読み込む関数"""
-    settings_path = get_settings_path()  # 修正: get_current_dir() から get_settings_path() に変更
-    if os.path.exists(settings_path):
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-            return [settings['gemini_api_keys'][f'GEMINI_API_KEY_{i}'] for i in range(1, 11)]
-    logging.error("settings.jsonが見つからないか、APIキーが設定されていません。")
-    return []
+    """設定からAPIキーを読み込む関数"""
+    api_keys = settings_store.get('gemini_api_keys') or {}
+    if not api_keys:
+        logging.error("settings.jsonが見つからないか、APIキーが設定されていません。")
+        return []
+    # 保存されている数だけキーを番号順に読み込み、空のキーは除外します
+    numbered = []
+    for name, key in api_keys.items():
+        suffix = name.rsplit('_', 1)[-1]
+        if not suffix.isdigit():
+            # 手で書き換えた名前（GEMINI_API_KEY_backupなど）は番号順に並べられないので読み込みません
+            logging.warning(f"APIキーの名前の末尾が番号ではないため読み込みません: {name}")
+            continue
+        numbered.append((int(suffix), key))
+    return [key for _, key in sorted(numbered, key=lambda item: item[0]) if key]
 
 def get_api_keys_text():
     """APIキーをテキストボックスに表示するための文字列を生成する関数"""
@@ -954,16 +1796,10 @@ def get_api_keys_text():
     return "\n".join(api_keys)
 
 def save_api_keys_to_settings(api_keys_text):
-    """APIキーをsettings.jsonに保存する関数"""
-    ensure_settings_exist()  # フォルダとファイルの存在を確認
-    settings_path = get_settings_path()
+    """APIキーを設定に保存する関数"""
     try:
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
         api_keys = api_keys_text.strip().split('\n')
-        settings['gemini_api_keys'] = {f'GEMINI_API_KEY_{i+1}': key for i, key in enumerate(api_keys)}
-        with open(settings_path, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
+        settings_store.update({'gemini_api_keys': {f'GEMINI_API_KEY_{i+1}': key for i, key in enumerate(api_keys)}})
         logging.info("APIキーがsettings.jsonに保存されました。")
         messagebox.showinfo("保存", "APIキーが保存されました。")
     except Exception as e:
@@ -975,48 +1811,37 @@ def get_settings_path():
     return Path.home() / ".my_app" / "settings.json"
 
 def load_settings():
-    settings_path = get_settings_path()
-    if settings_path.exists():
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
+    """設定のコピーを返す関数（ファイルは読まず、メモリの設定ストアから返します）"""
+    return settings_store.snapshot()
 
 def save_settings(settings=None):
     try:
-        settings_path = get_settings_path()
-        settings_path.parent.mkdir(parents=True, exist_ok=True)  # フォルダが存在しない場合は作成
-
         # settings.jsonが存在しない場合、デフォルトの設定を作成
-        if not settings_path.exists():
-            settings = {
-                'transcription_prompt': '',
-                'output_directory': str(Path.home() / 'Documents'),
-                'gemini_api_keys': {f'GEMINI_API_KEY_{i+1}': '' for i in range(10)}
-            }
-
-        with open(settings_path, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
+        if not settings_store.create_if_missing(default_settings()) and settings:
+            settings_store.update(settings)
         print("Settings saved successfully.")  # ログ出力
     except Exception as e:
         print(f"Error saving settings: {e}")  # エラーログ
 
+def default_settings():
+    """settings.jsonがないときに作る設定"""
+    return {
+        'transcription_prompt': '',
+        'output_directory': '',
+        'gemini_api_keys': {f'GEMINI_API_KEY_{i+1}': '' for i in range(10)}
+    }
+
 def ensure_settings_exist():
-    settings_path = Path.home() / ".my_app" / "settings.json"
+    settings_path = get_settings_path()
     
     # フォルダが存在しない場合は作成
     if not settings_path.parent.exists():
         settings_path.parent.mkdir(parents=True, exist_ok=True)
         print(f"フォルダを作成しました: {settings_path.parent}")
     
-    # settings.jsonが存在しない場合は作成
+    # settings.jsonが存在しない場合は作成（書きかけのファイルを読まれないよう、一時ファイルから置き換えます）
     if not settings_path.exists():
-        settings = {
-            'transcription_prompt': '',
-            'output_directory': '',
-            'gemini_api_keys': {f'GEMINI_API_KEY_{i+1}': '' for i in range(10)}
-        }
-        with open(settings_path, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
+        write_json_atomic(settings_path, default_settings())
         print(f"settings.jsonを作成しました: {settings_path}")
     else:
         print(f"settings.jsonは既に存在します: {settings_path}")
@@ -1024,6 +1849,83 @@ def ensure_settings_exist():
 # 確認と作成を実行
 ensure_settings_exist()
 
+# 設定はここで1度だけ読み込み、以後はメモリの設定ストアから返します
+settings_store = SettingsStore(get_settings_path())
+
+def on_settings_changed(changed, store):
+    """設定が変わったときに、設定から作った共有のオブジェクトを更新する関数"""
+    global transcription_prompt, hedge_policy, transcript_cache
+    logging.info(f"設定が変更されました: {', '.join(sorted(changed))}")
+    if changed & {'key_requests_per_minute', 'key_tokens_per_minute', 'key_max_in_flight', 'key_cooldown_seconds'}:
+        with api_key_pool_lock:
+            if api_key_pool is not None:
+                api_key_pool.configure(
+                    requests_per_minute=store.get('key_requests_per_minute'),
+                    tokens_per_minute=store.get('key_tokens_per_minute'),
+                    max_in_flight=store.get('key_max_in_flight', 1),
+                    cooldown_seconds=store.get('key_cooldown_seconds', 60),
+                )
+    if any(key.startswith('hedge_') for key in changed):
+        # 所要時間の記録は捨てて、新しい設定で作り直します
+        with hedge_policy_lock:
+            hedge_policy = None
+    if any(key.startswith('cache_') for key in changed):
+        with transcript_cache_lock:
+            transcript_cache = None
+    if 'max_inflight_mb' in changed:
+        with upload_byte_budget_lock:
+            if upload_byte_budget is not None:
+                upload_byte_budget.resize(int(store.get('max_inflight_mb', 200) * 1024 * 1024))
+    if 'transcription_prompt' in changed:
+        transcription_prompt = store.get('transcription_prompt', '') or ''
+
+settings_store.subscribe(on_settings_changed)
+
+
+# 文字起こしのリクエスト1回あたりの所要時間の目安（秒）。このセッションで実績があればそちらを使います
+DEFAULT_TRANSCRIPTION_REQUEST_SECONDS = 60
+# 議題の統合やファイルの作成など、文字起こしの後の処理にかかる時間の目安（秒）
+DEFAULT_FINISHING_SECONDS = 60
+
+def estimate_processing_seconds(audio_file_path):
+    """録音の長さ・分割の設定・APIキーの数から、処理にかかる秒数を見積もる関数"""
+    settings = load_settings()
+    duration = get_audio_duration(audio_file_path)
+    encoding = audio_encoding_for(audio_file_path, settings)
+    encoded_size = int(encoding.bytes_per_second * duration) if encoding.bytes_per_second else os.path.getsize(audio_file_path)
+    target_seconds = target_chunk_seconds(
+        duration, encoded_size,
+        chunk_seconds=settings.get('chunk_seconds', DEFAULT_CHUNK_SECONDS),
+        max_chunk_bytes=int(settings.get('chunk_max_mb', DEFAULT_CHUNK_MAX_BYTES / (1024 * 1024)) * 1024 * 1024),
+    )
+    num_chunks = max(1, math.ceil(duration / target_seconds))
+    num_keys = max(1, len(load_api_keys()))
+
+    # このセッションで文字起こしをしていれば、その平均の所要時間を使います
+    total, count = 0.0, 0
+    for labels, (seconds, observations) in metrics.histogram_summary('request_seconds').items():
+        if dict(labels).get('stage') == 'transcription':
+            total += seconds
+            count += observations
+    request_seconds = total / count if count else DEFAULT_TRANSCRIPTION_REQUEST_SECONDS
+
+    # 同時に送れる数ずつ順に処理し、1分あたりのリクエスト数の上限があればそれも考えます
+    rounds = math.ceil(num_chunks / (num_keys * settings.get('key_max_in_flight', 1)))
+    transcription_seconds = rounds * request_seconds
+    requests_per_minute = settings.get('key_requests_per_minute')
+    if requests_per_minute:
+        minutes = math.ceil(num_chunks / (num_keys * requests_per_minute)) - 1
+        transcription_seconds = max(transcription_seconds, minutes * 60 + request_seconds)
+    return transcription_seconds + DEFAULT_FINISHING_SECONDS
+
+def estimate_processing_time(audio_file_path):
+    """想定処理時間を「N〜N+1分」の形の文字列で返す関数"""
+    try:
+        minutes = max(1, int(estimate_processing_seconds(audio_file_path) // 60))
+    except Exception as e:
+        logging.error(f"想定処理時間の計算に失敗しました: {str(e)}")
+        return "不明"
+    return f"{minutes}〜{minutes + 1}分"
 
 def complete_audio_upload():
     global processing_done, start_time, selected_file_name, estimated_time_text
@@ -1031,22 +1933,15 @@ def complete_audio_upload():
         processing_done = False  # この行を追加
         start_time = time.time()  # 処理開始時刻を記録
         selected_file_name = os.path.basename(selected_file)
-        file_size_mb = os.path.getsize(selected_file) / (1024 * 1024)  # MBに変換
 
         # 想定処理時間を計算
-        if file_size_mb <= 10:
-            estimated_time = "2～3分"
-        elif file_size_mb <= 20:
-            estimated_time = "3～4分"
-        else:
-            estimated_time = "4〜4分"
+        estimated_time = estimate_processing_time(selected_file)
 
         estimated_time_text = estimated_time  # 時間だけを保存
         estimated_time_label.config(text=f"想定処理時間：{estimated_time}")  # 表示時にテキストを追加
 
         root.update_idletasks()
-        processed_files = load_processed_files()
-        threading.Thread(target=process_audio_file_async, args=(selected_file, processed_files, start_time)).start()
+        process_audio_file_async(selected_file, start_time)
     else:
         messagebox.showwarning("警告", "ファイルが選択されていません。")
 
@@ -1057,16 +1952,8 @@ def upload_audio_file():
         selected_file_name = os.path.basename(selected_file)
         file_label.config(text=f"選択したファイル\n{selected_file_name}")
         
-        # ファイルサイズを取得
-        file_size_mb = os.path.getsize(selected_file) / (1024 * 1024)  # MBに変換
-        
-        # 想定処理時間を計算
-        if file_size_mb <= 10:
-            estimated_time = "2〜3分"
-        elif file_size_mb <= 20:
-            estimated_time = "3〜4分"
-        else:
-            estimated_time = "3〜4分"
+        # 想定処理時間を計算（録音の長さはファイルの先頭から読むので、すぐに表示できます）
+        estimated_time = estimate_processing_time(selected_file)
         
         # 想定処理時間を表示（「想定処理時間：」を含める）
         estimated_time_text = estimated_time  # 時間だけを保存
@@ -1085,12 +1972,37 @@ def complete_xlsx_upload():
     else:
         messagebox.showwarning("警告", "ファイルが選択されていません。")
 
-def process_xlsx_file_async(xlsx_file):
+def complete_xlsx_folder_upload():
+    folder = filedialog.askdirectory(title="抽出結果のExcelファイルがあるフォルダを選択")
+    if folder:
+        excel_file_label.config(text=f"選択したフォルダ\n{folder}\n議事録を作成しています...")
+        root.update_idletasks()
+        threading.Thread(target=process_xlsx_folder_async, args=(folder,)).start()
+
+def process_xlsx_folder_async(folder):
     try:
-        if getattr(sys, 'frozen', False):
-            template_path = os.path.join(sys._MEIPASS, 'template.docx')
+        results = create_minutes_from_folder(folder)
+        failures = [result for result in results if not result.ok]
+        if not results:
+            message = "フォルダに抽出結果のExcelファイル（_抽出結果.xlsx）がありません。"
         else:
-            template_path = os.path.join(get_current_dir(), 'template.docx')
+            message = f"{len(results) - len(failures)}件の議事録を作成しました。"
+        if failures:
+            # 失敗したファイルは名前だけを表示し、詳しい理由はログに残します
+            names = "\n".join(os.path.basename(result.xlsx_path) for result in failures[:10])
+            more = f"\nほか{len(failures) - 10}件" if len(failures) > 10 else ""
+            message += f"\n\n{len(failures)}件は作成できませんでした:\n{names}{more}"
+        root.after(0, lambda: reset_file_info())
+        root.after(0, lambda: (messagebox.showinfo("完了", message), show_main_menu()))
+    except Exception as e:
+        logging.error(f"議事録の一括作成中にエラーが発生: {str(e)}")
+        # except節を抜けるとeは消えるので、メッセージは先に作っておきます
+        message = f"処理中にエラーが発生しました: {str(e)}"
+        root.after(0, lambda: messagebox.showerror("エラー", message))
+
+def process_xlsx_file_async(xlsx_file):
+    try:
+        template_path = get_template_path()
 
         output_directory = load_output_directory()
         output_path = os.path.join(output_directory, f"{os.path.splitext(os.path.basename(xlsx_file))[0]}_議事録.docx")
@@ -1105,47 +2017,61 @@ def process_xlsx_file_async(xlsx_file):
         logging.error(f"Excel処理中にエラーが発生: {str(e)}")
         messagebox.showerror("エラー", f"処理中にエラーが発生しました: {str(e)}")
 
-def process_audio_file_async(audio_file, processed_files, start_time):
-    global processing_done, selected_file, selected_file_name, estimated_time_text
-
-    def update_elapsed_time(start_time=start_time):  # nonlocalの代わりにパラメータとして渡す
-        if processing_done:
-            uploading_label.config(text="")  # 経過時間表示をクリア
-            return
-
-        if start_time:
-            try:
-                elapsed_time = int(time.time() - start_time)
-                minutes, seconds = divmod(elapsed_time, 60)
-                uploading_label.config(text=f"経過時間: {minutes}分{seconds}秒")
-                if not processing_done:
-                    root.after(1000, lambda: update_elapsed_time(start_time))
-            except Exception as e:
-                logging.error(f"経過時間の更新中にエラーが発生: {str(e)}")
-
-    # メインスレッドで最初の更新を開始
-    root.after(0, update_elapsed_time)
+def process_audio_file_async(audio_file, start_time):
+    """音声ファイルの処理をジョブとしてエンジンに渡し、終わったら画面に結果を表示する関数"""
+    global processing_done, current_audio_job
 
     # プロンプトが空でないか確認
     if not transcription_prompt:
         logging.error("プロンプトが空です。音声ファイルの処理を中止します。")
-        root.after(0, lambda: messagebox.showerror("エラー", "プロンプトが空です。処理を中止します。"))
+        processing_done = True
+        messagebox.showerror("エラー", "プロンプトが空です。処理を中止します。")
         return
 
+    logging.info(f"{audio_file}の処理を開始します。")
+    current_audio_job = pipeline_engine.submit(process_audio_file_job(audio_file), os.path.basename(audio_file))
+    tk_bridge.watch(current_audio_job, on_audio_job_done, show_stage)
+    # 中止ボタンと経過時間を表示するため、画面を作り直します
+    show_main_menu()
+
+def show_stage(handle):
+    """実行中の工程を画面に表示する関数（Tkのメインスレッドで呼びます）"""
+    if handle is current_audio_job and stage_label is not None and stage_label.winfo_exists():
+        stage_label.config(text=f"処理中: {STAGE_LABELS.get(handle.stage, handle.stage or '')} {handle.detail}".rstrip())
+
+def cancel_audio_job():
+    """実行中の音声ファイルの処理を中止する関数"""
+    if current_audio_job is not None and messagebox.askyesno("確認", "処理を中止しますか？\n次回は途中から再開できます。"):
+        current_audio_job.cancel()
+
+def on_audio_job_done(handle):
+    """音声ファイルのジョブが終わったときに結果を表示する関数（Tkのメインスレッドで呼びます）"""
+    global processing_done, current_audio_job
+    processing_done = True  # 処理完了を示すために True を設定
+    current_audio_job = None
+    if handle.cancelled():
+        reset_file_info()
+        show_main_menu()
+        messagebox.showinfo("中止", "処理を中止しました。")
+        return
     try:
-        logging.info(f"{audio_file}の処理を開始します。")
-        success = process_audio_file(audio_file, processed_files)
-        processing_done = True  # 処理完了を示すために True を設定
-
-        if success:
-            # 処理が成功した場合、選択したファイル情報と想定処理時間をリセット
-            root.after(0, lambda: reset_file_info())
-            root.after(0, lambda: (messagebox.showinfo("完了", "ファイルのアップロードが完了しました。"), show_main_menu()))
-        else:
-            root.after(0, lambda: messagebox.showerror("エラー", "ファイルの処理中にエラーが発生しました。"))
+        success = handle.result()
     except Exception as e:
         logging.exception(f"音声ファイルの処理中にエラーが発生しました: {str(e)}")
-        root.after(0, lambda: messagebox.showerror("エラー", "音声ファイルの処理中にエラーが発生しました。"))
+        show_main_menu()
+        messagebox.showerror("エラー", "音声ファイルの処理中にエラーが発生しました。")
+        return
+
+    if success:
+        # 会議一覧は画面を止めないよう、別のスレッドで作り直します
+        threading.Thread(target=export_meeting_index, daemon=True).start()
+        # 処理が成功した場合、選択したファイル情報と想定処理時間をリセット
+        reset_file_info()
+        show_main_menu()
+        messagebox.showinfo("完了", "ファイルのアップロードが完了しました。")
+    else:
+        show_main_menu()
+        messagebox.showerror("エラー", "ファイルの処理中にエラーが発生しました。")
 
 def reset_file_info():
     global selected_file, selected_file_name, estimated_time_text, processing_done, start_time
@@ -1169,5 +2095,93 @@ def add_dll_directory():
 # アプリケーション起動時に呼び出し
 add_dll_directory()
 
+def print_job_history(days=7):
+    """ジョブの台帳から、日ごとの処理件数・平均時間・トークン数と工程ごとの平均時間を表示する関数"""
+    ledger = get_job_ledger()
+    rows = ledger.throughput(days)
+    if not rows:
+        print(f"直近{days}日間に終わったジョブはありません。")
+        return
+    print("日付        成功  失敗  平均時間(秒)  音声(MB)  入力トークン  出力トークン")
+    for row in rows:
+        average = f"{row['average_seconds']:.0f}" if row['average_seconds'] is not None else '-'
+        print(f"{row['day']}  {row['succeeded']:>4}  {row['failed']:>4}  {average:>12}  "
+              f"{(row['total_bytes'] or 0) / (1024 * 1024):>8.1f}  {row['prompt_tokens']:>12}  {row['output_tokens']:>12}")
+    stage_seconds = ledger.stage_seconds(days)
+    if stage_seconds:
+        print("工程ごとの平均時間: " + " / ".join(
+            f"{STAGE_LABELS.get(stage, stage)} {seconds:.1f}秒" for stage, seconds in stage_seconds.items()))
+
+def parse_cli_args(argv):
+    """GUIを使わないバッチ処理用のコマンドライン引数を解析する関数"""
+    parser = argparse.ArgumentParser(prog="minutes_app", description="爆速議事録（ヘッドレスモード）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_common_arguments(subparser):
+        subparser.add_argument("paths", nargs="+", help="音声ファイルのあるディレクトリまたはglobパターン（.mp3/.m4a/.wav）")
+        subparser.add_argument("--jobs", type=int, default=2, help="同時に処理する録音の数")
+        subparser.add_argument("--max-requests", type=int, default=10, help="全ジョブで共有するAPI同時リクエスト数の上限")
+
+    batch_parser = subparsers.add_parser("batch", help="指定したファイルをまとめて処理します")
+    add_common_arguments(batch_parser)
+    batch_parser.add_argument("--force", action="store_true", help="処理済みのファイルも再処理します")
+
+    watch_parser = subparsers.add_parser("watch", help="フォルダを監視して新しいファイルを処理します")
+    add_common_arguments(watch_parser)
+    watch_parser.add_argument("--interval", type=float, default=10.0, help="フォルダを確認する間隔（秒）")
+
+    minutes_parser = subparsers.add_parser("minutes", help="フォルダの中の抽出結果のExcelファイルから議事録をまとめて作ります")
+    minutes_parser.add_argument("folder", help="抽出結果のExcelファイル（_抽出結果.xlsx）のあるフォルダ")
+    minutes_parser.add_argument("--output", help="議事録の保存先（省略すると設定の出力先）")
+    minutes_parser.add_argument("--workers", type=int, default=0, help="同時に使うプロセスの数（0ならCPUのコア数）")
+
+    subparsers.add_parser("export", help="会議一覧のExcelファイル（とParquetファイル）を索引から作り直します")
+
+    history_parser = subparsers.add_parser("history", help="ジョブの台帳から日ごとの処理件数と時間を表示します")
+    history_parser.add_argument("--days", type=int, default=7, help="表示する日数")
+
+    return parser.parse_args(argv)
+
+def cli_main(argv):
+    """ヘッドレスモードのエントリーポイント（終了コードを返す）"""
+    global transcription_prompt
+    args = parse_cli_args(argv)
+
+    if args.command == "minutes":
+        results = create_minutes_from_folder(args.folder, args.output, args.workers or None)
+        return 0 if all(result.ok for result in results) else 1
+
+    if args.command == "export":
+        export_meeting_index()
+        return 0
+
+    if args.command == "history":
+        print_job_history(args.days)
+        return 0
+
+    transcription_prompt = load_prompt_from_settings()
+    if not transcription_prompt:
+        logging.error("プロンプトが空です。処理を中止します。")
+        return 1
+    set_api_concurrency(args.max_requests)
+
+    if args.command == "watch":
+        watch_folders(args.paths, max_jobs=args.jobs, interval=args.interval)
+        return 0
+
+    if args.force:
+        audio_files = collect_audio_files(args.paths)
+    else:
+        audio_files = get_unprocessed_audio_files(args.paths)
+    if not audio_files:
+        logging.info("処理対象の音声ファイルがありません。")
+        return 0
+    succeeded, failed = run_batch(audio_files, max_jobs=args.jobs)
+    return 0 if failed == 0 else 1
+
 if __name__ == "__main__":
+    # ローカルの文字起こしモデルのプロセスプールを、exe化した後でも起動できるようにします
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1:
+        sys.exit(cli_main(sys.argv[1:]))
     main()
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""抽出結果のExcelファイル（_抽出結果.xlsx）から議事録をまとめて作るモジュール
+
+Excelファイルは読み取り専用・値のみで開き、B列の必要な行だけを読みます。
+コンパイル済みのテンプレートはワーカープロセスごとに1度だけ受け取り、
+ファイルごとの失敗は結果に記録して、残りのファイルの処理を続けます。
+"""
+import concurrent.futures
+import glob
+import logging
+import os
+from dataclasses import dataclass
+
+import openpyxl
+from openpyxl.utils.datetime import from_excel
+
+# 抽出結果のExcelファイルの名前の末尾
+EXTRACTION_SUFFIX = '_抽出結果.xlsx'
+# 議事録の名前の末尾
+MINUTES_SUFFIX = '_議事録.docx'
+# 抽出結果のExcelファイルに書かれている議題の数
+MAX_TOPICS = 20
+# 会議の情報（B1〜B5）に続いて、議題と要約が1行ずつ交互に並びます
+HEADER_FIELDS = ('会議名', '日時', '場所', '参加者', '欠席者')
+
+
+def convert_excel_date(value):
+    if isinstance(value, (int, float)):
+        return from_excel(value).strftime('%Y-%m-%d')
+    return value
+
+
+def read_minutes_data(file_path):
+    """抽出結果のExcelファイルから、議事録に差し込むデータを読む関数"""
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = wb.active
+        last_row = len(HEADER_FIELDS) + MAX_TOPICS * 2
+        values = [row[0] for row in sheet.iter_rows(min_row=1, max_row=last_row, min_col=2, max_col=2, values_only=True)]
+    finally:
+        wb.close()
+    # 空の行が末尾にあると、その分の行は返ってきません
+    values += [None] * (last_row - len(values))
+
+    data = {key: values[i] or '' for i, key in enumerate(HEADER_FIELDS)}
+    data['日時'] = convert_excel_date(values[1])
+    for i in range(1, MAX_TOPICS + 1):
+        topic_key = f'議題{chr(0x2460 + i - 1)}'
+        data[topic_key] = values[len(HEADER_FIELDS) + i * 2 - 2] or ''
+        data[f'{topic_key}の要約'] = values[len(HEADER_FIELDS) + i * 2 - 1] or ''
+    return data
+
+
+def minutes_path_for(xlsx_path, output_directory):
+    """抽出結果のExcelファイルに対応する議事録のパスを返す関数"""
+    return os.path.join(output_directory, f"{os.path.splitext(os.path.basename(xlsx_path))[0]}{MINUTES_SUFFIX}")
+
+
+def find_extraction_workbooks(folder):
+    """フォルダの中の抽出結果のExcelファイルを名前順に返す関数（Excelの一時ファイルは除きます）"""
+    paths = glob.glob(os.path.join(glob.escape(folder), f'*{EXTRACTION_SUFFIX}'))
+    return sorted(path for path in paths if not os.path.basename(path).startswith('~$'))
+
+
+@dataclass
+class MinutesResult:
+    """1件の議事録の作成結果"""
+    xlsx_path: str
+    output_path: str
+    error: str = ''
+
+    @property
+    def ok(self):
+        return not self.error
+
+
+# ワーカープロセスごとに1度だけ受け取るテンプレート
+_worker_template = None
+
+
+def _init_worker(template):
+    global _worker_template
+    _worker_template = template
+
+
+def render_minutes(template, xlsx_path, output_path):
+    """1件の抽出結果から議事録を作る関数（失敗しても例外は送出せず、結果に記録します）"""
+    try:
+        template.save(read_minutes_data(xlsx_path), output_path)
+        return MinutesResult(xlsx_path, output_path)
+    except Exception as e:
+        return MinutesResult(xlsx_path, output_path, f"{type(e).__name__}: {str(e)}")
+
+
+def _render_in_worker(xlsx_path, output_path):
+    return render_minutes(_worker_template, xlsx_path, output_path)
+
+
+def create_minutes_bulk(xlsx_paths, template, output_directory, max_workers=None, on_result=None):
+    """複数の抽出結果から議事録をプロセスプールでまとめて作る関数（結果のリストを入力の順に返す）
+
+    on_resultを指定すると、1件終わるたびに on_result(MinutesResult) を呼びます。
+    """
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(xlsx_paths)))
+    results = {}
+    if max_workers == 1:
+        # 1件だけ、または1コアなら、プロセスを起動せずにこのプロセスで作ります
+        for path in xlsx_paths:
+            results[path] = render_minutes(template, path, minutes_path_for(path, output_directory))
+            if on_result:
+                on_result(results[path])
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                                    initargs=(template,)) as executor:
+            futures = {executor.submit(_render_in_worker, path, minutes_path_for(path, output_directory)): path
+                       for path in xlsx_paths}
+            for future in concurrent.futures.as_completed(futures):
+                path = futures[future]
+                try:
+                    results[path] = future.result()
+                except Exception as e:
+                    # ワーカープロセスが異常終了した場合など
+                    results[path] = MinutesResult(path, minutes_path_for(path, output_directory), str(e))
+                if on_result:
+                    on_result(results[path])
+
+    failures = [result for result in results.values() if not result.ok]
+    for result in failures:
+        logging.error(f"議事録の作成に失敗しました: {result.xlsx_path} - {result.error}")
+    logging.info(f"議事録の一括作成: 成功{len(results) - len(failures)}件 / 失敗{len(failures)}件")
+    return [results[path] for path in xlsx_paths]
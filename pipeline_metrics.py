@@ -0,0 +1,185 @@
+"""処理の工程ごとの時間・リトライ・送信バイト数・トークン数を計測して書き出すモジュール
+
+ジョブごとのトレース（JSON Lines）と、Prometheusのテキスト形式のファイルを出力します。
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# メトリクス名の接頭辞
+PREFIX = 'minutes_'
+# 所要時間のヒストグラムの区切り（秒）
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def key_label(api_key):
+    """ログやメトリクスに出すためのAPIキーの表記（末尾4文字だけを残します）"""
+    if not api_key:
+        return 'none'
+    return f"***{api_key[-4:]}"
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels:
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{escaped}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class MetricsRegistry:
+    """カウンタとヒストグラムを保持し、Prometheusのテキスト形式で書き出すレジストリ"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}  # 名前 -> {ラベル: 値}
+        self._histograms = {}  # 名前 -> {ラベル: [区切りごとの件数, 合計, 件数]}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        """カウンタを増やす"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """ヒストグラムに値を1つ記録する"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            counts, total, count = series.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+            series[key] = (counts, total + value, count + 1)
+
+    def counter_value(self, name, **labels):
+        with self._lock:
+            return self._counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def histogram_summary(self, name):
+        """ヒストグラムのラベルごとの (合計, 件数) を返す"""
+        with self._lock:
+            return {labels: (total, count) for labels, (_, total, count) in self._histograms.get(name, {}).items()}
+
+    def render_prometheus(self):
+        """Prometheusのテキスト形式の文字列を返す"""
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                full_name = PREFIX + name
+                if name in self._help:
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} counter")
+                for labels, value in sorted(self._counters[name].items()):
+                    lines.append(f"{full_name}{_label_text(labels)} {value}")
+            for name in sorted(self._histograms):
+                full_name = PREFIX + name
+                if name in self._help:
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for labels, (counts, total, count) in sorted(self._histograms[name].items()):
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        lines.append(f"{full_name}_bucket{_label_text(labels + (('le', bound),))} {bucket_count}")
+                    lines.append(f"{full_name}_bucket{_label_text(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{full_name}_sum{_label_text(labels)} {total}")
+                    lines.append(f"{full_name}_count{_label_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Prometheusのテキスト形式でファイルに書き出す（node_exporterのtextfile collectorで読めるよう、一時ファイルから置き換えます）"""
+        directory = os.path.dirname(str(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(self.render_prometheus())
+        os.replace(temp_path, path)
+
+
+class JobTrace:
+    """1件のジョブの工程（スパン）と出来事をJSON Lines形式で記録するトレース
+
+    pathがNoneならファイルには書き出さず、メトリクスの記録だけを行います。
+    ジョブの台帳に残すため、工程ごとの合計時間・使ったAPIキー・トークン数はメモリにも集計します。
+    """
+
+    def __init__(self, path, registry=None, **attributes):
+        self.path = str(path) if path else None
+        self.registry = registry
+        self.attributes = attributes
+        self.stages = {}  # 工程 -> (最後の結果, 合計秒数)
+        self.keys = set()  # リクエストに使ったAPIキー（伏せ字）
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+        self._file = None
+        if self.path:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _write(self, record):
+        if self._file is None:
+            return
+        record.update(self.attributes)
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            try:
+                self._file.write(line + "\n")
+                self._file.flush()
+            except (OSError, ValueError) as e:
+                logging.error(f"トレースの書き込みに失敗しました: {str(e)}")
+
+    def event(self, name, **attrs):
+        """時間幅のない出来事（リトライ・キャッシュヒットなど）を記録する"""
+        self._write({'type': 'event', 'name': name, 'time': time.time(), 'attrs': attrs})
+
+    def record_span(self, name, start, duration, status='ok', **attrs):
+        """計測済みの工程を記録する"""
+        self._write({
+            'type': 'span', 'name': name, 'start': start, 'duration': round(duration, 6),
+            'status': status, 'thread': threading.current_thread().name, 'attrs': attrs,
+        })
+        with self._lock:
+            _, seconds = self.stages.get(name, (status, 0.0))
+            self.stages[name] = (status, seconds + duration)
+            if attrs.get('key'):
+                self.keys.add(attrs['key'])
+        if self.registry:
+            self.registry.observe('stage_seconds', duration, stage=name)
+
+    def add_tokens(self, prompt_tokens, output_tokens):
+        """このジョブで使ったトークン数を加える"""
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.output_tokens += output_tokens
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """with文の中の処理にかかった時間を工程として記録する"""
+        start = time.time()
+        started = time.perf_counter()
+        status = 'ok'
+        try:
+            yield attrs
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            self.record_span(name, start, time.perf_counter() - started, status, **attrs)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
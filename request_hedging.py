@@ -0,0 +1,98 @@
+"""応答の遅いリクエストを別のAPIキーでも送り、早く返ってきた方を使うためのモジュール（hedged request）
+
+直近のリクエストの所要時間を覚えておき、その百分位（例: 95パーセンタイル）を過ぎても
+応答がないリクエストだけ、空いている別のキーで同じリクエストを送ります。
+余分に送るリクエストは、通常のリクエスト数に対する割合で上限を決めます。
+"""
+import threading
+from collections import deque
+
+# 所要時間を覚えておくリクエストの数
+DEFAULT_WINDOW = 200
+# これより記録が少ないうちは、遅いかどうか判断できないので追加で送りません
+DEFAULT_MIN_SAMPLES = 20
+# 何パーセンタイルを過ぎたら追加で送るか
+DEFAULT_PERCENTILE = 95.0
+# 通常のリクエストに対して、追加で送ってよいリクエストの割合
+DEFAULT_MAX_EXTRA_RATIO = 0.1
+# 追加で送れる回数をためておける上限
+DEFAULT_MAX_BURST = 3.0
+
+
+class LatencyWindow:
+    """直近のリクエストの所要時間（秒）を一定数だけ覚えておく入れ物"""
+
+    def __init__(self, size=DEFAULT_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent):
+        """所要時間のpercentパーセンタイル（記録がなければNone）"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        # 最近傍法（nearest-rank）で求めます
+        rank = max(0, min(len(samples) - 1, int(round(percent / 100.0 * len(samples))) - 1))
+        return samples[rank]
+
+
+class HedgePolicy:
+    """いつ追加のリクエストを送るか、どれだけ送ってよいかを決める方針
+
+    追加で送れる回数は、通常のリクエストを1回送るたびに max_extra_ratio 回分ずつたまり、
+    max_burst 回分までためておけます（たまっていなければ送りません）。
+    """
+
+    def __init__(self, percentile=DEFAULT_PERCENTILE, max_extra_ratio=DEFAULT_MAX_EXTRA_RATIO,
+                 min_samples=DEFAULT_MIN_SAMPLES, window=DEFAULT_WINDOW, max_burst=DEFAULT_MAX_BURST):
+        self.percentile = percentile
+        self.max_extra_ratio = max_extra_ratio
+        self.min_samples = min_samples
+        self.max_burst = max_burst
+        self.latencies = LatencyWindow(window)
+        self.requests = 0
+        self.hedges = 0
+        self._credit = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """追加のリクエストを送るまでに待つ秒数（記録が足りなければNone）"""
+        if len(self.latencies) < self.min_samples:
+            return None
+        return self.latencies.percentile(self.percentile)
+
+    def record(self, seconds):
+        """成功したリクエストの所要時間を記録する"""
+        self.latencies.record(seconds)
+
+    def started(self):
+        """通常のリクエストを1回送ったことを記録する"""
+        with self._lock:
+            self.requests += 1
+            self._credit = min(self.max_burst, self._credit + self.max_extra_ratio)
+
+    def allow(self):
+        """追加のリクエストを1回分消費する（上限に達していればFalse）"""
+        with self._lock:
+            if self._credit < 1.0:
+                return False
+            self._credit -= 1.0
+            self.hedges += 1
+            return True
+
+    def snapshot(self):
+        """ログ出力用の状態"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hedges': self.hedges,
+                'delay': self.delay(),
+            }
@@ -0,0 +1,111 @@
+"""API呼び出しのリトライ方針（指数バックオフ・ジッター・リトライ予算）のモジュール"""
+import random
+import re
+import threading
+import time
+
+import google.api_core.exceptions
+
+# エラーの種類
+RETRYABLE = 'retryable'  # 時間をおけば成功する可能性があるエラー
+RATE_LIMITED = 'rate_limited'  # 利用制限（429）。別のキーならすぐに通る可能性があります
+KEY_INVALID = 'key_invalid'  # APIキー自体が使えないエラー。そのキーは以後使いません
+PERMANENT = 'permanent'  # リクエストの内容が原因で、やり直しても成功しないエラー
+
+RATE_LIMIT_ERRORS = (
+    google.api_core.exceptions.ResourceExhausted,
+    google.api_core.exceptions.TooManyRequests,
+)
+KEY_ERRORS = (
+    google.api_core.exceptions.Unauthenticated,
+    google.api_core.exceptions.PermissionDenied,
+)
+PERMANENT_ERRORS = (
+    google.api_core.exceptions.InvalidArgument,
+    google.api_core.exceptions.NotFound,
+    google.api_core.exceptions.FailedPrecondition,
+)
+
+# エラーメッセージに含まれる再試行までの待ち時間（例: "retry_delay { seconds: 38 }"、"Please retry in 38.5s"）
+RETRY_DELAY_PATTERNS = (
+    re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)'),
+    re.compile(r'retry in ([\d.]+)\s*s', re.IGNORECASE),
+)
+
+
+def classify_error(error):
+    """例外をリトライ方針上の種類に分類する関数"""
+    if isinstance(error, RATE_LIMIT_ERRORS):
+        return RATE_LIMITED
+    if isinstance(error, KEY_ERRORS):
+        return KEY_INVALID
+    if isinstance(error, PERMANENT_ERRORS):
+        # 無効なAPIキーは400 InvalidArgumentで返ってくることがあります
+        if 'API key not valid' in str(error) or 'API_KEY_INVALID' in str(error):
+            return KEY_INVALID
+        return PERMANENT
+    return RETRYABLE
+
+
+def retry_after_from(error):
+    """サーバーが指定した再試行までの待ち時間（秒）を取り出す関数（指定がなければNone）"""
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is not None:
+        return float(retry_after)
+    for detail in getattr(error, 'details', None) or []:
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is not None:
+            return delay.seconds + getattr(delay, 'nanos', 0) / 1e9
+    message = str(error)
+    for pattern in RETRY_DELAY_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class RetryPolicy:
+    """指数バックオフとジッターで待ち時間を決めるリトライ方針"""
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0, multiplier=2.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+
+    def delay(self, attempt, retry_after=None):
+        """attempt回目（0始まり）の失敗の後に待つ秒数を返す"""
+        if retry_after is not None:
+            # サーバーの指定を優先し、少しだけずらして同時に再試行が集中しないようにします
+            return retry_after + random.uniform(0, min(1.0, retry_after * 0.1))
+        ceiling = min(self.max_delay, self.base_delay * self.multiplier ** attempt)
+        # 半分は固定、残り半分をランダムにします（equal jitter）
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class RetryBudget:
+    """1つのジョブ全体で使えるリトライ回数と時間の上限"""
+
+    def __init__(self, max_retries=30, max_seconds=900.0):
+        self.max_retries = max_retries
+        self.max_seconds = max_seconds
+        self.retries = 0
+        self._deadline = time.monotonic() + max_seconds if max_seconds else None
+        self._lock = threading.Lock()
+
+    def remaining_seconds(self):
+        """時間の予算の残り（秒）。上限がなければNone"""
+        if self._deadline is None:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def allow_retry(self):
+        """リトライを1回分消費する（予算が残っていなければFalse）"""
+        with self._lock:
+            if self.max_retries is not None and self.retries >= self.max_retries:
+                return False
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                return False
+            self.retries += 1
+            return True
+
@@ -0,0 +1,244 @@
+"""settings.jsonを1度だけ読み込んでメモリに置き、安全に保存するための設定ストアのモジュール
+
+設定は読み込み時に検証し、型の合わない値は捨てて（呼び出し側の既定値を使うようにして）警告を残します。
+保存は一時ファイルに書いてから置き換えるので、保存の途中の壊れたファイルを読むことはありません。
+実行中に別のプログラムでsettings.jsonが書き換えられたときは、更新時刻を見て読み込み直します。
+変更があると、subscribe()で登録した関数に変更されたキーを知らせます。
+"""
+import copy
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+# 更新時刻を確かめる間隔（秒）。この間はファイルを見ずにメモリの設定を返します
+DEFAULT_CHECK_INTERVAL = 2.0
+
+NUMBER = (int, float)
+
+# 設定のキーごとの型（bool は int の一種なので、数値の設定には別に確かめます）
+SETTING_TYPES = {
+    'transcription_prompt': str,
+    'output_directory': str,
+    'gemini_api_keys': dict,
+    'chunk_seconds': NUMBER,
+    'chunk_max_mb': NUMBER,
+    'segment_mode': str,
+    'audio_encoding': str,
+    'speech_sample_rate': int,
+    'speech_bitrate': str,
+    'vad_enabled': bool,
+    'vad_drop_silence_seconds': NUMBER,
+    'key_requests_per_minute': NUMBER,
+    'key_tokens_per_minute': NUMBER,
+    'key_max_in_flight': int,
+    'key_cooldown_seconds': NUMBER,
+    'job_max_retries': int,
+    'job_retry_seconds': NUMBER,
+    'request_timeout_seconds': NUMBER,
+    'stage_timeout_seconds': dict,
+    'hedge_enabled': bool,
+    'hedge_percentile': NUMBER,
+    'hedge_max_extra_ratio': NUMBER,
+    'hedge_min_samples': int,
+    'cache_enabled': bool,
+    'cache_max_mb': NUMBER,
+    'cache_max_age_days': NUMBER,
+    'inline_max_mb': NUMBER,
+    'max_inflight_mb': NUMBER,
+    'meeting_index_enabled': bool,
+    'meeting_index_parquet': bool,
+    'metrics_enabled': bool,
+    'metrics_directory': str,
+    'transcription_backend': str,
+    'local_model': str,
+    'local_compute_type': str,
+    'local_workers': int,
+}
+# 選べる値が決まっている設定
+SETTING_CHOICES = {
+    'segment_mode': ('files', 'pipe'),
+    'audio_encoding': ('speech', 'lossless', 'original'),
+    'transcription_backend': ('gemini', 'local', 'auto'),
+}
+
+
+def _type_matches(value, expected):
+    if value is None:
+        # 空欄（null）は「設定なし」として許します
+        return True
+    if isinstance(value, bool) and expected is not bool:
+        return False
+    return isinstance(value, expected)
+
+
+def validate_settings(settings):
+    """設定を検証し、(正しい値だけの設定, 問題のあったキーと理由のリスト) を返す関数"""
+    if not isinstance(settings, dict):
+        return {}, [('', "設定がJSONのオブジェクトではありません")]
+    valid = {}
+    problems = []
+    for key, value in settings.items():
+        expected = SETTING_TYPES.get(key)
+        if expected is not None and not _type_matches(value, expected):
+            problems.append((key, f"型が正しくありません: {value!r}"))
+            continue
+        if key in SETTING_CHOICES and value is not None and value not in SETTING_CHOICES[key]:
+            problems.append((key, f"{'・'.join(SETTING_CHOICES[key])}のいずれかを指定してください: {value!r}"))
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and value < 0:
+            problems.append((key, f"負の値は指定できません: {value!r}"))
+            continue
+        valid[key] = value
+    return valid, problems
+
+
+def write_json_atomic(path, data):
+    """JSONを一時ファイルに書いてから置き換える関数（読む側が書きかけのファイルを見ることはありません）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.settings_', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class SettingsStore:
+    """settings.jsonの内容をメモリに置いておく設定ストア（どのスレッドからでも使えます）"""
+
+    def __init__(self, path, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.path = str(path)
+        self.check_interval = check_interval
+        self._raw = {}  # ファイルに書かれている内容（検証前）
+        self._settings = {}  # 検証済みの設定
+        self._signature = None
+        self._checked_at = 0.0
+        self._listeners = []
+        self._pending = set()  # まだ知らせていない変更されたキー
+        self._lock = threading.RLock()
+        self.reload()
+
+    def _stat_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload(self):
+        """settings.jsonを読み込み直す（読めなければ前の設定のままにします）。変更されたキーを返す"""
+        with self._lock:
+            changed = self._reload_locked()
+        self._notify()
+        return changed
+
+    def _reload_locked(self):
+        signature = self._stat_signature()
+        self._checked_at = time.monotonic()
+        if signature is None:
+            raw = {}
+        else:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    raw = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logging.error(f"settings.jsonを読み込めませんでした。前の設定を使い続けます: {str(e)}")
+                self._signature = signature
+                return set()
+        self._signature = signature
+        return self._apply(raw)
+
+    def _apply(self, raw):
+        """読み込んだ内容を検証して反映する（変更されたキーは、ロックを放した後で_notifyが知らせます）"""
+        settings, problems = validate_settings(raw)
+        for key, reason in problems:
+            logging.warning(f"settings.jsonの{key or '内容'}を無視します: {reason}")
+        changed = {key for key in set(settings) | set(self._settings) if settings.get(key) != self._settings.get(key)}
+        self._raw = raw if isinstance(raw, dict) else {}
+        self._settings = settings
+        self._pending |= changed
+        return changed
+
+    def _refresh(self):
+        """一定の間隔で更新時刻を確かめ、ファイルが変わっていれば読み込み直す"""
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return
+            if self._stat_signature() != self._signature:
+                self._reload_locked()
+            else:
+                self._checked_at = time.monotonic()
+        self._notify()
+
+    def get(self, key, default=None):
+        """設定の値を返す（設定されていないか正しくない値なら default）"""
+        self._refresh()
+        return copy.deepcopy(self._settings.get(key, default))
+
+    def snapshot(self):
+        """すべての設定のコピーを返す"""
+        self._refresh()
+        with self._lock:
+            return copy.deepcopy(self._settings)
+
+    def update(self, changes):
+        """設定を変更して保存する（検証に通らない値があればValueErrorを送出します）"""
+        _, problems = validate_settings(changes)
+        if problems:
+            raise ValueError("; ".join(f"{key}: {reason}" for key, reason in problems))
+        with self._lock:
+            # 他のプログラムが書き換えた内容を消さないよう、保存の直前に読み込み直してから変更します
+            if self._stat_signature() != self._signature:
+                self._reload_locked()
+            raw = dict(self._raw)
+            raw.update(changes)
+            write_json_atomic(self.path, raw)
+            self._signature = self._stat_signature()
+            self._checked_at = time.monotonic()
+            changed = self._apply(raw)
+        self._notify()
+        return changed
+
+    def create_if_missing(self, defaults):
+        """settings.jsonがなければ既定値で作る（作ったらTrue）"""
+        with self._lock:
+            if os.path.exists(self.path):
+                return False
+            write_json_atomic(self.path, defaults)
+            self._reload_locked()
+        self._notify()
+        return True
+
+    def subscribe(self, listener):
+        """設定が変わるたびに listener(変更されたキーの集合, 設定のストア) を呼ぶよう登録する"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def _notify(self):
+        """たまっている変更を登録された関数に知らせる（ロックを持たずに呼びます）
+
+        関数の中で他のロックを取ったり設定を読んだりしても、ロックの順序が逆になって止まることはありません。
+        """
+        with self._lock:
+            changed, self._pending = self._pending, set()
+            listeners = list(self._listeners)
+        if not changed:
+            return
+        for listener in listeners:
+            try:
+                listener(changed, self)
+            except Exception as e:
+                logging.error(f"設定の変更の通知中にエラーが発生しました: {str(e)}")
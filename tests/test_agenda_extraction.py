@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from agenda_extraction import (
+    MAX_TOPICS, MERGE_INSTRUCTIONS, create_merge_prompt, create_repair_prompt, format_agenda,
+    merge_agenda_items, parse_agenda_items, parse_agenda_json,
+)
+
+
+def test_parse_agenda_json():
+    reply = json.dumps({'topics': [
+        {'title': ' 予算 ', 'summary': '来期の予算案を確認した。'},
+        {'title': '人事', 'summary': '異動の時期を決めた。'},
+    ]}, ensure_ascii=False)
+    assert parse_agenda_json(reply) == [('予算', '来期の予算案を確認した。'), ('人事', '異動の時期を決めた。')]
+
+
+def test_parse_agenda_json_skips_empty_topics():
+    reply = json.dumps({'topics': [{'title': '', 'summary': 'x'}, {'title': '予算', 'summary': ' '}]})
+    assert parse_agenda_json(reply) == []
+
+
+@pytest.mark.parametrize('reply, message', [
+    ('議題: 予算', 'JSONとして読み取れません'),
+    (None, 'JSONとして読み取れません'),
+    ('[]', 'topicsの配列がありません'),
+    ('{"topics": {}}', 'topicsの配列がありません'),
+    ('{"topics": ["予算"]}', 'topics[0]がオブジェクトではありません'),
+    ('{"topics": [{"title": "予算"}]}', 'topics[0]のtitleまたはsummary'),
+    ('{"topics": [{"title": "予算", "summary": 3}]}', 'topics[0]のtitleまたはsummary'),
+])
+def test_parse_agenda_json_rejects_replies_off_the_schema(reply, message):
+    with pytest.raises(ValueError, match=message.replace('[', r'\[').replace(']', r'\]')):
+        parse_agenda_json(reply)
+
+
+def test_repair_prompt_resends_only_the_reply():
+    reply = '{"topics": [{"title": "予算"}]}'
+    try:
+        parse_agenda_json(reply)
+    except ValueError as e:
+        prompt = create_repair_prompt(reply, e)
+    assert prompt.endswith(reply)
+    assert 'titleまたはsummary' in prompt
+
+
+def test_merge_prompt_lists_partials_as_json():
+    partials = [[('予算', '案を確認')], [('人事', '異動を決定')]]
+    prompt = create_merge_prompt(partials)
+    assert prompt.startswith(MERGE_INSTRUCTIONS)
+    listing = json.loads(prompt[len(MERGE_INSTRUCTIONS):])
+    assert listing == [[{'title': '予算', 'summary': '案を確認'}], [{'title': '人事', 'summary': '異動を決定'}]]
+
+
+def test_parse_agenda_items_reads_every_legacy_style():
+    text = (
+        "議題①: 予算\n議題①の要約: 来期の予算案を\n確認した。\n\n"
+        "** 議題2：人事\n要約：異動の時期を決めた。\n"
+        "議題: 議題だけで要約がない\n"
+    )
+    assert parse_agenda_items(text) == [('予算', '来期の予算案を 確認した。'), ('人事', '異動の時期を決めた。')]
+
+
+def test_format_agenda_round_trips_through_the_legacy_parser():
+    items = [('予算', '案を確認した。'), ('人事', '異動を決めた。')]
+    formatted = format_agenda(items)
+    assert formatted.startswith("議題①: 予算\n議題①の要約: 案を確認した。")
+    assert parse_agenda_items(formatted) == items
+
+
+def test_format_agenda_stops_at_the_last_number():
+    items = [(f"議題{i}", f"要約{i}") for i in range(MAX_TOPICS + 5)]
+    assert len(parse_agenda_items(format_agenda(items))) == MAX_TOPICS
+
+
+def test_merge_agenda_items_joins_topics_with_the_same_name():
+    partials = [
+        [('予算', '案を確認した。'), ('人事', '異動を決めた。')],
+        [('予算 ', '金額を修正する。'), ('「人事」', '異動を決めた。'), ('採用', '計画を説明した。')],
+    ]
+    assert merge_agenda_items(partials) == [
+        ('予算', '案を確認した。 金額を修正する。'),
+        ('人事', '異動を決めた。'),
+        ('採用', '計画を説明した。'),
+    ]
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import types
+
+import pytest
+
+import api_key_pool
+from api_key_pool import ApiKeyPool, RATE_WINDOW_SECONDS
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(api_key_pool, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def test_requests_per_minute_moves_to_the_next_key(clock):
+    pool = ApiKeyPool(['a', 'b'], requests_per_minute=1, max_in_flight=2)
+    first = pool.try_acquire()
+    pool.release(first, success=True)
+    second = pool.try_acquire()
+    pool.release(second, success=True)
+
+    assert {first, second} == {'a', 'b'}
+    assert pool.try_acquire() is None
+    clock.advance(RATE_WINDOW_SECONDS)
+    assert pool.try_acquire() in ('a', 'b')
+
+
+def test_tokens_per_minute_budget(clock):
+    pool = ApiKeyPool(['a', 'b'], tokens_per_minute=100, max_in_flight=2)
+    first = pool.try_acquire(estimated_tokens=80)
+    second = pool.try_acquire(estimated_tokens=80)
+
+    assert {first, second} == {'a', 'b'}
+    assert pool.try_acquire(estimated_tokens=80) is None
+    # 小さいリクエストなら、残りの予算に収まるキーで通ります
+    assert pool.try_acquire(estimated_tokens=10) in ('a', 'b')
+
+
+def test_request_larger_than_the_budget_is_still_served(clock):
+    pool = ApiKeyPool(['a'], tokens_per_minute=100)
+    assert pool.try_acquire(estimated_tokens=500) == 'a'
+
+
+def test_in_flight_limit(clock):
+    pool = ApiKeyPool(['a'], max_in_flight=1)
+    assert pool.try_acquire() == 'a'
+    assert pool.try_acquire() is None
+    pool.cancel('a')
+    assert pool.try_acquire() == 'a'
+
+
+def test_rate_limited_key_cools_down_for_retry_after(clock):
+    pool = ApiKeyPool(['a', 'b'])
+    key = pool.try_acquire()
+    pool.release(key, success=False, exhausted=True, retry_after=30)
+    other = pool.try_acquire()
+    pool.release(other, success=True)
+
+    assert other != key
+    assert pool.try_acquire(exclude=[other]) is None
+    clock.advance(32)
+    assert pool.try_acquire(exclude=[other]) == key
+
+
+def test_cooldown_grows_with_consecutive_rate_limits(clock):
+    pool = ApiKeyPool(['a'], cooldown_seconds=60)
+    cooldowns = []
+    for _ in range(3):
+        pool.release(pool.acquire(), success=False, exhausted=True)
+        cooldowns.append(pool.snapshot()[0]['cooldown'])
+        clock.advance(cooldowns[-1] + 0.1)
+
+    # 1回目は2.5〜5秒、2回目は5〜10秒、3回目は10〜20秒（equal jitter）
+    assert 2.5 <= cooldowns[0] <= 5
+    assert 5 <= cooldowns[1] <= 10
+    assert 10 <= cooldowns[2] <= 20
+
+    # 成功すれば、次の利用制限は最初の長さに戻ります
+    pool.release(pool.acquire(), success=True)
+    pool.release(pool.acquire(), success=False, exhausted=True)
+    assert pool.snapshot()[0]['cooldown'] <= 5
+
+
+def test_disabled_keys_are_never_lent(clock):
+    pool = ApiKeyPool(['a', 'b'])
+    pool.release('a', success=False, disable=True)
+    assert pool.acquire() == 'b'
+    pool.release('b', success=False, disable=True)
+    assert pool.acquire() is None
+
+
+def test_exclude_falls_back_when_nothing_else_is_free(clock):
+    pool = ApiKeyPool(['a', 'b'], max_in_flight=2)
+    assert pool.try_acquire(exclude=['a']) == 'b'
+    assert pool.try_acquire(exclude=['a', 'b']) is None
+    assert pool.acquire(exclude=['a', 'b']) in ('a', 'b')
+
+
+def test_prefers_the_key_with_the_better_success_rate(clock):
+    pool = ApiKeyPool(['a', 'b'])
+    for _ in range(3):
+        pool.acquire(exclude=['b'])
+        pool.release('a', success=False)
+    assert pool.acquire() == 'b'
+
+
+def test_acquire_times_out():
+    pool = ApiKeyPool(['a'])
+    assert pool.acquire() == 'a'
+    assert pool.acquire(timeout=0.05) is None
+
+
+def test_acquire_async_wakes_on_release_from_another_thread():
+    pool = ApiKeyPool(['a'])
+    assert pool.acquire() == 'a'
+
+    async def main():
+        threading.Timer(0.05, pool.release, ('a',), {'success': True}).start()
+        return await asyncio.wait_for(pool.acquire_async(), 2)
+
+    assert asyncio.run(main()) == 'a'
+
+
+def test_cancelled_acquire_async_does_not_hold_a_key():
+    pool = ApiKeyPool(['a'])
+    assert pool.acquire() == 'a'
+
+    async def main():
+        task = asyncio.ensure_future(pool.acquire_async())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    pool.release('a', success=True)
+    assert pool.try_acquire() == 'a'
@@ -0,0 +1,81 @@
+import io
+import os
+
+import pytest
+from docx import Document
+
+from docx_template import CompiledTemplate, load_template
+
+
+@pytest.fixture
+def template_path(tmp_path):
+    document = Document()
+    # 差し込み位置が複数のランにまたがっている段落（Wordで編集すると起こります）
+    paragraph = document.add_paragraph()
+    paragraph.add_run("会議：「会").bold = True
+    paragraph.add_run("議")
+    paragraph.add_run("名」です")
+    document.add_paragraph("日時「日時」、場所「場所」")
+    table = document.add_table(rows=1, cols=2)
+    table.cell(0, 0).text = "議題①"
+    table.cell(0, 1).text = "「議題①の要約」"
+    document.sections[0].header.paragraphs[0].text = "「会議名」の議事録"
+    path = tmp_path / "template.docx"
+    document.save(path)
+    return str(path)
+
+
+def render(template_path, values):
+    return Document(io.BytesIO(CompiledTemplate(template_path).render(values)))
+
+
+def test_placeholders_are_found_across_runs_tables_and_headers(template_path):
+    assert CompiledTemplate(template_path).placeholders == {'会議名', '日時', '場所', '議題①の要約'}
+
+
+def test_values_replace_placeholders_split_across_runs(template_path):
+    document = render(template_path, {'会議名': '定例会議', '日時': '4月1日', '場所': '会議室A', '議題①の要約': '予算を確認'})
+    assert document.paragraphs[0].text == "会議：定例会議です"
+    assert document.paragraphs[1].text == "日時4月1日、場所会議室A"
+    assert document.tables[0].cell(0, 1).text == "予算を確認"
+    assert document.sections[0].header.paragraphs[0].text == "定例会議の議事録"
+
+
+def test_formatting_of_the_first_run_is_kept(template_path):
+    document = render(template_path, {'会議名': '定例会議'})
+    runs = document.paragraphs[0].runs
+    assert runs[0].bold and runs[0].text == "会議：定例会議"
+    assert not runs[-1].bold and runs[-1].text == "です"
+
+
+def test_missing_values_keep_the_placeholder(template_path):
+    document = render(template_path, {'日時': '4月1日'})
+    assert document.paragraphs[1].text == "日時4月1日、場所「場所」"
+
+
+def test_values_are_escaped_and_line_breaks_become_breaks(template_path):
+    document = render(template_path, {'会議名': 'A&B <定例>\n第2部\x07'})
+    paragraph = document.paragraphs[0]
+    assert paragraph.text == "会議：A&B <定例>\n第2部です"
+    assert paragraph._p.xml.count('<w:br/>') == 1
+
+
+def test_save_writes_a_valid_docx(template_path, tmp_path):
+    output = tmp_path / "out.docx"
+    CompiledTemplate(template_path).save({'会議名': '定例会議'}, str(output))
+    assert Document(str(output)).paragraphs[0].text == "会議：定例会議です"
+
+
+def test_load_template_is_cached_until_the_file_changes(template_path):
+    first = load_template(template_path)
+    assert load_template(template_path) is first
+
+    document = Document(template_path)
+    document.add_paragraph("「追加」")
+    document.save(template_path)
+    stat = os.stat(template_path)
+    os.utime(template_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    second = load_template(template_path)
+    assert second is not first
+    assert '追加' in second.placeholders
@@ -0,0 +1,128 @@
+import json
+import os
+
+import pytest
+
+from audio_chunks import AudioChunk
+from job_manifest import DONE, FAILED, PENDING, JobManifest
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "meeting.mp3"
+    path.write_bytes(b"audio")
+    return str(path)
+
+
+@pytest.fixture
+def jobs_dir(tmp_path):
+    return str(tmp_path / "jobs")
+
+
+def planned(jobs_dir, source, count=3):
+    manifest = JobManifest.open(jobs_dir, source, 'v1')
+    manifest.set_plan([AudioChunk(i, i * 10.0, i * 10.0 + 12, 2.0 if i else 0.0) for i in range(count)])
+    return manifest
+
+
+def test_new_manifest_is_not_resumed(jobs_dir, source):
+    manifest = JobManifest.open(jobs_dir, source, 'v1')
+    assert not manifest.resumed
+    assert manifest.chunks is None
+
+
+def test_plan_round_trips(jobs_dir, source):
+    planned(jobs_dir, source)
+    manifest = JobManifest.open(jobs_dir, source, 'v1')
+    assert manifest.resumed
+    assert manifest.chunks[1] == AudioChunk(1, 10.0, 22.0, 2.0)
+    assert manifest.pending_indices() == [0, 1, 2]
+
+
+def test_chunk_results_are_appended_and_replayed(jobs_dir, source):
+    manifest = planned(jobs_dir, source)
+    manifest_bytes = os.path.getsize(manifest.path)
+    manifest.record_chunk(0, "こんにちは")
+    manifest.record_chunk(2, None)
+    manifest.record_chunk_extraction(0, [["議題", "要約"]])
+
+    # チャンクの結果はログに追記するだけで、マニフェスト本体は書き直しません
+    assert os.path.getsize(manifest.path) == manifest_bytes
+    with open(manifest.log_path, encoding='utf-8') as f:
+        assert len(f.readlines()) == 3
+
+    reopened = JobManifest.open(jobs_dir, source, 'v1')
+    assert reopened.transcripts() == ["こんにちは", None, None]
+    assert [c['status'] for c in reopened.data['chunks']] == [DONE, PENDING, FAILED]
+    assert reopened.chunk_extractions() == [[["議題", "要約"]], None, None]
+    assert reopened.pending_indices() == [1, 2]
+
+
+def test_new_transcript_clears_the_old_extraction(jobs_dir, source):
+    manifest = planned(jobs_dir, source)
+    manifest.record_chunk(0, "一回目")
+    manifest.record_chunk_extraction(0, [["議題", "要約"]])
+    manifest.record_chunk(0, "二回目")
+
+    reopened = JobManifest.open(jobs_dir, source, 'v1')
+    assert reopened.transcripts()[0] == "二回目"
+    assert reopened.chunk_extractions()[0] is None
+
+
+def test_torn_last_line_is_skipped(jobs_dir, source):
+    manifest = planned(jobs_dir, source)
+    manifest.record_chunk(0, "最初")
+    manifest.record_chunk(1, "二番目")
+    with open(manifest.log_path, 'a', encoding='utf-8') as f:
+        f.write('{"index": 2, "status": "do')
+
+    reopened = JobManifest.open(jobs_dir, source, 'v1')
+    assert reopened.transcripts() == ["最初", "二番目", None]
+
+
+def test_log_entries_out_of_range_are_ignored(jobs_dir, source):
+    manifest = planned(jobs_dir, source, count=1)
+    with open(manifest.log_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'index': 5, 'transcript': 'x'}) + "\n")
+        f.write(json.dumps({'transcript': 'y'}) + "\n")
+
+    reopened = JobManifest.open(jobs_dir, source, 'v1')
+    assert reopened.transcripts() == [None]
+
+
+def test_save_folds_the_log_into_the_manifest(jobs_dir, source):
+    manifest = planned(jobs_dir, source)
+    manifest.record_chunk(0, "テキスト")
+    manifest.complete_stage('transcription', 'transcript.docx')
+
+    assert not os.path.exists(manifest.log_path)
+    reopened = JobManifest.open(jobs_dir, source, 'v1')
+    assert reopened.transcripts()[0] == "テキスト"
+    assert reopened.stage_result('transcription') == 'transcript.docx'
+
+
+def test_reset_stages_after(jobs_dir, source):
+    manifest = planned(jobs_dir, source)
+    for stage in ('transcription', 'docx', 'extraction'):
+        manifest.complete_stage(stage)
+    manifest.reset_stages_after('docx')
+
+    reopened = JobManifest.open(jobs_dir, source, 'v1')
+    assert reopened.stage_done('transcription') and reopened.stage_done('docx')
+    assert not reopened.stage_done('extraction')
+
+
+def test_changed_fingerprint_starts_over(jobs_dir, source):
+    manifest = planned(jobs_dir, source)
+    manifest.record_chunk(0, "古い設定の結果")
+
+    reopened = JobManifest.open(jobs_dir, source, 'v2')
+    assert not reopened.resumed
+
+
+def test_remove_deletes_manifest_and_log(jobs_dir, source):
+    manifest = planned(jobs_dir, source)
+    manifest.record_chunk(0, "テキスト")
+    manifest.remove()
+    assert not os.path.exists(manifest.path)
+    assert not os.path.exists(manifest.log_path)
@@ -0,0 +1,126 @@
+import os
+import struct
+import wave
+
+import pytest
+
+import media_probe
+from media_probe import MediaInfo, MediaProbe, probe_header
+
+# MPEG-1 Layer III・128kbps・44.1kHz・ステレオのフレームヘッダーと、その1フレームの長さ
+MP3_HEADER = b'\xff\xfb\x90\x00'
+MP3_FRAME_BYTES = 144 * 128000 // 44100
+
+
+def write_wav(path, seconds, sample_rate=8000):
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(b'\x00\x00' * int(seconds * sample_rate))
+
+
+def mp3_frames(count, first_frame=None):
+    frame = MP3_HEADER + b'\x00' * (MP3_FRAME_BYTES - 4)
+    frames = [frame] * count
+    if first_frame is not None:
+        frames[0] = first_frame
+    return b''.join(frames)
+
+
+def id3v2_tag(size):
+    syncsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b'ID3\x04\x00\x00' + syncsafe + b'\x00' * size
+
+
+def atom(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def test_wav(tmp_path):
+    path = tmp_path / "a.wav"
+    write_wav(path, 2.5)
+    info = probe_header(path)
+    assert info.format == 'wav'
+    assert info.duration == pytest.approx(2.5)
+    assert (info.sample_rate, info.channels, info.bit_rate) == (8000, 1, 128000)
+
+
+def test_truncated_wav_uses_the_real_size(tmp_path):
+    path = tmp_path / "a.wav"
+    write_wav(path, 2.0)
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 8000)
+    assert probe_header(path).duration == pytest.approx(1.5)
+
+
+def test_cbr_mp3_with_id3_tags(tmp_path):
+    path = tmp_path / "a.mp3"
+    path.write_bytes(id3v2_tag(300) + mp3_frames(100) + b'TAG' + b'\x00' * 125)
+    info = probe_header(path)
+    assert info.format == 'mp3'
+    assert (info.sample_rate, info.channels, info.bit_rate) == (44100, 2, 128000)
+    assert info.duration == pytest.approx(100 * MP3_FRAME_BYTES * 8 / 128000)
+
+
+def test_vbr_mp3_reads_the_xing_frame_count(tmp_path):
+    # MPEG-1のステレオでは、Xingヘッダーはフレームヘッダーとサイド情報（32バイト）の後にあります
+    xing = MP3_HEADER + b'\x00' * 32 + b'Xing' + struct.pack('>II', 0x01, 5000)
+    first = xing + b'\x00' * (MP3_FRAME_BYTES - len(xing))
+    path = tmp_path / "a.mp3"
+    path.write_bytes(mp3_frames(10, first_frame=first))
+    assert probe_header(path).duration == pytest.approx(5000 * 1152 / 44100)
+
+
+def test_m4a_reads_mvhd(tmp_path):
+    mvhd = atom(b'mvhd', b'\x00\x00\x00\x00' + struct.pack('>IIII', 0, 0, 1000, 90500) + b'\x00' * 80)
+    path = tmp_path / "a.m4a"
+    path.write_bytes(atom(b'ftyp', b'M4A \x00\x00\x00\x00') + atom(b'free', b'\x00' * 16)
+                     + atom(b'moov', mvhd) + atom(b'mdat', b'\x00' * 1000))
+    info = probe_header(path)
+    assert info.format == 'mp4'
+    assert info.duration == pytest.approx(90.5)
+
+
+def test_wrong_extension_still_parses(tmp_path):
+    path = tmp_path / "really_a_wav.mp3"
+    write_wav(path, 1.0)
+    assert probe_header(path).format == 'wav'
+
+
+def test_unreadable_header(tmp_path):
+    path = tmp_path / "a.mp3"
+    path.write_bytes(b'not audio at all' * 100)
+    assert probe_header(path) is None
+
+
+def test_probe_caches_by_path_mtime_and_size(tmp_path, monkeypatch):
+    path = tmp_path / "a.wav"
+    write_wav(path, 1.0)
+    calls = []
+    monkeypatch.setattr(media_probe, 'probe_header', lambda p: calls.append(p) or probe_header(p))
+    probe = MediaProbe()
+
+    first = probe.probe(str(path))
+    assert probe.probe(str(path)) is first
+    assert len(calls) == 1
+
+    write_wav(path, 3.0)
+    assert probe.probe(str(path)).duration == pytest.approx(3.0)
+    assert len(calls) == 2
+
+
+def test_falls_back_to_ffprobe(tmp_path, monkeypatch):
+    path = tmp_path / "a.mp3"
+    path.write_bytes(b'not audio at all')
+    fallback = MediaInfo(12.0, 'mp3', source='ffprobe')
+    monkeypatch.setattr(media_probe, 'probe_ffprobe', lambda ffprobe_path, p: fallback)
+    assert MediaProbe('ffprobe').probe(str(path)) is fallback
+
+
+def test_cache_is_bounded(tmp_path):
+    probe = MediaProbe(max_entries=2)
+    for name in ('a', 'b', 'c'):
+        write_wav(tmp_path / f"{name}.wav", 1.0)
+        probe.probe(str(tmp_path / f"{name}.wav"))
+    assert len(probe._entries) == 2
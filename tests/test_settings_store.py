@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+
+import pytest
+
+from settings_store import SettingsStore, validate_settings, write_json_atomic
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "settings.json")
+
+
+def write(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def touch_later(path):
+    """更新時刻を進めて、書き換えられたことが確実に分かるようにする"""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_validate_settings_keeps_only_valid_values():
+    valid, problems = validate_settings({
+        'chunk_seconds': 300,
+        'cache_max_mb': 1.5,
+        'vad_enabled': True,
+        'metrics_directory': None,
+        'unknown_key': 'kept',
+        'key_max_in_flight': 1.5,
+        'hedge_enabled': 'yes',
+        'job_max_retries': True,
+        'segment_mode': 'stream',
+        'cache_max_age_days': -1,
+    })
+    assert valid == {'chunk_seconds': 300, 'cache_max_mb': 1.5, 'vad_enabled': True,
+                     'metrics_directory': None, 'unknown_key': 'kept'}
+    assert sorted(key for key, _ in problems) == [
+        'cache_max_age_days', 'hedge_enabled', 'job_max_retries', 'key_max_in_flight', 'segment_mode']
+
+
+def test_validate_settings_rejects_non_objects():
+    assert validate_settings(['a']) == ({}, [('', "設定がJSONのオブジェクトではありません")])
+
+
+def test_invalid_values_fall_back_to_the_default(path):
+    write(path, {'chunk_seconds': 'long', 'output_directory': 'out'})
+    store = SettingsStore(path)
+    assert store.get('chunk_seconds', 300) == 300
+    assert store.get('output_directory') == 'out'
+
+
+def test_missing_and_broken_files(path):
+    store = SettingsStore(path, check_interval=0)
+    assert store.snapshot() == {}
+    write(path, {'output_directory': 'out'})
+    touch_later(path)
+    assert store.get('output_directory') == 'out'
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"output_directory": ')
+    touch_later(path)
+    # 読めないファイルでは前の設定を使い続けます
+    assert store.get('output_directory') == 'out'
+
+
+def test_values_are_copies(path):
+    write(path, {'gemini_api_keys': {'GEMINI_API_KEY_1': 'a'}})
+    store = SettingsStore(path)
+    store.get('gemini_api_keys')['GEMINI_API_KEY_2'] = 'b'
+    store.snapshot()['gemini_api_keys'].clear()
+    assert store.get('gemini_api_keys') == {'GEMINI_API_KEY_1': 'a'}
+
+
+def test_update_saves_atomically_and_keeps_unknown_keys(path):
+    write(path, {'output_directory': 'out', 'custom': 1})
+    store = SettingsStore(path)
+    assert store.update({'chunk_seconds': 600}) == {'chunk_seconds'}
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) == {'output_directory': 'out', 'custom': 1, 'chunk_seconds': 600}
+    assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith('.tmp')]
+
+
+def test_update_rejects_invalid_values(path):
+    write(path, {'chunk_seconds': 300})
+    store = SettingsStore(path)
+    with pytest.raises(ValueError, match='segment_mode'):
+        store.update({'segment_mode': 'stream'})
+    assert store.get('segment_mode') is None
+
+
+def test_update_keeps_changes_made_by_another_program(path):
+    write(path, {'chunk_seconds': 300})
+    store = SettingsStore(path, check_interval=3600)
+    write(path, {'chunk_seconds': 300, 'output_directory': 'elsewhere'})
+    touch_later(path)
+    store.update({'cache_enabled': False})
+    assert store.get('output_directory') == 'elsewhere'
+
+
+def test_external_edits_are_picked_up_after_the_interval(path):
+    write(path, {'chunk_seconds': 300})
+    store = SettingsStore(path, check_interval=0)
+    write(path, {'chunk_seconds': 120})
+    touch_later(path)
+    assert store.get('chunk_seconds') == 120
+
+
+def test_listeners_get_the_changed_keys(path):
+    write(path, {'chunk_seconds': 300, 'cache_enabled': True})
+    store = SettingsStore(path)
+    calls = []
+    store.subscribe(lambda changed, s: calls.append((changed, s.get('chunk_seconds'))))
+
+    store.update({'chunk_seconds': 600, 'cache_enabled': True})
+    store.update({'chunk_seconds': 600})
+    assert calls == [({'chunk_seconds'}, 600)]
+
+
+def test_listeners_run_without_the_store_lock(path):
+    write(path, {'chunk_seconds': 300})
+    store = SettingsStore(path)
+    seen = []
+
+    def listener(changed, s):
+        # 他のスレッドからも設定を読めること（ロックを持ったまま呼ばれていないこと）を確かめます
+        reader = threading.Thread(target=lambda: seen.append(s.snapshot()))
+        reader.start()
+        reader.join(timeout=2)
+    store.subscribe(listener)
+    store.update({'chunk_seconds': 600})
+    assert seen and seen[0]['chunk_seconds'] == 600
+
+
+def test_failing_listener_does_not_stop_the_others(path):
+    write(path, {})
+    store = SettingsStore(path)
+    calls = []
+    store.subscribe(lambda changed, s: 1 / 0)
+    store.subscribe(lambda changed, s: calls.append(changed))
+    store.update({'chunk_seconds': 600})
+    assert calls == [{'chunk_seconds'}]
+
+
+def test_create_if_missing(path):
+    store = SettingsStore(path)
+    assert store.create_if_missing({'chunk_seconds': 300})
+    assert store.get('chunk_seconds') == 300
+    assert not store.create_if_missing({'chunk_seconds': 60})
+    assert store.get('chunk_seconds') == 300
+
+
+def test_write_json_atomic_leaves_no_temp_file_on_failure(tmp_path):
+    target = tmp_path / "out.json"
+    with pytest.raises(TypeError):
+        write_json_atomic(str(target), {'value': object()})
+    assert not target.exists()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,54 @@
+from audio_chunks import AudioChunk
+from transcript_stitch import find_seam, normalize, stitch_transcripts
+
+FIRST = "今日は定例会議を始めます。まず来期の予算について話します。次に人事異動の話です。"
+SECOND = "来期の予算について話します。次に人事異動の話です。最後に質問を受け付けます。"
+JOINED = "今日は定例会議を始めます。まず来期の予算について話します。次に人事異動の話です。最後に質問を受け付けます。"
+
+
+def test_normalize_drops_spaces_and_punctuation():
+    text, positions = normalize("あ、い う。")
+    assert text == "あいう"
+    assert positions == [0, 2, 4]
+
+
+def test_overlap_is_removed_at_the_seam():
+    assert stitch_transcripts([FIRST, SECOND]) == JOINED
+
+
+def test_overlap_with_different_punctuation_is_matched():
+    second = SECOND.replace("。", "、").replace("について", " について ")
+    stitched = stitch_transcripts([FIRST, second])
+    assert stitched.count("予算") == 1
+    assert stitched.startswith("今日は定例会議を始めます。")
+    assert stitched.endswith("最後に質問を受け付けます、")
+
+
+def test_unrelated_texts_are_joined_with_a_newline():
+    assert find_seam("今日は晴れています。", "明日は雨が降るでしょう。", 100) is None
+    assert stitch_transcripts(["今日は晴れています。", "明日は雨が降るでしょう。"]) == \
+        "今日は晴れています。\n明日は雨が降るでしょう。"
+
+
+def test_failed_chunk_breaks_the_seam():
+    assert stitch_transcripts([FIRST, None, SECOND]) == FIRST + "\n" + SECOND
+
+
+def test_chunks_cut_in_silence_are_not_matched():
+    chunks = [AudioChunk(0, 0.0, 60.0, 0.0), AudioChunk(1, 60.0, 120.0, 0.0)]
+    assert stitch_transcripts([FIRST, SECOND], chunks) == FIRST + "\n" + SECOND
+
+
+def test_overlapping_chunks_use_the_plan():
+    chunks = [AudioChunk(0, 0.0, 60.0, 0.0), AudioChunk(1, 30.0, 90.0, 30.0)]
+    assert stitch_transcripts([FIRST, SECOND], chunks) == JOINED
+
+
+def test_three_chunks():
+    third = "最後に質問を受け付けます。以上で会議を終わります。"
+    assert stitch_transcripts([FIRST, SECOND, third]) == JOINED + "以上で会議を終わります。"
+
+
+def test_empty_input():
+    assert stitch_transcripts([]) == ''
+    assert stitch_transcripts([None, '']) == ''
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from audio_chunks import AudioChunk
+from voice_activity import (
+    ANALYSIS_SAMPLE_RATE, FRAME_SECONDS, MIN_SPEECH_DB, band_levels, plan_speech_chunks, speech_regions,
+    speech_seconds, speech_threshold,
+)
+
+# 計算しやすいよう、区間の検出のテストでは0.1秒のフレームを使います
+TEST_FRAME_SECONDS = 0.1
+
+
+def levels_for(*segments):
+    """(秒数, dB) の並びから、TEST_FRAME_SECONDSごとのエネルギーの配列を作る"""
+    return np.concatenate([np.full(round(seconds / TEST_FRAME_SECONDS), db) for seconds, db in segments])
+
+
+def tone_frames(frequency, frames=10):
+    frame_length = int(ANALYSIS_SAMPLE_RATE * FRAME_SECONDS)
+    t = np.arange(frame_length * frames) / ANALYSIS_SAMPLE_RATE
+    return (0.5 * np.sin(2 * np.pi * frequency * t)).reshape(frames, frame_length)
+
+
+def test_band_levels_measure_the_speech_band():
+    voice = band_levels(tone_frames(1000))
+    hum = band_levels(tone_frames(50))
+    assert voice.shape == (10,)
+    assert (voice - hum > 30).all()
+
+
+def test_threshold_sits_above_the_noise_floor():
+    levels = levels_for((10, -70), (10, -20))
+    assert speech_threshold(levels) == pytest.approx(-58)
+    # 雑音の大きさに関係なく、MIN_SPEECH_DBより下にはなりません
+    assert speech_threshold(levels_for((10, -120), (10, -20))) == MIN_SPEECH_DB
+
+
+def test_speech_regions_are_padded_and_clamped():
+    levels = levels_for((2, -70), (3, -20), (5, -70), (1, -20))
+    regions = speech_regions(levels, TEST_FRAME_SECONDS, padding_seconds=0.2)
+    assert regions == [pytest.approx((1.8, 5.2)), pytest.approx((9.8, 11.0))]
+
+
+def test_short_silences_are_bridged_and_short_blips_dropped():
+    levels = levels_for((1, -70), (2, -20), (0.3, -70), (2, -20), (3, -70), (0.1, -20), (3, -70))
+    regions = speech_regions(levels, TEST_FRAME_SECONDS, padding_seconds=0.0)
+    assert regions == [pytest.approx((1.0, 5.3))]
+
+
+def test_no_levels_means_no_speech():
+    assert speech_regions(np.zeros(0)) == []
+
+
+def test_chunks_are_cut_in_the_longest_late_silence():
+    regions = [(0.0, 40.0), (42.0, 70.0), (73.0, 100.0)]
+    chunks = plan_speech_chunks(regions, target_seconds=60)
+    assert chunks == [AudioChunk(0, 0.0, 41.0, 0.0), AudioChunk(1, 41.0, 100.0, 0.0)]
+
+
+def test_long_silences_are_dropped():
+    regions = [(0.0, 10.0), (50.0, 60.0)]
+    chunks = plan_speech_chunks(regions, target_seconds=60, drop_silence_seconds=20)
+    assert chunks == [AudioChunk(0, 0.0, 10.0, 0.0), AudioChunk(1, 50.0, 60.0, 0.0)]
+    assert speech_seconds(chunks) == pytest.approx(20.0)
+
+
+def test_speech_without_silences_falls_back_to_overlapping_cuts():
+    chunks = plan_speech_chunks([(0.0, 130.0)], target_seconds=60, overlap_ratio=0.1)
+    assert chunks == [
+        AudioChunk(0, 0.0, 60.0, 0.0),
+        AudioChunk(1, 54.0, 114.0, 6.0),
+        AudioChunk(2, 108.0, 130.0, 6.0),
+    ]
+    # 重なった分は二重に数えません
+    assert speech_seconds(chunks) == pytest.approx(130.0)
+
+
+def test_no_regions_means_no_chunks():
+    assert plan_speech_chunks([], target_seconds=60) == []
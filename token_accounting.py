@@ -0,0 +1,42 @@
+"""リクエストのトークン数を見積もり、工程ごとの使用量を記録するモジュール
+
+実際の入出力のトークン数は、応答のusage_metadataから受け取ります（count_tokensは呼びません）。
+"""
+import threading
+
+from api_key_pool import estimate_text_tokens
+
+
+def estimate_prompt_tokens(instructions, text):
+    """指示文と本文の入力トークン数を見積もる関数（キーの利用枠の予約に使います）"""
+    return estimate_text_tokens(instructions) + estimate_text_tokens(text)
+
+
+def usage_from(response):
+    """応答のusage_metadataから (入力トークン数, 出力トークン数) を取り出す関数"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return 0, 0
+    return getattr(usage, 'prompt_token_count', 0) or 0, getattr(usage, 'candidates_token_count', 0) or 0
+
+
+class TokenLedger:
+    """工程ごとのトークン使用量（見積もりと実際の入出力）を集計する台帳"""
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, estimated=0, prompt_tokens=0, output_tokens=0):
+        """1回のリクエストのトークン数を記録する（estimatedはキーの予約に使った見積もり）"""
+        with self._lock:
+            totals = self._stages.setdefault(stage, {'requests': 0, 'estimated': 0, 'prompt': 0, 'output': 0})
+            totals['requests'] += 1
+            totals['estimated'] += estimated
+            totals['prompt'] += prompt_tokens
+            totals['output'] += output_tokens
+
+    def snapshot(self):
+        """工程ごとの集計のコピーを返す"""
+        with self._lock:
+            return {stage: dict(totals) for stage, totals in self._stages.items()}
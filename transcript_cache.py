@@ -0,0 +1,108 @@
+"""チャンクの音声内容をキーにして文字起こし結果を保存するディスクキャッシュのモジュール"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+# 何回書き込むごとに古いエントリの削除を行うか
+EVICT_EVERY = 50
+
+
+class TranscriptCache:
+    """音声データ・プロンプト・モデル名のハッシュをキーに文字起こし結果を保存するキャッシュ
+
+    エントリは1件1ファイルで保存し、更新時刻を最終利用時刻として使います。
+    古いものから削除して、合計サイズと保存期間の上限を守ります。
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(audio_data, prompt, model_name):
+        """音声データ・プロンプト・モデル名からキャッシュのキーを作る"""
+        return TranscriptCache.make_key_from_digest(hashlib.sha256(audio_data).digest(), prompt, model_name)
+
+    @staticmethod
+    def make_key_from_digest(audio_digest, prompt, model_name):
+        """音声データのSHA-256・プロンプト・モデル名からキャッシュのキーを作る"""
+        digest = hashlib.sha256()
+        # 区切りが曖昧にならないよう、各要素のハッシュをつなげます
+        digest.update(hashlib.sha256(model_name.encode('utf-8')).digest())
+        digest.update(hashlib.sha256((prompt or '').encode('utf-8')).digest())
+        digest.update(audio_digest)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.txt")
+
+    def get(self, key):
+        """キーに対応する文字起こし結果を返す（なければNone）"""
+        path = self._path(key)
+        try:
+            if self.max_age_seconds and time.time() - os.path.getmtime(path) > self.max_age_seconds:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            os.utime(path)  # 最近使ったエントリとして残りやすくします
+            return text
+        except OSError:
+            return None
+
+    def put(self, key, text):
+        """文字起こし結果を保存する（書き込み途中のファイルを読まれないよう、一時ファイルから置き換えます）"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self._lock:
+            self._puts += 1
+            should_evict = self._puts % EVICT_EVERY == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """保存期間を過ぎたエントリと、合計サイズの上限を超えた分の古いエントリを削除する"""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if not name.endswith('.txt'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for mtime, size, path in sorted(entries):
+                expired = self.max_age_seconds and now - mtime > self.max_age_seconds
+                if not expired and (not self.max_bytes or total <= self.max_bytes):
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            return removed
@@ -0,0 +1,106 @@
+"""重なりを持たせて分割したチャンクの文字起こし結果を、重複なくつなぎ合わせるモジュール
+
+日本語には単語の区切りがないので、文字単位のn-gramで前のチャンクの末尾と次のチャンクの先頭を
+照合します。一致したn-gramの位置の差（対角線）を投票で数え、最も票の多いずれ幅で2つを重ね合わせ、
+重なりの中央で切り替えます。1つの継ぎ目あたりの計算量は照合する範囲の長さに比例します。
+"""
+import unicodedata
+from collections import Counter, defaultdict
+
+# 照合に使う文字n-gramの長さ
+NGRAM_SIZE = 4
+# 重なりとみなすのに必要な一致するn-gramの数
+MIN_MATCHES = 3
+# 照合する範囲の上限（文字数）
+MAX_WINDOW = 3000
+# 表記ゆれや聞き取りの差で生じるずれをどこまで同じ対角線とみなすか
+DIAGONAL_TOLERANCE = 3
+
+
+def normalize(text):
+    """照合用に空白と句読点を取り除いた文字列と、元の文字列での位置の対応を返す関数"""
+    chars = []
+    positions = []
+    for index, char in enumerate(text):
+        category = unicodedata.category(char)
+        if char.isspace() or category.startswith('P'):
+            continue
+        chars.append(char)
+        positions.append(index)
+    return ''.join(chars), positions
+
+
+def find_seam(previous, following, window):
+    """2つの文字起こし結果の切り替え位置を探す関数
+
+    (前の結果を切る位置, 次の結果を使い始める位置) を返します。重なりが見つからなければNoneを返します。
+    """
+    prev_norm, prev_positions = normalize(previous[-window:])
+    next_norm, next_positions = normalize(following[:window])
+    if len(prev_norm) < NGRAM_SIZE or len(next_norm) < NGRAM_SIZE:
+        return None
+
+    # 前の結果の末尾にあるn-gramの位置を索引にします
+    grams = defaultdict(list)
+    for i in range(len(prev_norm) - NGRAM_SIZE + 1):
+        grams[prev_norm[i:i + NGRAM_SIZE]].append(i)
+
+    # 次の結果の先頭のn-gramと一致した位置の差（対角線）ごとに票を数えます
+    matches = []
+    votes = Counter()
+    for j in range(len(next_norm) - NGRAM_SIZE + 1):
+        for i in grams.get(next_norm[j:j + NGRAM_SIZE], ()):
+            matches.append((i, j))
+            votes[i - j] += 1
+    if not votes:
+        return None
+
+    # 近い対角線の票もまとめて数え、多少の挿入・脱落があっても同じ重なりとみなします
+    def band_votes(diagonal):
+        return sum(votes.get(diagonal + d, 0) for d in range(-DIAGONAL_TOLERANCE, DIAGONAL_TOLERANCE + 1))
+
+    best = max(votes, key=lambda diagonal: (band_votes(diagonal), votes[diagonal]))
+    aligned = [(i, j) for i, j in matches if abs(i - j - best) <= DIAGONAL_TOLERANCE]
+    if len(aligned) < MIN_MATCHES:
+        return None
+
+    # 重なりの中央で切り替えます（チャンクの端は言葉が途中で切れていることが多いためです）
+    i, j = aligned[len(aligned) // 2]
+    cut_previous = len(previous) - len(previous[-window:]) + prev_positions[i]
+    start_following = next_positions[j]
+    return cut_previous, start_following
+
+
+def stitch_transcripts(transcripts, chunks=None):
+    """チャンクごとの文字起こし結果を、継ぎ目の重複を取り除いて1つにつなげる関数
+
+    transcriptsはチャンク順のリスト（失敗したチャンクはNone）、chunksは分割計画です。
+    分割計画があれば、重なりの長さに合わせて照合する範囲を決めます。
+    """
+    combined = ''
+    previous = None
+    for index, text in enumerate(transcripts):
+        if not text:
+            # 失敗したチャンクの前後はつなぎ合わせられないので、そのまま区切ります
+            previous = None
+            continue
+        separator = "\n" if combined else ''
+        if chunks is not None and chunks[index].overlap <= 0:
+            # 無音の位置で区切ったチャンクは重なっていないので、照合せずに区切ります
+            previous = None
+        if previous is not None:
+            window = MAX_WINDOW
+            if chunks is not None and chunks[index - 1].duration > 0:
+                # 重なりの割合の2倍程度の範囲を照合します
+                ratio = chunks[index].overlap / chunks[index - 1].duration
+                window = min(MAX_WINDOW, int(len(previous) * ratio * 2) + 50)
+            seam = find_seam(previous, text, window)
+            if seam is not None:
+                # 重なりの中で切り替えるので、区切りを入れずにそのままつなげます
+                cut_previous, start_following = seam
+                combined = combined[:len(combined) - len(previous) + cut_previous]
+                text = text[start_following:]
+                separator = ''
+        combined += separator + text
+        previous = text
+    return combined
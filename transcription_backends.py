@@ -0,0 +1,172 @@
+"""文字起こしの方式（バックエンド）を切り替えるためのモジュール
+
+Gemini以外に、ネットワークを使わずCPUだけで動くWhisper系のモデル（faster-whisper、int8）を
+プロセスプールで動かすバックエンドを用意しています。faster-whisperは必要なときだけ読み込むので、
+インストールしていなければGeminiだけで動きます。
+"""
+import abc
+import asyncio
+import concurrent.futures
+import importlib.util
+import io
+import logging
+import os
+import threading
+
+# ローカルのバックエンドの既定値
+DEFAULT_LOCAL_MODEL = 'small'
+DEFAULT_COMPUTE_TYPE = 'int8'
+DEFAULT_THREADS_PER_WORKER = 2
+
+
+class TranscriptionBackend(abc.ABC):
+    """文字起こしのバックエンドの共通の形
+
+    transcribe(audio_part, chunk) はチャンク1つを文字起こしして、テキスト（失敗したらNone）を返します。
+    transcribe_async はその非同期版で、既定ではtranscribeをスレッドで実行します。
+    max_workers は同時に処理できるチャンクの数です。
+    """
+
+    name = 'base'
+    max_workers = 1
+
+    @abc.abstractmethod
+    def transcribe(self, audio_part, chunk):
+        """チャンク1つを文字起こしして、テキスト（失敗したらNone）を返す"""
+
+    async def transcribe_async(self, audio_part, chunk):
+        return await asyncio.to_thread(self.transcribe, audio_part, chunk)
+
+    def close(self):
+        pass
+
+
+class CallableBackend(TranscriptionBackend):
+    """transcribe_func(audio_part, chunk) を呼ぶだけのバックエンド（Geminiなど、呼び出し側で実装するもの）
+
+    async_funcを渡すと、非同期で呼ばれたときはスレッドを使わずにそちらを待ちます。
+    """
+
+    def __init__(self, name, transcribe_func, max_workers, async_func=None):
+        self.name = name
+        self.transcribe_func = transcribe_func
+        self.async_func = async_func
+        self.max_workers = max_workers
+
+    def transcribe(self, audio_part, chunk):
+        return self.transcribe_func(audio_part, chunk)
+
+    async def transcribe_async(self, audio_part, chunk):
+        if self.async_func is None:
+            return await super().transcribe_async(audio_part, chunk)
+        return await self.async_func(audio_part, chunk)
+
+
+class FallbackBackend(TranscriptionBackend):
+    """primaryで失敗したチャンクだけをsecondaryで文字起こしするバックエンド
+
+    Geminiの利用枠を使い切ったときに、ローカルのモデルへ引き継ぐために使います。
+    """
+
+    def __init__(self, primary, secondary):
+        self.primary = primary
+        self.secondary = secondary
+        self.name = f"{primary.name}+{secondary.name}"
+        self.max_workers = primary.max_workers
+
+    def transcribe(self, audio_part, chunk):
+        text = self.primary.transcribe(audio_part, chunk)
+        if text:
+            return text
+        logging.info(f"{audio_part}を{self.secondary.name}で文字起こしします。")
+        return self.secondary.transcribe(audio_part, chunk)
+
+    async def transcribe_async(self, audio_part, chunk):
+        text = await self.primary.transcribe_async(audio_part, chunk)
+        if text:
+            return text
+        logging.info(f"{audio_part}を{self.secondary.name}で文字起こしします。")
+        return await self.secondary.transcribe_async(audio_part, chunk)
+
+
+# ワーカープロセスごとに1度だけ読み込むモデル
+_worker_model = None
+
+
+def _init_worker(model_size, compute_type, cpu_threads, download_root):
+    global _worker_model
+    from faster_whisper import WhisperModel
+    _worker_model = WhisperModel(model_size, device='cpu', compute_type=compute_type,
+                                 cpu_threads=cpu_threads, download_root=download_root)
+
+
+def _transcribe_in_worker(source, language, beam_size):
+    """ワーカープロセスで1チャンクを文字起こしする（sourceはファイルのパスか音声データ）"""
+    audio = io.BytesIO(source) if isinstance(source, bytes) else source
+    segments, _ = _worker_model.transcribe(audio, language=language, beam_size=beam_size, vad_filter=True)
+    # 日本語なので、区間の間に空白は入れずにつなげます
+    return "".join(segment.text.strip() for segment in segments)
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """faster-whisperのモデルをCPUのプロセスプールで動かすバックエンド
+
+    音声はこのPCの外に出ないので、社外秘の録音にも使えます。処理時間はCPUのコア数だけで決まり、
+    APIの利用制限を受けません。Geminiと違ってプロンプトの指示（相槌の削除など）は使えません。
+    """
+
+    name = 'local'
+
+    def __init__(self, model_size=DEFAULT_LOCAL_MODEL, compute_type=DEFAULT_COMPUTE_TYPE, workers=0,
+                 threads_per_worker=DEFAULT_THREADS_PER_WORKER, language='ja', beam_size=1, download_root=None):
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.language = language
+        self.beam_size = beam_size
+        self.threads_per_worker = threads_per_worker
+        self.download_root = download_root
+        # 指定がなければ、1プロセスあたりのスレッド数でコア数を割った数だけプロセスを起動します
+        self.max_workers = workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+        self.model_tag = f"faster-whisper/{model_size}/{compute_type}"
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        """faster-whisperがインストールされているかどうか"""
+        return importlib.util.find_spec('faster_whisper') is not None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                logging.info(f"ローカルの文字起こしモデル（{self.model_tag}）を{self.max_workers}プロセスで起動します。")
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=_init_worker,
+                    initargs=(self.model_size, self.compute_type, self.threads_per_worker, self.download_root),
+                )
+            return self._executor
+
+    def transcribe_source(self, source):
+        """ファイルのパスか音声データを文字起こしする（失敗したら例外を送出します）"""
+        future = self._get_executor().submit(_transcribe_in_worker, source, self.language, self.beam_size)
+        return future.result()
+
+    async def transcribe_source_async(self, source):
+        """transcribe_sourceの非同期版（キャンセルされたら、まだ始まっていない処理を取り消します）"""
+        future = self._get_executor().submit(_transcribe_in_worker, source, self.language, self.beam_size)
+        return await asyncio.wrap_future(future)
+
+    def transcribe(self, audio_part, chunk):
+        source = audio_part.read() if hasattr(audio_part, 'read') else str(audio_part)
+        try:
+            return self.transcribe_source(source) or None
+        except Exception as e:
+            logging.error(f"ローカルでの文字起こしに失敗しました: {audio_part} - {str(e)}")
+            return None
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,171 @@
+"""音声の中の発話区間を検出し（VAD）、無音の位置でチャンクを区切る分割計画を立てるモジュール
+
+音声をffmpegで低いサンプリングレートのPCMにデコードしながら、フレームごとに人の声の帯域の
+エネルギーを求めます。会議の開始待ちや休憩のような長い無音は分割計画から外し、
+チャンクの境界はできるだけ無音の中に置くので、言葉の途中で切れることが減ります。
+"""
+import subprocess
+
+import numpy as np
+
+from audio_chunks import AudioChunk, DEFAULT_OVERLAP_RATIO, MAX_OVERLAP_SECONDS
+
+# 検出に使うサンプリングレート（Hz）とフレームの長さ（秒）
+ANALYSIS_SAMPLE_RATE = 8000
+FRAME_SECONDS = 0.03
+# 人の声の主な帯域（Hz）
+SPEECH_BAND = (300, 3400)
+# 一度にデコードして解析するフレーム数
+FRAMES_PER_BLOCK = 2000
+
+# 雑音の大きさ（下位の百分位）より何dB大きければ発話とみなすか
+DEFAULT_MARGIN_DB = 12.0
+# これより小さい音は、雑音の大きさに関係なく無音とみなします（dBFS）
+MIN_SPEECH_DB = -60.0
+# これより短い発話は雑音とみなし、これより短い無音は発話の一部とみなします（秒）
+DEFAULT_MIN_SPEECH_SECONDS = 0.25
+DEFAULT_MIN_SILENCE_SECONDS = 0.5
+# 発話区間の前後に残す余白（秒）
+DEFAULT_PADDING_SECONDS = 0.2
+# これより長い無音は文字起こしに送りません（秒）
+DEFAULT_DROP_SILENCE_SECONDS = 20.0
+
+
+def decode_command(ffmpeg_path, source_path, sample_rate=ANALYSIS_SAMPLE_RATE):
+    """音声をモノラル・16bitのPCMで標準出力に書き出すffmpegのコマンドを返す関数"""
+    return [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-i', source_path,
+            '-vn', '-ac', '1', '-ar', str(sample_rate), '-f', 's16le', '-']
+
+
+def band_levels(samples, sample_rate=ANALYSIS_SAMPLE_RATE, band=SPEECH_BAND):
+    """フレームごとのサンプル（フレーム数×サンプル数の配列）から、声の帯域のエネルギー（dB）を求める関数"""
+    frame_length = samples.shape[1]
+    spectrum = np.abs(np.fft.rfft(samples * np.hanning(frame_length), axis=1)) ** 2
+    frequencies = np.fft.rfftfreq(frame_length, 1.0 / sample_rate)
+    in_band = (frequencies >= band[0]) & (frequencies <= band[1])
+    power = spectrum[:, in_band].sum(axis=1) / (frame_length * frame_length)
+    return 10.0 * np.log10(power + 1e-12)
+
+
+def frame_levels(ffmpeg_path, source_path, sample_rate=ANALYSIS_SAMPLE_RATE, frame_seconds=FRAME_SECONDS):
+    """音声をデコードしながら、フレームごとの声の帯域のエネルギー（dB）を配列で返す関数
+
+    デコードした音声全体はメモリに持たず、一定のフレーム数ずつ解析します。
+    """
+    frame_length = int(sample_rate * frame_seconds)
+    block_bytes = frame_length * FRAMES_PER_BLOCK * 2
+    levels = []
+    process = subprocess.Popen(decode_command(ffmpeg_path, source_path, sample_rate),
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        remainder = b''
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            data = remainder + data
+            usable = len(data) - len(data) % (frame_length * 2)
+            remainder = data[usable:]
+            if usable:
+                samples = np.frombuffer(data[:usable], dtype='<i2').astype(np.float32) / 32768.0
+                levels.append(band_levels(samples.reshape(-1, frame_length), sample_rate))
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read().decode('utf-8', errors='replace')
+        process.stderr.close()
+        process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"音声のデコードに失敗しました: {stderr.strip()}")
+    return np.concatenate(levels) if levels else np.zeros(0)
+
+
+def speech_threshold(levels, margin_db=DEFAULT_MARGIN_DB):
+    """雑音の大きさから、発話とみなすエネルギーのしきい値（dB）を決める関数"""
+    noise_floor = np.percentile(levels, 10)
+    loud = np.percentile(levels, 95)
+    # 無音がほとんどない録音でも発話を取りこぼさないよう、大きな音より十分低い値に抑えます
+    return max(MIN_SPEECH_DB, min(noise_floor + margin_db, loud - 2 * margin_db))
+
+
+def speech_regions(levels, frame_seconds=FRAME_SECONDS, threshold_db=None,
+                   min_speech_seconds=DEFAULT_MIN_SPEECH_SECONDS, min_silence_seconds=DEFAULT_MIN_SILENCE_SECONDS,
+                   padding_seconds=DEFAULT_PADDING_SECONDS):
+    """フレームごとのエネルギーから、発話区間 (開始秒, 終了秒) のリストを返す関数"""
+    if len(levels) == 0:
+        return []
+    if threshold_db is None:
+        threshold_db = speech_threshold(levels)
+    voiced = np.concatenate(([False], levels > threshold_db, [False]))
+    edges = np.flatnonzero(np.diff(voiced.astype(np.int8)))
+    starts = edges[0::2] * frame_seconds
+    ends = edges[1::2] * frame_seconds
+
+    regions = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        # 短い無音をはさんだ発話は1つの区間にまとめます
+        if regions and start - regions[-1][1] < min_silence_seconds:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    duration = len(levels) * frame_seconds
+    return [(max(0.0, start - padding_seconds), min(duration, end + padding_seconds))
+            for start, end in regions if end - start >= min_speech_seconds]
+
+
+def detect_speech(ffmpeg_path, source_path, **options):
+    """音声ファイルの発話区間と、解析した長さ（秒）を返す関数"""
+    levels = frame_levels(ffmpeg_path, source_path)
+    return speech_regions(levels, **options), len(levels) * FRAME_SECONDS
+
+
+def _islands(regions, drop_silence_seconds):
+    """長い無音で区切られた、ひとまとまりの発話区間のリストを返す"""
+    islands = []
+    for start, end in regions:
+        if islands and start - islands[-1][-1][1] < drop_silence_seconds:
+            islands[-1].append((start, end))
+        else:
+            islands.append([(start, end)])
+    return islands
+
+
+def plan_speech_chunks(regions, target_seconds, drop_silence_seconds=DEFAULT_DROP_SILENCE_SECONDS,
+                       overlap_ratio=DEFAULT_OVERLAP_RATIO):
+    """発話区間をもとに、無音の位置で区切る分割計画を立てる関数
+
+    drop_silence_seconds より長い無音はどのチャンクにも含めません。
+    チャンクが target_seconds を超えそうなときは、後半にある一番長い無音の中で区切ります。
+    区切れる無音がなければ従来どおり決まった位置で切り、前のチャンクと重ねて継ぎ目をつなげます。
+    """
+    chunks = []
+
+    def add(start, end, overlap):
+        chunks.append(AudioChunk(len(chunks), start, end, overlap))
+
+    for island in _islands(regions, drop_silence_seconds):
+        # 発話と発話の間の無音（開始秒, 終了秒）
+        gaps = [(previous[1], following[0]) for previous, following in zip(island, island[1:])]
+        start, end = island[0][0], island[-1][1]
+        overlap = 0.0
+        while end - start > target_seconds:
+            candidates = [gap for gap in gaps
+                          if start + target_seconds * 0.5 <= (gap[0] + gap[1]) / 2 <= start + target_seconds]
+            if candidates:
+                gap = max(candidates, key=lambda g: (g[1] - g[0], g[0]))
+                cut = (gap[0] + gap[1]) / 2
+                add(start, cut, overlap)
+                start, overlap = cut, 0.0
+            else:
+                cut = start + target_seconds
+                add(start, cut, overlap)
+                overlap = min(target_seconds * overlap_ratio, MAX_OVERLAP_SECONDS)
+                start = cut - overlap
+        add(start, end, overlap)
+    return chunks
+
+
+def speech_seconds(chunks):
+    """分割計画のうち、文字起こしに送る秒数（重なりは除く）を返す関数"""
+    return sum(chunk.duration - chunk.overlap for chunk in chunks)
+
@@ -0,0 +1,48 @@
+"""抽出結果のExcelファイルで使う名前付きスタイルのモジュール
+
+セルごとにFont・PatternFill・Borderを作らず、ワークブックに名前付きスタイルを1度だけ登録して
+セルにはその名前を指定します。書き込み専用モード（write_only）のワークブックでも使えます。
+"""
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+
+LABEL_STYLE = 'minutes_label'  # 項目名（太字・灰色の背景）
+CONTENT_STYLE = 'minutes_content'  # 内容（折り返して表示）
+HEADER_STYLE = 'minutes_header'  # 一覧の見出し行
+
+LABEL_FILL_COLOR = "E0E0E0"
+HEADER_FILL_COLOR = "C0C0C0"
+
+
+def _thin_border():
+    thin = Side(style='thin')
+    return Border(left=thin, right=thin, top=thin, bottom=thin)
+
+
+def register_styles(wb):
+    """ワークブックに名前付きスタイルを登録する関数"""
+    wb.add_named_style(NamedStyle(
+        name=LABEL_STYLE,
+        font=Font(bold=True),
+        fill=PatternFill(start_color=LABEL_FILL_COLOR, end_color=LABEL_FILL_COLOR, fill_type="solid"),
+        border=_thin_border(),
+    ))
+    wb.add_named_style(NamedStyle(
+        name=CONTENT_STYLE,
+        border=_thin_border(),
+        alignment=Alignment(wrap_text=True),
+    ))
+    wb.add_named_style(NamedStyle(
+        name=HEADER_STYLE,
+        font=Font(bold=True),
+        fill=PatternFill(start_color=HEADER_FILL_COLOR, end_color=HEADER_FILL_COLOR, fill_type="solid"),
+        border=_thin_border(),
+        alignment=Alignment(horizontal='center'),
+    ))
+
+
+def styled_cell(ws, value, style):
+    """書き込み専用のシートに追加する、名前付きスタイル付きのセルを返す関数"""
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell